@@ -0,0 +1,56 @@
+"""
+Микробенчмарк фильтра по радиусу: старый построчный цикл haversine
+против distance.within_radius (NumPy и чистый Python).
+
+    python bench/bench_distance.py [--radius 5] [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import distance  # noqa: E402
+from geo import haversine_km  # noqa: E402
+
+
+def loop_filter(lat, lon, lats, lons, radius_km):
+    return [i for i, (a, b) in enumerate(zip(lats, lons))
+            if haversine_km(lat, lon, a, b) <= radius_km]
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - t0, res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--radius", type=float, default=5.0)
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    args = ap.parse_args()
+
+    rnd = random.Random(42)
+    lat0, lon0 = 55.75, 37.62
+    print(f"numpy: {'yes' if distance.np is not None else 'no'}, radius={args.radius} km")
+    print(f"{'points':>9} {'loop, ms':>10} {'py, ms':>10} {'numpy, ms':>10} {'hits':>7}")
+    for n in (int(x) for x in args.sizes.split(",")):
+        # Город ~100x100 км вокруг точки запроса
+        lats = [lat0 + rnd.uniform(-0.5, 0.5) for _ in range(n)]
+        lons = [lon0 + rnd.uniform(-0.8, 0.8) for _ in range(n)]
+
+        t_loop, ref = timed(loop_filter, lat0, lon0, lats, lons, args.radius)
+        t_py, res_py = timed(distance._within_radius_py, lat0, lon0, lats, lons, args.radius)
+        assert res_py == ref
+        t_np = float("nan")
+        if distance.np is not None:
+            t_np, res_np = timed(distance.within_radius, lat0, lon0, lats, lons, args.radius)
+            assert res_np == ref
+        print(f"{n:>9} {t_loop * 1e3:>10.1f} {t_py * 1e3:>10.1f} {t_np * 1e3:>10.1f} {len(ref):>7}")
+
+
+if __name__ == "__main__":
+    main()
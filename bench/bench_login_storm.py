@@ -0,0 +1,104 @@
+"""
+Задержка /sync во время шторма логинов: хеширование паролей в потоке
+запроса (PASSWORD_WORKERS=0) против пула процессов.
+
+    DATABASE_URL=postgresql://... python bench/bench_login_storm.py [--storm 8] [--seconds 5]
+
+Один поток непрерывно шлёт /sync, --storm потоков одновременно логинятся.
+Всё в одном процессе через Flask test client — как запросы в потоках
+одного воркера (gthread): пока хеш считается в потоке запроса, GIL занят
+и /sync ждёт. Без DATABASE_URL используется временная SQLite-база.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(app, passwords, workers, storm, seconds):
+    passwords.workers = workers
+    if workers:
+        passwords.hash("warmup")     # запуск процессов пула — не в замер
+    c = app.test_client()
+    token = c.post("/login", json={"username": "sync", "password": "pw"}).json["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+    body = {"lat": 55.75, "lon": 37.62}
+
+    stop = threading.Event()
+    logins = [0]
+    busy = [0]
+
+    def storm_loop(i):
+        cl = app.test_client()
+        while not stop.is_set():
+            r = cl.post("/login", json={"username": f"storm{i}", "password": "pw"})
+            if r.status_code == 503:
+                busy[0] += 1
+            logins[0] += 1
+
+    def measure(duration):
+        times = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            t0 = time.perf_counter()
+            c.post("/sync", json=body, headers=h)
+            times.append((time.perf_counter() - t0) * 1000)
+            time.sleep(0.01)
+        return times
+
+    idle = measure(min(2.0, seconds))
+    threads = [threading.Thread(target=storm_loop, args=(i,), daemon=True) for i in range(storm)]
+    for t in threads:
+        t.start()
+    loaded = measure(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return idle, loaded, logins[0] / seconds, busy[0]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--storm", type=int, default=8, help="потоков, логинящихся параллельно")
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--workers", type=int, default=2, help="процессов в пуле хеширования")
+    args = ap.parse_args()
+
+    from main import app, db, passwords
+
+    app.config["ALLOW_NO_DEVICE"] = True
+    passwords.max_pending = 1000
+    with app.app_context():
+        db.create_all()
+    c = app.test_client()
+    for name in ["sync"] + [f"storm{i}" for i in range(args.storm)]:
+        c.post("/register", json={"username": name, "password": "pw"})
+
+    print(f"{'hashing':<16} {'/sync p50':>10} {'p95':>8} {'p99':>8} {'max':>8} {'logins/s':>9}")
+    for label, workers in (("inline", 0), (f"pool x{args.workers}", args.workers)):
+        idle, loaded, rate, busy = run(app, passwords, workers, args.storm, args.seconds)
+        if label == "inline":
+            print(f"{'idle':<16} {statistics.median(idle):>10.1f} {percentile(idle, 0.95):>8.1f} "
+                  f"{percentile(idle, 0.99):>8.1f} {max(idle):>8.1f} {'-':>9}")
+        print(f"{label:<16} {statistics.median(loaded):>10.1f} {percentile(loaded, 0.95):>8.1f} "
+              f"{percentile(loaded, 0.99):>8.1f} {max(loaded):>8.1f} {rate:>9.1f}"
+              + (f"  ({busy} x 503)" if busy else ""))
+    print(passwords.stats())
+    passwords.shutdown()
+
+
+if __name__ == "__main__":
+    main()
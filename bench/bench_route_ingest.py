@@ -0,0 +1,83 @@
+"""
+Пропускная способность загрузки трека: /add_route_point по одной точке
+против /add_route_points пачками (JSON и бинарный track_codec).
+
+    DATABASE_URL=sqlite:////tmp/bench.db python bench/bench_route_ingest.py [--points 7200] [--batch 600]
+
+Без DATABASE_URL используется временная SQLite-база. Запросы идут через
+Flask test client, поэтому цифры отражают стоимость обработчика и БД, без сети.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import track_codec  # noqa: E402
+from main import app, db  # noqa: E402
+
+
+def make_track(n, t0=1_700_000_000.0):
+    return [(55.75 + i * 1e-5, 37.62 + i * 2e-5, t0 + i) for i in range(n)]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--points", type=int, default=7200)
+    ap.add_argument("--batch", type=int, default=600)
+    args = ap.parse_args()
+
+    app.config["ALLOW_NO_DEVICE"] = True
+    with app.app_context():
+        db.create_all()
+    c = app.test_client()
+    c.post("/register", json={"username": "bench", "password": "pw"})
+    token = c.post("/login", json={"username": "bench", "password": "pw"}).json["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+    track = make_track(args.points)
+
+    def new_route():
+        return c.post("/create_route", json={"name": "bench"}, headers=h).json["route_id"]
+
+    results = []
+
+    rid = new_route()
+    t0 = time.perf_counter()
+    for lat, lon, _ in track:
+        c.post("/add_route_point", json={"route_id": rid, "lat": lat, "lon": lon}, headers=h)
+    results.append(("per-point JSON", args.points, time.perf_counter() - t0, 0))
+
+    rid = new_route()
+    t0 = time.perf_counter()
+    size = 0
+    for seq, i in enumerate(range(0, args.points, args.batch), 1):
+        body = {"route_id": rid, "seq": seq, "points": [
+            {"lat": lat, "lon": lon, "ts": ts} for lat, lon, ts in track[i:i + args.batch]]}
+        data = json.dumps(body).encode()
+        size += len(data)
+        c.post("/add_route_points", data=data, content_type="application/json", headers=h)
+    results.append((f"batch JSON x{args.batch}", args.points // args.batch, time.perf_counter() - t0, size))
+
+    rid = new_route()
+    t0 = time.perf_counter()
+    size = 0
+    for seq, i in enumerate(range(0, args.points, args.batch), 1):
+        data = track_codec.encode(track[i:i + args.batch])
+        size += len(data)
+        c.post(f"/add_route_points?route_id={rid}&seq={seq}", data=data,
+               content_type="application/octet-stream", headers=h)
+    results.append((f"batch binary x{args.batch}", args.points // args.batch, time.perf_counter() - t0, size))
+
+    print(f"{'mode':<22} {'requests':>8} {'sec':>8} {'points/s':>10} {'body bytes':>11}")
+    for name, reqs, sec, size in results:
+        print(f"{name:<22} {reqs:>8} {sec:>8.2f} {args.points / sec:>10.0f} {size or '-':>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Задержка /routes_near на большом числе маршрутов.
+
+    DATABASE_URL=postgresql://... python bench/bench_routes_near.py [--routes 100000] [--segments 1000]
+
+Маршруты — случайные блуждания в области ~2°x3°. В БД пишутся только строки
+routes (со статистикой) и route_cells: /routes_near не читает route_points,
+так что их количество (routes x segments) на время запроса не влияет и
+засевать их не нужно. Без DATABASE_URL используется временная SQLite-база.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo import track_cells  # noqa: E402
+from geometry import TrackStats  # noqa: E402
+from main import app, db, Route, RouteCell  # noqa: E402
+
+LAT0, LON0 = 55.0, 36.0
+
+
+def random_track(rnd, segments, step_deg=0.002):
+    lat = LAT0 + rnd.random() * 2.0
+    lon = LON0 + rnd.random() * 3.0
+    heading_lat, heading_lon = rnd.uniform(-1, 1), rnd.uniform(-1, 1)
+    pts = [(lat, lon)]
+    for _ in range(segments):
+        heading_lat += rnd.uniform(-0.3, 0.3)
+        heading_lon += rnd.uniform(-0.3, 0.3)
+        lat += max(-1, min(1, heading_lat)) * step_deg
+        lon += max(-1, min(1, heading_lon)) * step_deg
+        pts.append((lat, lon))
+    return pts
+
+
+def seed(n_routes, segments, batch=2000):
+    rnd = random.Random(42)
+    cell_deg = app.config["ROUTE_CELL_DEG"]
+    now = datetime.utcnow()
+    routes, cells, total_cells = [], [], 0
+    for i in range(n_routes):
+        pts = random_track(rnd, segments)
+        rid = str(uuid.uuid4())
+        stats = TrackStats()
+        for lat, lon in pts:
+            stats.add(lat, lon, now)
+        row = {"id": rid, "name": f"bench {i}", "owner": "bench", "created": now, "sealed": True}
+        row.update({name: getattr(stats, name) for name in TrackStats.FIELDS})
+        routes.append(row)
+        for r, c in track_cells(pts, cell_deg):
+            cells.append({"route_id": rid, "row": r, "col": c})
+        if len(routes) >= batch:
+            db.session.execute(Route.__table__.insert(), routes)
+            db.session.execute(RouteCell.__table__.insert(), cells)
+            db.session.commit()
+            total_cells += len(cells)
+            routes, cells = [], []
+            print(f"  seeded {i + 1} routes, {total_cells} cells", end="\r")
+    if routes:
+        db.session.execute(Route.__table__.insert(), routes)
+        db.session.execute(RouteCell.__table__.insert(), cells)
+        db.session.commit()
+        total_cells += len(cells)
+    print(f"  seeded {n_routes} routes, {total_cells} cells")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--routes", type=int, default=100000)
+    ap.add_argument("--segments", type=int, default=1000)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    app.config["ALLOW_NO_DEVICE"] = True
+    with app.app_context():
+        db.create_all()
+        if not Route.query.filter_by(owner="bench").first():
+            seed(args.routes, args.segments)
+    c = app.test_client()
+    c.post("/register", json={"username": "bench", "password": "pw"})
+    token = c.post("/login", json={"username": "bench", "password": "pw"}).json["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+
+    rnd = random.Random(7)
+    cases = [
+        ("radius 1 km", lambda la, lo: f"lat={la}&lon={lo}&radius_km=1&limit=50"),
+        ("radius 5 km", lambda la, lo: f"lat={la}&lon={lo}&radius_km=5&limit=50"),
+        ("bbox 0.05deg", lambda la, lo: f"bbox={la},{lo},{la + 0.05},{lo + 0.05}&limit=50"),
+        ("radius 50 km (bbox fallback)", lambda la, lo: f"lat={la}&lon={lo}&radius_km=50&limit=50"),
+    ]
+    print(f"{'query':<30} {'p50 ms':>8} {'p95 ms':>8} {'found':>8}")
+    for name, qs in cases:
+        times, found = [], []
+        for _ in range(args.queries):
+            la, lo = LAT0 + rnd.random() * 2.0, LON0 + rnd.random() * 3.0
+            t0 = time.perf_counter()
+            r = c.get("/routes_near?" + qs(round(la, 5), round(lo, 5)), headers=h)
+            times.append((time.perf_counter() - t0) * 1000)
+            found.append(r.json["total"])
+        times.sort()
+        print(f"{name:<30} {statistics.median(times):>8.1f} {times[int(len(times) * 0.95)]:>8.1f} "
+              f"{int(statistics.mean(found)):>8}")
+
+
+if __name__ == "__main__":
+    main()
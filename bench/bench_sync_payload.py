@@ -0,0 +1,133 @@
+"""
+Размер и стоимость сериализации ответа /sync: стандартный провайдер Flask
+против FastJSONProvider (stdlib json и orjson), без сжатия, gzip и brotli.
+
+    DATABASE_URL=postgresql://... python bench/bench_sync_payload.py [--users 200] [--messages 300]
+
+Засевается группа с историей сообщений, пользователи рядом, приватные
+сообщения и SOS — полный первый /sync. Сначала ответ снимается один раз
+и в цикле только сериализуется и сжимается (CPU на ответ, байты), затем
+тот же /sync целиком через test client. Без DATABASE_URL — временная SQLite.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.setdefault("UPLOAD_FOLDER", tempfile.mkdtemp())
+os.environ.setdefault("PASSWORD_WORKERS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta  # noqa: E402
+
+from flask import request  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_provider  # noqa: E402
+from json_provider import FastJSONProvider, compress_response  # noqa: E402
+from main import (app, db, Group, GroupMember, Message, PrivateMessage, Sos,  # noqa: E402
+                  User)
+
+LAT0, LON0 = 55.75, 37.62
+WORDS = "привет где вы встречаемся у входа через десять минут ok на месте иду жду".split()
+
+
+def seed(n_users, n_messages):
+    rnd = random.Random(1)
+    now = time.time()
+    t0 = datetime.utcnow() - timedelta(hours=2)
+    users = [f"user{i}" for i in range(n_users)]
+    db.session.bulk_insert_mappings(User, [
+        {"username": u, "password": "x", "lat": LAT0 + rnd.uniform(-0.02, 0.02),
+         "lon": LON0 + rnd.uniform(-0.02, 0.02), "last_seen": now} for u in users])
+    grp = Group(name="Поход выходного дня", lat=LAT0, lon=LON0, is_public=True)
+    db.session.add(grp)
+    db.session.flush()
+    db.session.add(GroupMember(user_id="bench", group_id=grp.id, joined_msg_id=0))
+    for u in users[:30]:
+        db.session.add(GroupMember(user_id=u, group_id=grp.id, joined_msg_id=0))
+    db.session.bulk_insert_mappings(Message, [
+        {"group_id": grp.id, "sender": rnd.choice(users[:30]),
+         "text": " ".join(rnd.choices(WORDS, k=rnd.randint(2, 12))),
+         "photo": None, "audio": None, "created_at": t0 + timedelta(seconds=10 * i)}
+        for i in range(n_messages)])
+    db.session.bulk_insert_mappings(PrivateMessage, [
+        {"from_user": users[i % 20], "to_user": "bench",
+         "text": " ".join(rnd.choices(WORDS, k=6)), "created_at": t0 + timedelta(seconds=i)}
+        for i in range(100)])
+    db.session.bulk_insert_mappings(Sos, [
+        {"username": users[i], "lat": LAT0 + rnd.uniform(-0.05, 0.05),
+         "lon": LON0 + rnd.uniform(-0.05, 0.05), "comment": "нужна помощь",
+         "status": "средняя", "photos": "", "active": True, "closed": False,
+         "created": t0 + timedelta(minutes=i)} for i in range(10)])
+    db.session.commit()
+    return grp.id
+
+
+def providers():
+    yield "flask default", DefaultJSONProvider(app), False
+    saved = json_provider.orjson
+    json_provider.orjson = None
+    yield "stdlib", FastJSONProvider(app), True
+    json_provider.orjson = saved
+    if saved is not None:
+        yield "orjson", FastJSONProvider(app), True
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--messages", type=int, default=300)
+    ap.add_argument("--iterations", type=int, default=300)
+    args = ap.parse_args()
+
+    app.config["ALLOW_NO_DEVICE"] = True
+    with app.app_context():
+        db.create_all()
+    c = app.test_client()
+    c.post("/register", json={"username": "bench", "password": "pw"})
+    token = c.post("/login", json={"username": "bench", "password": "pw"}).json["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+    with app.app_context():
+        gid = seed(args.users, args.messages)
+    body = {"lat": LAT0, "lon": LON0, "group_id": gid}
+    payload = c.post("/sync", json=body, headers=h).json
+    print(f"/sync: {len(payload['updated_users'])} users, {len(payload['new_messages'])} messages, "
+          f"{len(payload['private_messages'])} private, {len(payload['sos_alerts'])} sos\n")
+
+    encodings = ["identity", "gzip"] + (["br"] if json_provider.brotli is not None else [])
+    print(f"{'provider':<14} {'encoding':<9} {'bytes':>9} {'cpu us':>9}")
+    for name, provider, _ in providers():
+        saved, app.json = app.json, provider
+        for enc in encodings:
+            with app.test_request_context(headers={"Accept-Encoding": enc}):
+                resp = None
+                t0 = time.process_time()
+                for _ in range(args.iterations):
+                    resp = app.json.response(payload)
+                    resp = compress_response(resp, request.accept_encodings)
+                cpu = (time.process_time() - t0) / args.iterations * 1e6
+            print(f"{name:<14} {enc:<9} {len(resp.get_data()):>9} {cpu:>9.0f}")
+        app.json = saved
+
+    print(f"\n{'end-to-end':<24} {'bytes':>9} {'cpu ms/req':>11}")
+    n = max(20, args.iterations // 10)
+    for name, provider, compress in providers():
+        saved, app.json = app.json, provider
+        app.config["JSON_COMPRESS"] = compress
+        for enc in (["identity"] + encodings[-1:]) if compress else ["identity"]:
+            t0 = time.process_time()
+            for _ in range(n):
+                r = c.post("/sync", json=body, headers=dict(h, **{"Accept-Encoding": enc}))
+            cpu = (time.process_time() - t0) / n * 1000
+            print(f"{name + ' ' + enc:<24} {len(r.data):>9} {cpu:>11.2f}")
+        app.json = saved
+    app.config["JSON_COMPRESS"] = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Маленький потокобезопасный кэш с TTL и вытеснением по LRU.
+
+pop() меняет поколение ключа: запрос, который прочитал generation() до
+инвалидации и загрузил старые данные, не запишет их обратно через
+set(..., generation=...) после неё.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._gens = OrderedDict()   # key -> поколение, меняется при pop
+        self._gen_floor = 0          # поколение ключей, вытесненных из _gens
+        self._gen_seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            if item[0] < now:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def generation(self, key):
+        with self._lock:
+            return self._gens.get(key, self._gen_floor)
+
+    def set(self, key, value, generation=None):
+        """generation — из generation() до загрузки; если ключ с тех пор
+        инвалидировали, значение устарело и не сохраняется."""
+        with self._lock:
+            if generation is not None and self._gens.get(key, self._gen_floor) != generation:
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return True
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            # Поколения растут, и вытесняется самое старое: поднимая до него
+            # _gen_floor, вытеснение может лишь зря пропустить set, но не
+            # вернуть ключу поколение, прочитанное до pop
+            self._gens[key] = next(self._gen_seq)
+            self._gens.move_to_end(key)
+            while len(self._gens) > self.maxsize:
+                self._gen_floor = self._gens.popitem(last=False)[1]
+        return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._gens.clear()
+            self._gen_floor = next(self._gen_seq)
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,64 @@
+"""
+Пакетный расчёт расстояний для фильтрации по радиусу.
+
+Сначала дешёвый bbox-префильтр, затем haversine только для выживших точек.
+С NumPy всё считается векторно; без него — тот же алгоритм на чистом Python.
+"""
+import math
+
+from geo import EARTH_RADIUS_KM, haversine_km, radius_to_deg
+
+try:
+    import numpy as np
+except ImportError:  # NumPy опционален
+    np = None
+
+
+def bbox_mask(lat, lon, lats, lons, radius_km):
+    """Маска точек внутри bbox, описанного вокруг круга (учитывает переход через 180°)."""
+    dlat, dlon = radius_to_deg(lat, radius_km)
+    mask = np.abs(lats - lat) <= dlat
+    if dlon < 180.0:
+        dl = np.abs(lons - lon)
+        mask &= np.minimum(dl, 360.0 - dl) <= dlon
+    return mask
+
+
+def haversine_many(lat, lon, lats, lons):
+    """Расстояния (км) от точки до массивов lats/lons."""
+    if np is None:
+        return [haversine_km(lat, lon, a, b) for a, b in zip(lats, lons)]
+    lat1 = math.radians(lat)
+    lats_r = np.radians(np.asarray(lats, dtype=np.float64))
+    dlat = lats_r - lat1
+    dlon = np.radians(np.asarray(lons, dtype=np.float64) - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lats_r) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def within_radius(lat, lon, lats, lons, radius_km):
+    """Индексы точек (lats[i], lons[i]) не дальше radius_km от (lat, lon)."""
+    if np is None:
+        return _within_radius_py(lat, lon, lats, lons, radius_km)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    idx = np.flatnonzero(bbox_mask(lat, lon, lats, lons, radius_km))
+    if idx.size == 0:
+        return []
+    dist = haversine_many(lat, lon, lats[idx], lons[idx])
+    return idx[dist <= radius_km].tolist()
+
+
+def _within_radius_py(lat, lon, lats, lons, radius_km):
+    dlat, dlon = radius_to_deg(lat, radius_km)
+    out = []
+    for i, (a, b) in enumerate(zip(lats, lons)):
+        if abs(a - lat) > dlat:
+            continue
+        if dlon < 180.0:
+            dl = abs(b - lon)
+            if min(dl, 360.0 - dl) > dlon:
+                continue
+        if haversine_km(lat, lon, a, b) <= radius_km:
+            out.append(i)
+    return out
@@ -0,0 +1,148 @@
+"""
+Шина событий для push-канала (SSE / long-poll).
+
+События публикуются в топики ("user:<name>", "alert:<name>", "group:<id>",
+"sos", "pos:<r>:<c>") и получают сквозной порядковый номер seq. Подписчик читает всё, что новее
+его курсора, или ждёт без обращения к БД, пока не придёт что-то новое.
+
+InProcessBackend держит события в памяти процесса: его достаточно для
+одного воркера и для локальной проверки. Для нескольких воркеров нужен
+бэкенд с тем же интерфейсом поверх общего брокера (Redis pub/sub и т.п.).
+События старше max_age вытесняются, а опустевшие топики без подписчиков
+удаляются: гео-топики "pos:*" и топики пользователей иначе копятся вечно.
+"""
+import threading
+import time
+import uuid
+from collections import deque
+
+
+class InProcessBackend:
+    def __init__(self, maxlen=1000, max_age=600.0):
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self.epoch = uuid.uuid4().hex[:8]
+        self._seq = 0
+        self._topics = {}      # topic -> deque[event]
+        self._dropped = {}     # topic -> seq последнего вытесненного события
+        self._expired = 0      # seq последнего события удалённых топиков
+        self._waiters = {}     # topic -> {threading.Event}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + max_age
+
+    def publish(self, topic, event):
+        now = time.monotonic()
+        with self._lock:
+            self._seq += 1
+            event["seq"] = self._seq
+            event["ts"] = now
+            q = self._topics.get(topic)
+            if q is None:
+                q = self._topics[topic] = deque()
+            if len(q) >= self.maxlen:
+                self._dropped[topic] = q.popleft()["seq"]
+            q.append(event)
+            for w in self._waiters.get(topic, ()):
+                w.set()
+            if now >= self._next_sweep:
+                self._sweep(now)
+            return self._seq
+
+    def _sweep(self, now):
+        """Вытеснить старые события; удалить пустые топики без подписчиков."""
+        self._next_sweep = now + self.max_age / 10
+        cutoff = now - self.max_age
+        for topic in list(self._topics):
+            q = self._topics[topic]
+            while q and q[0]["ts"] < cutoff:
+                self._dropped[topic] = q.popleft()["seq"]
+            if not q and topic not in self._waiters:
+                del self._topics[topic]
+                # Разрыв по удалённому топику помним одним числом на всех:
+                # курсор старше него в любом случае старше max_age
+                self._expired = max(self._expired, self._dropped.pop(topic, 0))
+
+    def _collect(self, topics, since):
+        """(события новее since, был ли разрыв из-за вытеснения)."""
+        out, gap = [], False
+        for t in topics:
+            if self._dropped.get(t, self._expired) > since:
+                gap = True
+            q = self._topics.get(t)
+            if not q or q[-1]["seq"] <= since:
+                continue
+            for ev in reversed(q):
+                if ev["seq"] <= since:
+                    break
+                out.append(ev)
+        out.sort(key=lambda ev: ev["seq"])
+        return out, gap
+
+    def head(self):
+        return self._seq
+
+    def read(self, topics, since, timeout):
+        """
+        (события новее since, разрыв, head). Всё собирается под одной
+        блокировкой, поэтому в топиках нет событий новее since и не старше
+        head, кроме возвращённых: head — следующий курсор клиента.
+        """
+        with self._lock:
+            out, gap = self._collect(topics, since)
+            if out or gap or timeout <= 0:
+                return out, gap, self._seq
+            waiter = threading.Event()
+            for t in topics:
+                self._waiters.setdefault(t, set()).add(waiter)
+        try:
+            waiter.wait(timeout)
+        finally:
+            with self._lock:
+                for t in topics:
+                    ws = self._waiters.get(t)
+                    if ws is not None:
+                        ws.discard(waiter)
+                        if not ws:
+                            del self._waiters[t]
+                out, gap = self._collect(topics, since)
+                head = self._seq
+        return out, gap, head
+
+
+class EventBus:
+    """
+    Тонкая обёртка над бэкендом: формат событий и курсоров.
+    Курсор "<epoch>:<seq>" — чужая эпоха или вытесненные события дают reset=True,
+    и клиенту нужно один раз сделать полный /sync.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or InProcessBackend()
+
+    def publish(self, topic, etype, data, priority=0):
+        return self.backend.publish(topic, {"type": etype, "data": data, "priority": priority})
+
+    def cursor(self, seq):
+        return f"{self.backend.epoch}:{seq}"
+
+    def _parse(self, cursor):
+        if not cursor:
+            return None
+        epoch, _, seq = str(cursor).partition(":")
+        if epoch != self.backend.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def read(self, topics, cursor, timeout=0):
+        """Вернуть (events, new_cursor, reset). Без курсора — только новые события."""
+        since = self._parse(cursor)
+        reset = cursor is not None and since is None
+        if since is None:
+            since = self.backend.head()
+        events, gap, head = self.backend.read(topics, since, timeout)
+        # Курсор всегда сдвигается до head: и пустое ожидание, и reset
+        # "проходят" разрыв, иначе он сообщался бы на каждом чтении
+        new_seq = max(head, since)
+        # Срочные события (SOS рядом) — первыми, остальные в порядке seq
+        events.sort(key=lambda ev: -ev["priority"])
+        return events, self.cursor(new_seq), reset or gap
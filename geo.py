@@ -0,0 +1,263 @@
+"""
+Гео-хелперы: расстояние по сфере и сеточный индекс точек в памяти.
+
+GridIndex раскладывает точки по ячейкам сетки lat/lon фиксированного шага,
+поэтому запрос по радиусу смотрит только в соседние ячейки, а не во все
+записи. Индекс потокобезопасен и ничего не знает про Flask/БД.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG_LAT = EARTH_RADIUS_KM * math.pi / 180.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * \
+        math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def radius_to_deg(lat, radius_km):
+    """Полуразмеры bbox (в градусах), гарантированно покрывающего круг."""
+    dlat = radius_km / KM_PER_DEG_LAT
+    if abs(lat) + dlat >= 90:
+        return dlat, 180.0
+    cos_lat = math.cos(math.radians(abs(lat) + dlat))
+    return dlat, min(180.0, radius_km / (KM_PER_DEG_LAT * max(cos_lat, 1e-9)))
+
+
+def cell_of(lat, lon, cell_deg):
+    """Ячейка (row, col) сетки шага cell_deg; col нормализован по долготе."""
+    ncols = max(1, int(round(360.0 / cell_deg)))
+    return (int(math.floor(lat / cell_deg)),
+            int(math.floor((lon + 180.0) / cell_deg)) % ncols)
+
+
+def cells_around(lat, lon, radius_km, cell_deg):
+    """Все ячейки сетки, пересекающие bbox круга (lat, lon, radius_km)."""
+    ncols = max(1, int(round(360.0 / cell_deg)))
+    dlat, dlon = radius_to_deg(lat, radius_km)
+    r0 = int(math.floor((lat - dlat) / cell_deg))
+    r1 = int(math.floor((lat + dlat) / cell_deg))
+    if dlon >= 180.0:
+        cols = range(ncols)
+    else:
+        c0 = int(math.floor((lon - dlon + 180.0) / cell_deg))
+        c1 = int(math.floor((lon + dlon + 180.0) / cell_deg))
+        cols = sorted({c % ncols for c in range(c0, c1 + 1)})
+    return [(r, c) for r in range(r0, r1 + 1) for c in cols]
+
+
+def segment_cells(lat1, lon1, lat2, lon2, cell_deg):
+    """
+    Все ячейки сетки, через которые проходит отрезок (обход сетки по
+    Amanatides–Woo в координатах lat/lon). Отрезок через 180° идёт коротким путём.
+    """
+    ncols = max(1, int(round(360.0 / cell_deg)))
+    if lon2 - lon1 > 180.0:
+        lon2 -= 360.0
+    elif lon1 - lon2 > 180.0:
+        lon2 += 360.0
+    x0, y0 = (lon1 + 180.0) / cell_deg, lat1 / cell_deg
+    x1, y1 = (lon2 + 180.0) / cell_deg, lat2 / cell_deg
+    cx, cy = int(math.floor(x0)), int(math.floor(y0))
+    ex, ey = int(math.floor(x1)), int(math.floor(y1))
+    cells = {(cy, cx % ncols)}
+    dx, dy = x1 - x0, y1 - y0
+    step_x = 1 if dx > 0 else -1
+    step_y = 1 if dy > 0 else -1
+    t_max_x = ((cx + (step_x > 0)) - x0) / dx if dx else math.inf
+    t_max_y = ((cy + (step_y > 0)) - y0) / dy if dy else math.inf
+    t_dx = abs(1.0 / dx) if dx else math.inf
+    t_dy = abs(1.0 / dy) if dy else math.inf
+    for _ in range(abs(ex - cx) + abs(ey - cy)):
+        if t_max_x < t_max_y:
+            cx += step_x
+            t_max_x += t_dx
+        else:
+            cy += step_y
+            t_max_y += t_dy
+        cells.add((cy, cx % ncols))
+    return cells
+
+
+def track_cells(points, cell_deg):
+    """Ячейки, покрывающие ломаную [(lat, lon), ...]."""
+    cells = set()
+    prev = None
+    for lat, lon in points:
+        if prev is None:
+            cells.add(cell_of(lat, lon, cell_deg))
+        else:
+            cells |= segment_cells(prev[0], prev[1], lat, lon, cell_deg)
+        prev = (lat, lon)
+    return cells
+
+
+def cell_distance_km(lat, lon, cell, cell_deg):
+    """Расстояние от точки до ближайшей точки прямоугольника ячейки (0 — внутри)."""
+    row, col = cell
+    lat0 = row * cell_deg
+    lon0 = col * cell_deg - 180.0
+    near_lat = min(max(lat, lat0), lat0 + cell_deg)
+    # Долготу сравниваем по кратчайшей дуге
+    d = (lon - lon0 + 180.0) % 360.0 - 180.0
+    near_lon = lon0 + min(max(d, 0.0), cell_deg)
+    return haversine_km(lat, lon, near_lat, near_lon)
+
+
+def bbox_cells(min_lat, min_lon, max_lat, max_lon, cell_deg):
+    """Ячейки, пересекающие bbox; min_lon > max_lon — bbox через 180°."""
+    ncols = max(1, int(round(360.0 / cell_deg)))
+    r0 = int(math.floor(min_lat / cell_deg))
+    r1 = int(math.floor(max_lat / cell_deg))
+    c0 = int(math.floor((min_lon + 180.0) / cell_deg))
+    c1 = int(math.floor((max_lon + 180.0) / cell_deg))
+    if c1 < c0:
+        c1 += ncols
+    cols = sorted({c % ncols for c in range(c0, c1 + 1)})
+    return [(r, c) for r in range(r0, r1 + 1) for c in cols]
+
+
+class GridEntry:
+    __slots__ = ("key", "lat", "lon", "ts", "data", "cell", "version")
+
+    def __init__(self, key, lat, lon, ts, data, cell, version):
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.ts = ts
+        self.data = data
+        self.cell = cell
+        self.version = version
+
+
+class GridIndex:
+    """
+    Индекс key -> (lat, lon, ts, data) с разбиением на ячейки cell_deg°.
+    Если задан ttl (сек), записи старше now - ttl не возвращаются запросами
+    и вычищаются в expire(). Каждое изменение записи получает монотонный
+    номер version — по нему клиенту можно отдавать только дельту.
+    Сдвиг не больше move_eps° по обеим осям изменением не считается:
+    обновляется только ts (запись остаётся живой), version не растёт.
+    """
+
+    def __init__(self, cell_deg=0.05, ttl=None, move_eps=0.0):
+        self.cell_deg = float(cell_deg)
+        self.ttl = ttl
+        self.move_eps = float(move_eps)
+        self._cells = {}                 # (row, col) -> {key: GridEntry}
+        self._entries = OrderedDict()    # key -> GridEntry, по времени обновления
+        self._lock = threading.RLock()
+        self.version = 0
+
+    def _cell(self, lat, lon):
+        return cell_of(lat, lon, self.cell_deg)
+
+    def _is_live(self, entry, now):
+        return self.ttl is None or now - entry.ts <= self.ttl
+
+    def upsert(self, key, lat, lon, ts=None, data=None):
+        """
+        Добавить/переместить точку. Запись с тем же или более старым ts
+        игнорируется. Возвращает True, если изменились позиция или data
+        (и запись получила новую version).
+        """
+        if lat is None or lon is None:
+            return False
+        ts = time.time() if ts is None else ts
+        cell = self._cell(lat, lon)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                if old.ts >= ts:
+                    return False
+                if (abs(old.lat - lat) <= self.move_eps and abs(old.lon - lon) <= self.move_eps
+                        and old.data == data):
+                    # Стоит на месте — только продлеваем жизнь записи
+                    old.ts = ts
+                    self._entries.move_to_end(key)
+                    return False
+                if old.cell != cell:
+                    self._drop_from_cell(old)
+                else:
+                    self.version += 1
+                    old.lat, old.lon, old.ts, old.data = lat, lon, ts, data
+                    old.version = self.version
+                    self._entries.move_to_end(key)
+                    return True
+            self.version += 1
+            entry = GridEntry(key, lat, lon, ts, data, cell, self.version)
+            self._cells.setdefault(cell, {})[key] = entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            return True
+
+    def _drop_from_cell(self, entry):
+        bucket = self._cells.get(entry.cell)
+        if bucket is not None:
+            bucket.pop(entry.key, None)
+            if not bucket:
+                del self._cells[entry.cell]
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._drop_from_cell(entry)
+            return entry
+
+    def get(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or not self._is_live(entry, now):
+            return None
+        return entry
+
+    def expire(self, now=None):
+        """Выкинуть протухшие записи. Идём с головы (самые старые обновления)."""
+        if self.ttl is None:
+            return 0
+        now = time.time() if now is None else now
+        removed = 0
+        with self._lock:
+            while self._entries:
+                key, entry = next(iter(self._entries.items()))
+                if now - entry.ts <= self.ttl:
+                    break
+                self._entries.popitem(last=False)
+                self._drop_from_cell(entry)
+                removed += 1
+        return removed
+
+    def candidates(self, lat, lon, radius_km, now=None):
+        """Живые записи из ячеек, покрывающих круг (без точной проверки расстояния)."""
+        now = time.time() if now is None else now
+        out = []
+        with self._lock:
+            cells = self._cells
+            for cell in cells_around(lat, lon, radius_km, self.cell_deg):
+                bucket = cells.get(cell)
+                if bucket:
+                    out.extend(e for e in bucket.values() if self._is_live(e, now))
+        return out
+
+    def query_radius(self, lat, lon, radius_km, now=None):
+        return [
+            e for e in self.candidates(lat, lon, radius_km, now)
+            if haversine_km(lat, lon, e.lat, e.lon) <= radius_km
+        ]
+
+    def live(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return [e for e in self._entries.values() if self._is_live(e, now)]
+
+    def __len__(self):
+        return len(self._entries)
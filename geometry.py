@@ -0,0 +1,218 @@
+"""
+Упрощение треков для отдачи на карту с разной детализацией.
+
+Douglas–Peucker считается один раз на весь трек: каждой точке сохраняется
+её "значимость" — максимальный допуск (в метрах), при котором DP её ещё
+оставляет. После этого любой уровень детализации — просто фильтр
+significance > tolerance за O(n), без повторного прогона алгоритма.
+
+Расстояния считаются в локальной равнопромежуточной проекции вокруг
+средней широты трека: для треков в десятки-сотни км погрешность мала.
+
+TrackStats — агрегаты трека (число точек, длина, bbox, время начала/конца),
+которые можно досчитывать по мере поступления точек.
+"""
+import math
+
+from geo import KM_PER_DEG_LAT, haversine_km
+
+try:
+    import numpy as np
+except ImportError:  # NumPy опционален
+    np = None
+
+M_PER_DEG = KM_PER_DEG_LAT * 1000.0
+# Метров на пиксель на экваторе при zoom=0 (тайлы 256 px, Web Mercator)
+M_PER_PX_Z0 = 156543.03392
+MAX_ZOOM = 22
+
+
+def zoom_tolerance(zoom, lat, px=1.0):
+    """Допуск в метрах, соответствующий px пикселям на заданном zoom."""
+    zoom = min(max(float(zoom), 0.0), MAX_ZOOM)
+    return px * M_PER_PX_Z0 * math.cos(math.radians(lat)) / 2 ** zoom
+
+
+def _project(lats, lons):
+    lat0 = sum(lats) / len(lats)
+    kx = M_PER_DEG * math.cos(math.radians(lat0))
+    return [lon * kx for lon in lons], [lat * M_PER_DEG for lat in lats]
+
+
+def _farthest_py(xs, ys, a, b):
+    """(индекс, расстояние) самой удалённой от отрезка a-b точки между ними."""
+    ax, ay, bx, by = xs[a], ys[a], xs[b], ys[b]
+    dx, dy = bx - ax, by - ay
+    seg2 = dx * dx + dy * dy
+    best_i, best_d2 = a + 1, -1.0
+    for i in range(a + 1, b):
+        px, py = xs[i] - ax, ys[i] - ay
+        t = (px * dx + py * dy) / seg2 if seg2 else 0.0
+        t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+        ex, ey = px - t * dx, py - t * dy
+        d2 = ex * ex + ey * ey
+        if d2 > best_d2:
+            best_i, best_d2 = i, d2
+    return best_i, math.sqrt(best_d2)
+
+
+def _farthest_np(xs, ys, a, b):
+    ax, ay = xs[a], ys[a]
+    dx, dy = xs[b] - ax, ys[b] - ay
+    seg2 = dx * dx + dy * dy
+    px, py = xs[a + 1:b] - ax, ys[a + 1:b] - ay
+    if seg2:
+        t = np.clip((px * dx + py * dy) / seg2, 0.0, 1.0)
+        px, py = px - t * dx, py - t * dy
+    d2 = px * px + py * py
+    k = int(np.argmax(d2))
+    return a + 1 + k, math.sqrt(float(d2[k]))
+
+
+def dp_significance(lats, lons):
+    """
+    Значимость каждой точки для Douglas–Peucker. Концы трека — inf.
+    Значимость потомка ограничена значимостью предка, поэтому
+    filter(significance > t) даёт ровно результат DP с допуском t.
+    """
+    n = len(lats)
+    if n == 0:
+        return []
+    sig = [0.0] * n
+    sig[0] = sig[-1] = math.inf
+    if n < 3:
+        return sig
+    xs, ys = _project(lats, lons)
+    farthest = _farthest_py
+    if np is not None:
+        xs, ys = np.asarray(xs), np.asarray(ys)
+        farthest = _farthest_np
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        a, b, cap = stack.pop()
+        if b - a < 2:
+            continue
+        i, d = farthest(xs, ys, a, b)
+        s = d if d < cap else cap
+        sig[i] = s
+        stack.append((a, i, s))
+        stack.append((i, b, s))
+    return sig
+
+
+class SimplifiedTrack:
+    """Трек с предрасчитанной значимостью точек; level() — выборка для допуска."""
+
+    __slots__ = ("lats", "lons", "ts", "significance", "_ts_iso")
+
+    def __init__(self, lats, lons, ts):
+        self.lats = lats
+        self.lons = lons
+        self.ts = ts
+        self.significance = dp_significance(lats, lons)
+        self._ts_iso = None
+
+    def ts_iso(self):
+        """ts в isoformat; считается один раз на трек, дальше — из кэша LOD."""
+        if self._ts_iso is None:
+            self._ts_iso = [t.isoformat() for t in self.ts]
+        return self._ts_iso
+
+    def __len__(self):
+        return len(self.lats)
+
+    def level(self, tolerance_m):
+        """Индексы точек, оставшихся при допуске tolerance_m (<= 0 — все точки)."""
+        if tolerance_m <= 0:
+            return range(len(self.lats))
+        return [i for i, s in enumerate(self.significance) if s > tolerance_m]
+
+    def center_lat(self):
+        return (min(self.lats) + max(self.lats)) / 2 if self.lats else 0.0
+
+
+def _encode_value(v, out):
+    v = ~(v << 1) if v < 0 else v << 1
+    while v >= 0x20:
+        out.append(chr((0x20 | (v & 0x1F)) + 63))
+        v >>= 5
+    out.append(chr(v + 63))
+
+
+def encode_polyline(points, precision=5):
+    """Encoded Polyline Algorithm Format (Google) для [(lat, lon), ...]."""
+    factor = 10 ** precision
+    out = []
+    plat = plon = 0
+    for lat, lon in points:
+        ilat = int(round(lat * factor))
+        ilon = int(round(lon * factor))
+        _encode_value(ilat - plat, out)
+        _encode_value(ilon - plon, out)
+        plat, plon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(s, precision=5):
+    factor = 10 ** precision
+    points, pos, lat, lon = [], 0, 0, 0
+    while pos < len(s):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                b = ord(s[pos]) - 63
+                pos += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+class TrackStats:
+    """
+    Накопитель статистики трека. Точки подаются по возрастанию ts;
+    last_lat/last_lon — последняя точка, от неё считается следующий отрезок.
+    """
+
+    FIELDS = ("point_count", "distance_km", "min_lat", "max_lat", "min_lon", "max_lon",
+              "start_ts", "end_ts", "last_lat", "last_lon")
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            setattr(self, name, values.get(name))
+        self.point_count = self.point_count or 0
+        self.distance_km = self.distance_km or 0.0
+
+    @classmethod
+    def of(cls, obj):
+        """Снять текущие значения с объекта с теми же атрибутами (например, Route)."""
+        return cls(**{name: getattr(obj, name) for name in cls.FIELDS})
+
+    def add(self, lat, lon, ts):
+        if self.last_lat is not None:
+            self.distance_km += haversine_km(self.last_lat, self.last_lon, lat, lon)
+        if self.point_count:
+            self.min_lat = min(self.min_lat, lat)
+            self.max_lat = max(self.max_lat, lat)
+            self.min_lon = min(self.min_lon, lon)
+            self.max_lon = max(self.max_lon, lon)
+        else:
+            self.min_lat = self.max_lat = lat
+            self.min_lon = self.max_lon = lon
+        if ts is not None:
+            if self.start_ts is None or ts < self.start_ts:
+                self.start_ts = ts
+            if self.end_ts is None or ts > self.end_ts:
+                self.end_ts = ts
+        self.point_count += 1
+        self.last_lat, self.last_lon = lat, lon
+
+    def apply_to(self, obj):
+        for name in self.FIELDS:
+            setattr(obj, name, getattr(self, name))
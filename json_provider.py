@@ -0,0 +1,106 @@
+"""
+Сериализация ответов и сжатие больших JSON.
+
+FastJSONProvider — JSON-провайдер Flask: с orjson (если установлен)
+dumps/loads и jsonify идут через него и сразу дают байты, без
+промежуточной str; без orjson — стандартный json без сортировки ключей
+и без \\uXXXX-экранирования кириллицы (JSON_AS_ASCII).
+
+iso() — isoformat с мемоизацией: одни и те же created/created_at
+отдаются в каждом /sync и в каждой странице истории.
+
+compress_response() — gzip или brotli (если установлен пакет Brotli)
+по Accept-Encoding для ответов не меньше min_size байт. Потоковые ответы
+и уже сжатые не трогаются.
+"""
+import functools
+import gzip
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson опционален
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Brotli опционален, без него — только gzip
+    brotli = None
+
+COMPRESSIBLE = {"application/json", "text/plain", "text/csv", "application/geo+json"}
+
+
+@functools.lru_cache(maxsize=65536)
+def _iso(dt, offset):
+    return dt.isoformat()
+
+
+def iso(dt):
+    # Равные моменты с разными смещениями равны и как ключи — смещение в ключе
+    return _iso(dt, dt.utcoffset())
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.ensure_ascii = app.config.get("JSON_AS_ASCII", True)
+
+    def _orjson_option(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.dumps(obj, default=self.default, option=self._orjson_option()).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=self._orjson_option())
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def choose_encoding(accept_encodings):
+    """"br", "gzip" или None — по весам из Accept-Encoding."""
+    best, best_q = None, 0.0
+    for enc in (("br",) if brotli is not None else ()) + ("gzip",):
+        q = accept_encodings.quality(enc)
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+
+
+def compress_response(resp, accept_encodings, min_size=1024, gzip_level=6, brotli_quality=4):
+    if (resp.direct_passthrough or resp.is_streamed or resp.status_code != 200
+            or "Content-Encoding" in resp.headers or resp.mimetype not in COMPRESSIBLE):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    data = resp.get_data()
+    if len(data) < min_size:
+        return resp
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return resp
+    if encoding == "br":
+        data = brotli.compress(data, quality=brotli_quality)
+    else:
+        data = gzip.compress(data, compresslevel=gzip_level, mtime=0)
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    etag, weak = resp.get_etag()
+    if etag:
+        # Другое представление — другой ETag
+        resp.set_etag(f"{etag}-{encoding}", weak)
+    return resp
@@ -0,0 +1,82 @@
+"""
+Write-behind буфер координат.
+
+Хранит только последнюю позицию каждого пользователя и периодически
+(или при переполнении) отдаёт пачку в flush_fn одной bulk-операцией.
+Фоновый поток стартует лениво — при первом put(), уже в рабочем процессе.
+"""
+import logging
+import threading
+import time
+
+
+class LocationBuffer:
+    def __init__(self, flush_fn, interval=2.0, max_pending=500):
+        self._flush_fn = flush_fn
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}           # username -> (lat, lon, ts)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def put(self, username, lat, lon, ts=None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            prev = self._pending.get(username)
+            if prev is None or prev[2] <= ts:
+                self._pending[username] = (lat, lon, ts)
+            full = len(self._pending) >= self.max_pending
+            if self._thread is None and not self._stopped.is_set():
+                self._thread = threading.Thread(
+                    target=self._run, name="location-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def get(self, username):
+        """Ещё не записанная в БД позиция пользователя или None."""
+        with self._lock:
+            return self._pending.get(username)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Записать всё накопленное. Возвращает число строк."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            try:
+                self._flush_fn([
+                    {"username": name, "lat": lat, "lon": lon, "last_seen": ts}
+                    for name, (lat, lon, ts) in batch.items()
+                ])
+            except Exception:
+                logging.exception("[LOCATIONS] flush of %d rows failed, will retry", len(batch))
+                # Возвращаем пачку, не затирая более свежие позиции
+                with self._lock:
+                    for name, row in batch.items():
+                        cur = self._pending.get(name)
+                        if cur is None or cur[2] < row[2]:
+                            self._pending[name] = row
+                return 0
+            return len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def stop(self):
+        """Остановить поток и дописать хвост (вызывается при завершении воркера)."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        self.flush()
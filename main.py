@@ -1,22 +1,51 @@
 import os
+import math
 import uuid
+import atexit
+import threading
+import json
+import heapq
+import shutil
+import tempfile
+import itertools
+import mimetypes
+import click
 import logging
 import time
-import math
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from collections import Counter, OrderedDict
 from functools import wraps
-from sqlalchemy import or_, and_
-from flask import Flask, request, jsonify, send_from_directory
+from sqlalchemy import and_, event, func, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+from flask import (
+    Flask, Response, g, request, jsonify, redirect, send_file,
+    stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
     JWTManager, create_access_token, jwt_required,
     get_jwt_identity, get_jwt, decode_token
 )
 from dotenv import load_dotenv
 
+from geo import (
+    GridIndex, bbox_cells, cell_distance_km, cell_of, cells_around, haversine_km,
+    radius_to_deg, track_cells,
+)
+from distance import within_radius
+from location_buffer import LocationBuffer
+from events import EventBus, InProcessBackend
+import tasks
+from passwords import PasswordHasher, PasswordHasherBusy
+from json_provider import FastJSONProvider, compress_response, iso
+from cache import TTLCache
+import track_codec
+from geometry import SimplifiedTrack, TrackStats, encode_polyline, zoom_tolerance
+from media_store import MediaStore, S3MediaStore, is_hashed
+from thumbnails import Thumbnailer
+
 
 # ------------------- Загрузка env-переменных -------------------
 load_dotenv()
@@ -27,14 +56,109 @@ app.config.update(
     SECRET_KEY=os.getenv("SECRET_KEY", "supersecret"),
     JWT_SECRET_KEY=os.getenv("JWT_SECRET_KEY", "jwtsecret"),
     JWT_ACCESS_TOKEN_EXPIRES=timedelta(days=1),
-    SQLALCHEMY_DATABASE_URI=(
+    SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL") or (
         f"postgresql://{os.getenv('PGUSER')}:{os.getenv('PGPASSWORD')}"
         f"@{os.getenv('PGHOST')}:{os.getenv('PGPORT')}/{os.getenv('PGDATABASE')}"
     ),
     SQLALCHEMY_TRACK_MODIFICATIONS=False,
     JSON_AS_ASCII=False,
+    # Сжатие JSON-ответов (gzip, brotli при наличии пакета) от этого размера
+    JSON_COMPRESS=os.getenv("JSON_COMPRESS", "true").lower() == "true",
+    JSON_COMPRESS_MIN_BYTES=int(os.getenv("JSON_COMPRESS_MIN_BYTES", 1024)),
+    JSON_GZIP_LEVEL=int(os.getenv("JSON_GZIP_LEVEL", 6)),
+    JSON_BROTLI_QUALITY=int(os.getenv("JSON_BROTLI_QUALITY", 4)),
     UPLOAD_FOLDER=os.getenv("UPLOAD_FOLDER", "uploads"),
+    # Уменьшенные копии фото для /uploads/<name>?w= (нужен Pillow)
+    THUMB_WIDTHS=[int(w) for w in os.getenv("THUMB_WIDTHS", "160,480,1080").split(",")],
+    THUMB_DIR=os.getenv("THUMB_DIR"),   # по умолчанию UPLOAD_FOLDER/.thumbs
+    THUMB_CACHE_MB=int(os.getenv("THUMB_CACHE_MB", 512)),
+    THUMB_QUALITY=int(os.getenv("THUMB_QUALITY", 80)),
+    THUMB_WORKERS=int(os.getenv("THUMB_WORKERS", 2)),
+    # Отдача файлов фронт-прокси: "nginx" (X-Accel-Redirect на UPLOAD_ACCEL_PREFIX,
+    # internal location с alias на UPLOAD_FOLDER) или "sendfile" (X-Sendfile)
+    UPLOAD_ACCEL=os.getenv("UPLOAD_ACCEL", "").lower(),
+    UPLOAD_ACCEL_PREFIX=os.getenv("UPLOAD_ACCEL_PREFIX", "/_protected_uploads/"),
+    UPLOADS_PAGE_MAX=int(os.getenv("UPLOADS_PAGE_MAX", 1000)),
+    # Докачиваемые загрузки: /uploads/sessions
+    UPLOAD_MAX_MB=int(os.getenv("UPLOAD_MAX_MB", 25)),
+    UPLOAD_CHUNK_MAX_MB=int(os.getenv("UPLOAD_CHUNK_MAX_MB", 4)),
+    UPLOAD_SESSION_TTL_HOURS=float(os.getenv("UPLOAD_SESSION_TTL_HOURS", 24)),
+    # Где лежат загрузки: "local" (UPLOAD_FOLDER) или "s3" (S3/MinIO, нужен boto3).
+    # С s3 клиенты скачивают и загружают по подписанным ссылкам, мимо воркеров;
+    # UPLOAD_FOLDER остаётся буфером для загрузок через сервер.
+    STORAGE_BACKEND=os.getenv("STORAGE_BACKEND", "local").lower(),
+    S3_BUCKET=os.getenv("S3_BUCKET"),
+    S3_PREFIX=os.getenv("S3_PREFIX", ""),
+    S3_ENDPOINT_URL=os.getenv("S3_ENDPOINT_URL"),   # для MinIO: http://minio:9000
+    S3_REGION=os.getenv("S3_REGION"),
+    S3_ACCESS_KEY=os.getenv("S3_ACCESS_KEY"),
+    S3_SECRET_KEY=os.getenv("S3_SECRET_KEY"),
+    S3_URL_EXPIRES=int(os.getenv("S3_URL_EXPIRES", 3600)),
     ALLOW_NO_DEVICE=os.getenv("ALLOW_NO_DEVICE", "false").lower() == "true",
+    # Кэш проверки сессии (jti, device, banned): у других воркеров logout/ban
+    # вступает в силу не позже чем через SESSION_CACHE_TTL секунд
+    SESSION_CACHE_TTL=float(os.getenv("SESSION_CACHE_TTL", 30)),
+    SESSION_CACHE_MAX=int(os.getenv("SESSION_CACHE_MAX", 10000)),
+    # Шаг сетки индекса присутствия (градусы) и период досинхронизации с БД (сек, 0 — выкл.)
+    PRESENCE_CELL_DEG=float(os.getenv("PRESENCE_CELL_DEG", 0.05)),
+    PRESENCE_REFRESH_SEC=float(os.getenv("PRESENCE_REFRESH_SEC", 5)),
+    # Сдвиг меньше этого (градусы, ~1 м) — не перемещение: сосед не попадает в дельту
+    PRESENCE_MOVE_EPS_DEG=float(os.getenv("PRESENCE_MOVE_EPS_DEG", 0.00001)),
+    # Сколько клиентских "снимков" соседей держать для дельта-ответов /sync
+    SYNC_VIEWS_MAX=int(os.getenv("SYNC_VIEWS_MAX", 100000)),
+    # Write-behind координат: копим последние позиции и пишем пачкой
+    WRITE_BEHIND_LOCATIONS=os.getenv("WRITE_BEHIND_LOCATIONS", "false").lower() == "true",
+    LOCATION_FLUSH_SEC=float(os.getenv("LOCATION_FLUSH_SEC", 2)),
+    LOCATION_FLUSH_MAX=int(os.getenv("LOCATION_FLUSH_MAX", 500)),
+    # Фоновые задачи (побочные эффекты после коммита): потоки, размер очереди,
+    # повторы; TASKS_SYNC=true — выполнять сразу в запросе (отладка)
+    TASK_WORKERS=int(os.getenv("TASK_WORKERS", 4)),
+    TASK_QUEUE_MAX=int(os.getenv("TASK_QUEUE_MAX", 1000)),
+    TASK_MAX_RETRIES=int(os.getenv("TASK_MAX_RETRIES", 3)),
+    TASK_RETRY_DELAY=float(os.getenv("TASK_RETRY_DELAY", 0.5)),
+    TASK_DRAIN_SEC=float(os.getenv("TASK_DRAIN_SEC", 10)),
+    TASKS_SYNC=os.getenv("TASKS_SYNC", "false").lower() == "true",
+    # Хеширование паролей в пуле процессов: метод werkzeug, число процессов
+    # (0 — в потоке запроса), лимит одновременных операций, таймаут ожидания
+    PASSWORD_HASH_METHOD=os.getenv("PASSWORD_HASH_METHOD", "scrypt"),
+    PASSWORD_WORKERS=int(os.getenv("PASSWORD_WORKERS", 2)),
+    PASSWORD_MAX_PENDING=int(os.getenv("PASSWORD_MAX_PENDING", 64)),
+    PASSWORD_TIMEOUT_SEC=float(os.getenv("PASSWORD_TIMEOUT_SEC", 10)),
+    # Push-канал: размер буфера на топик, время жизни событий, шаг гео-топиков позиций, тайминги
+    EVENTS_BUFFER=int(os.getenv("EVENTS_BUFFER", 1000)),
+    EVENTS_MAX_AGE_SEC=float(os.getenv("EVENTS_MAX_AGE_SEC", 600)),
+    EVENTS_POS_CELL_DEG=float(os.getenv("EVENTS_POS_CELL_DEG", 0.1)),
+    EVENTS_HEARTBEAT_SEC=float(os.getenv("EVENTS_HEARTBEAT_SEC", 15)),
+    EVENTS_STREAM_MAX_SEC=float(os.getenv("EVENTS_STREAM_MAX_SEC", 300)),
+    EVENTS_POLL_MAX_SEC=float(os.getenv("EVENTS_POLL_MAX_SEC", 30)),
+    # Максимальный размер страницы истории сообщений
+    MESSAGES_PAGE_MAX=int(os.getenv("MESSAGES_PAGE_MAX", 200)),
+    # Первый /sync отдаёт не всю переписку, а последние N сообщений на собеседника
+    PRIVATE_BACKFILL_PER_PEER=int(os.getenv("PRIVATE_BACKFILL_PER_PEER", 50)),
+    # SOS в /sync и push-канале — только в этом радиусе от пользователя
+    SOS_RADIUS_KM=float(os.getenv("SOS_RADIUS_KM", 50)),
+    SOS_CELL_DEG=float(os.getenv("SOS_CELL_DEG", 0.1)),
+    # Сдвиг пользователя, после которого список SOS рядом пересчитывается
+    # даже без новых SOS (точность границы радиуса)
+    SOS_RECHECK_KM=float(os.getenv("SOS_RECHECK_KM", 1.0)),
+    # Радиус, в котором онлайн-пользователи получают срочное оповещение о новом SOS
+    SOS_ALERT_RADIUS_KM=float(os.getenv("SOS_ALERT_RADIUS_KM", 10)),
+    # Максимум точек в одной пачке /add_route_points
+    ROUTE_BATCH_MAX=int(os.getenv("ROUTE_BATCH_MAX", 10000)),
+    # /get_route: упрощённые треки в памяти воркера и допуск в пикселях для ?zoom=
+    ROUTE_LOD_CACHE_MAX=int(os.getenv("ROUTE_LOD_CACHE_MAX", 256)),
+    ROUTE_LOD_CACHE_TTL=float(os.getenv("ROUTE_LOD_CACHE_TTL", 600)),
+    ROUTE_LOD_PX=float(os.getenv("ROUTE_LOD_PX", 1.0)),
+    ROUTE_STREAM_BATCH=int(os.getenv("ROUTE_STREAM_BATCH", 2000)),
+    # Максимальная страница /list_routes
+    ROUTES_PAGE_MAX=int(os.getenv("ROUTES_PAGE_MAX", 200)),
+    # Сетка route_cells для /routes_near (после смены шага — flask backfill-route-stats)
+    ROUTE_CELL_DEG=float(os.getenv("ROUTE_CELL_DEG", 0.01)),
+    ROUTES_NEAR_MAX_KM=float(os.getenv("ROUTES_NEAR_MAX_KM", 100)),
+    # Область больше стольких ячеек ищется только по bbox маршрутов
+    ROUTES_NEAR_MAX_CELLS=int(os.getenv("ROUTES_NEAR_MAX_CELLS", 2500)),
+    # Сколько маршрутов-кандидатов читать при поиске по bbox
+    ROUTES_NEAR_SCAN_MAX=int(os.getenv("ROUTES_NEAR_SCAN_MAX", 1000)),
 )
 
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -44,6 +168,18 @@ db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
 CORS(app)
+app.json = FastJSONProvider(app)
+
+@app.after_request
+def _compress_json(resp):
+    if not app.config["JSON_COMPRESS"]:
+        return resp
+    return compress_response(
+        resp, request.accept_encodings,
+        min_size=app.config["JSON_COMPRESS_MIN_BYTES"],
+        gzip_level=app.config["JSON_GZIP_LEVEL"],
+        brotli_quality=app.config["JSON_BROTLI_QUALITY"],
+    )
 
 
 # ------------------- Таблицы и модели -------------------
@@ -60,7 +196,7 @@ class User(db.Model):
     password       = db.Column(db.String(200), nullable=False)
     lat            = db.Column(db.Float, default=0.0)
     lon            = db.Column(db.Float, default=0.0)
-    last_seen      = db.Column(db.Float, default=lambda: time.time())
+    last_seen      = db.Column(db.Float, default=lambda: time.time(), index=True)
     current_token  = db.Column(db.String(500))
     current_device = db.Column(db.String(100))
 
@@ -95,6 +231,10 @@ class Message(db.Model):
     photo      = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_messages_group_id_id", "group_id", "id"),
+    )
+
 class PrivateMessage(db.Model):
     __tablename__ = "private_messages"
     id         = db.Column(db.Integer, primary_key=True)
@@ -105,6 +245,13 @@ class PrivateMessage(db.Model):
     photo      = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_private_messages_to_user_id", "to_user", "id"),
+        db.Index("ix_private_messages_from_user_id", "from_user", "id"),
+        db.Index("ix_private_messages_to_user_from_user_id", "to_user", "from_user", "id"),
+        db.Index("ix_private_messages_from_user_to_user_id", "from_user", "to_user", "id"),
+    )
+
 class Group(db.Model):
     __tablename__ = "groups"
     id        = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -123,6 +270,10 @@ class GroupMember(db.Model):
     joined_msg_id = db.Column(db.Integer, default=0)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_group_members_group_id", "group_id"),
+    )
+
 class Invite(db.Model):
     __tablename__ = "invites"
     id        = db.Column(db.Integer, primary_key=True)
@@ -131,6 +282,10 @@ class Invite(db.Model):
     group_id  = db.Column(db.String(36))
     created   = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_invites_to_user_created", "to_user", "created"),
+    )
+
 class Sos(db.Model):
     __tablename__ = "sos"
     id = db.Column(db.Integer, primary_key=True)
@@ -148,14 +303,41 @@ class Sos(db.Model):
     # --- SOS_EXT ---
     created = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_sos_active_closed_created", "active", "closed", "created"),
+    )
+
 class Route(db.Model):
     __tablename__ = "routes"
     id       = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     name     = db.Column(db.String(120))
     owner    = db.Column(db.String(80), db.ForeignKey("users.username"))
     created  = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seq = db.Column(db.Integer, default=0)   # последняя принятая пачка /add_route_points
+    # Запечатанный маршрут: точки упакованы в track (track_codec.pack), строк route_points нет
+    sealed    = db.Column(db.Boolean, default=False)
+    sealed_at = db.Column(db.DateTime, nullable=True)
+    track     = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    # Денормализованная статистика (geometry.TrackStats), обновляется при вставке точек
+    point_count   = db.Column(db.Integer, default=0)
+    comment_count = db.Column(db.Integer, default=0)
+    distance_km   = db.Column(db.Float, default=0.0)
+    min_lat  = db.Column(db.Float, nullable=True)
+    max_lat  = db.Column(db.Float, nullable=True)
+    min_lon  = db.Column(db.Float, nullable=True)
+    max_lon  = db.Column(db.Float, nullable=True)
+    start_ts = db.Column(db.DateTime, nullable=True)
+    end_ts   = db.Column(db.DateTime, nullable=True)
+    last_lat = db.Column(db.Float, nullable=True)
+    last_lon = db.Column(db.Float, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_routes_owner_created", "owner", "created"),
+        db.Index("ix_routes_bbox", "min_lat", "max_lat", "min_lon", "max_lon"),
+    )
 
-    points   = db.relationship("RoutePoint",   backref="route", cascade="all,delete")
+    points   = db.relationship("RoutePoint",   backref="route", cascade="all,delete",
+                               order_by="RoutePoint.ts")
     comments = db.relationship("RouteComment", backref="route", cascade="all,delete")
 
 class RoutePoint(db.Model):
@@ -166,6 +348,21 @@ class RoutePoint(db.Model):
     lon      = db.Column(db.Float)
     ts       = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_route_points_route_id_ts", "route_id", "ts"),
+    )
+
+class RouteCell(db.Model):
+    """Ячейка сетки ROUTE_CELL_DEG, через которую проходит трек маршрута."""
+    __tablename__ = "route_cells"
+    route_id = db.Column(db.String(36), db.ForeignKey("routes.id"), primary_key=True)
+    row      = db.Column(db.Integer, primary_key=True)
+    col      = db.Column(db.Integer, primary_key=True)
+
+    __table_args__ = (
+        db.Index("ix_route_cells_row_col_route_id", "row", "col", "route_id"),
+    )
+
 class RouteComment(db.Model):
     __tablename__ = "route_comments"
     id       = db.Column(db.Integer, primary_key=True)
@@ -176,6 +373,10 @@ class RouteComment(db.Model):
     photo    = db.Column(db.String(200))
     ts       = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_route_comments_route_id_ts", "route_id", "ts"),
+    )
+
 # --- SOS_EXT ---
 class SosReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -183,12 +384,88 @@ class SosReport(db.Model):
     reporter = db.Column(db.String(80))
     comment = db.Column(db.Text)
     created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_sos_report_sos_id_reporter", "sos_id", "reporter"),
+    )
 # --- SOS_EXT ---
 
+class ChangeCounter(db.Model):
+    """Счётчик изменений по ключу: "u:<username>", "g:<group_id>", "sos"."""
+    __tablename__ = "change_counters"
+    key   = db.Column(db.String(120), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class MediaRef(db.Model):
+    """Число ссылок на файл из media_store; refs=0 дольше грейс-периода — мусор."""
+    __tablename__ = "media_refs"
+    name       = db.Column(db.String(100), primary_key=True)
+    refs       = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_media_refs_refs_updated_at", "refs", "updated_at"),
+    )
+
+class UploadSession(db.Model):
+    """Докачиваемая загрузка: части дописываются в .part-файл, в конце он уходит в media_store."""
+    __tablename__ = "upload_sessions"
+    id         = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    owner      = db.Column(db.String(80), db.ForeignKey("users.username"))
+    ext        = db.Column(db.String(8), nullable=False)
+    size       = db.Column(db.BigInteger, nullable=False)
+    received   = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256     = db.Column(db.String(64), nullable=True)   # ожидаемый хеш от клиента, если передан
+    name       = db.Column(db.String(100), nullable=True)  # имя в media_store после завершения
+    created    = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index("ix_upload_sessions_updated_at", "updated_at"),
+    )
+
+# ------------------- Фоновые задачи -------------------
+
+executor = tasks.TaskExecutor(
+    tasks.InProcessBackend(maxsize=app.config["TASK_QUEUE_MAX"]),
+    workers=app.config["TASK_WORKERS"],
+    max_retries=app.config["TASK_MAX_RETRIES"],
+    retry_delay=app.config["TASK_RETRY_DELAY"],
+    context=app.app_context,
+    sync=app.config["TASKS_SYNC"],
+)
+atexit.register(executor.drain, app.config["TASK_DRAIN_SEC"])
+
+def after_commit(name, *args):
+    """
+    Поставить задачу в очередь, когда текущая транзакция закоммитится;
+    при откате — отбросить. Так задача не увидит несохранённых данных.
+    """
+    session = db.session()
+    if not session.in_transaction():
+        # rollback() без начатой транзакции событий не шлёт — очередь бы не сбросилась
+        session.begin()
+    session.info.setdefault("after_commit", []).append((name, args))
+
+@event.listens_for(db.session, "after_commit")
+def _submit_after_commit(session):
+    for name, args in session.info.pop("after_commit", ()):
+        executor.submit(name, *args)
+
+@event.listens_for(db.session, "after_transaction_end")
+def _drop_after_commit(session, transaction):
+    # После коммита очередь уже пуста; здесь остаётся только откат или close()
+    if transaction.parent is None:
+        session.info.pop("after_commit", None)
+
+
 # ------------------- Хелперы авторизации -------------------
 
 from flask_jwt_extended import get_jwt_identity, get_jwt
-def sos_to_json(s, show_reports=False):
+def sos_to_json(s, show_reports=False, reports=None):
+    """reports — заранее загруженные жалобы (см. sos_list_to_json), иначе запрос."""
+    if show_reports and reports is None:
+        reports = SosReport.query.filter_by(sos_id=s.id).all()
     photos = (s.photos or "").split(",") if s.photos else []
     return {
         "id": s.id,
@@ -202,19 +479,71 @@ def sos_to_json(s, show_reports=False):
         "active": getattr(s, "active", True),
         "rescuer": getattr(s, "rescuer", None),
         "closed": getattr(s, "closed", False),
-        "created": s.created.isoformat(),
+        "created": iso(s.created),
         # --- SOS_EXT ---
         "reports": [
             {
                 "reporter": r.reporter,
                 "comment": r.comment,
-                "created": r.created.isoformat()
+                "created": iso(r.created)
             }
-            for r in SosReport.query.filter_by(sos_id=s.id).all()
+            for r in reports
         ] if show_reports else None,
         # --- SOS_EXT ---
     }
 
+def _sos_reports_query(sos_ids):
+    return SosReport.query.filter(SosReport.sos_id.in_(sos_ids)).order_by(SosReport.id.asc())
+
+def sos_list_to_json(soses, show_reports=False):
+    """Список SOS; жалобы грузятся одним запросом на весь список."""
+    by_sos = {}
+    if show_reports and soses:
+        for r in _sos_reports_query([s.id for s in soses]):
+            by_sos.setdefault(r.sos_id, []).append(r)
+    return [sos_to_json(s, show_reports, by_sos.get(s.id, [])) for s in soses]
+
+def message_to_json(m):
+    return {
+        "group_id": m.group_id,
+        "id": m.id,
+        "from": m.sender,
+        "text": m.text,
+        "photo": m.photo,
+        "audio": m.audio,
+        "created_at": iso(m.created_at)
+    }
+
+def private_message_to_json(m):
+    return {
+        "id": m.id,
+        "to_user": m.to_user,
+        "from_user": m.from_user,
+        "text": m.text,
+        "photo": m.photo,
+        "audio": m.audio,
+        "created_at": iso(m.created_at)
+    }
+
+def invite_to_json(inv):
+    return {
+        "id": inv.id,
+        "from_user": inv.from_user,
+        "to_user": inv.to_user,
+        "group_id": inv.group_id,
+        "created": iso(inv.created)
+    }
+
+
+# username -> (current_token, current_device, banned)
+session_cache = TTLCache(maxsize=app.config["SESSION_CACHE_MAX"], ttl=app.config["SESSION_CACHE_TTL"])
+
+def current_user():
+    """Пользователь запроса; если декоратор его уже загрузил — без повторного SELECT."""
+    user = g.get("current_user")
+    if user is None:
+        user = g.current_user = User.query.get(get_jwt_identity())
+    return user
 
 def single_device_required(fn):
     @wraps(fn)
@@ -225,17 +554,147 @@ def single_device_required(fn):
         identity = get_jwt_identity()
         jti      = get_jwt().get("jti")
         device   = request.headers.get("X-Device-ID")
-        user     = User.query.get(identity)
-        if not user or user.current_token != jti or user.current_device != device:
+        session  = session_cache.get(identity)
+        if session is None:
+            # Поколение — до SELECT: login/logout/ban между чтением строки
+            # и set() не дадут записать в кэш старую сессию
+            generation = session_cache.generation(identity)
+            user = User.query.get(identity)
+            if not user:
+                return jsonify(error="Unauthorized"), 403
+            g.current_user = user
+            session = (user.current_token, user.current_device, bool(user.banned))
+            session_cache.set(identity, session, generation=generation)
+        token, cur_device, banned = session
+        if token != jti or cur_device != device:
             return jsonify(error="Unauthorized"), 403
+        if banned:
+            return jsonify(error="banned"), 403
         return fn(*args, **kwargs)
     return wrapper
 
-def save_uploaded_file(file_storage, ext):
-    filename = f"{uuid.uuid4()}.{ext}"
-    path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-    file_storage.save(path)
-    return filename
+if app.config["STORAGE_BACKEND"] == "s3":
+    media_store = S3MediaStore(
+        app.config["UPLOAD_FOLDER"], app.config["S3_BUCKET"],
+        prefix=app.config["S3_PREFIX"],
+        endpoint_url=app.config["S3_ENDPOINT_URL"],
+        region=app.config["S3_REGION"],
+        access_key=app.config["S3_ACCESS_KEY"],
+        secret_key=app.config["S3_SECRET_KEY"],
+        url_expires=app.config["S3_URL_EXPIRES"],
+    )
+else:
+    media_store = MediaStore(app.config["UPLOAD_FOLDER"])
+thumbnailer = Thumbnailer(
+    media_store,
+    app.config["THUMB_DIR"] or os.path.join(app.config["UPLOAD_FOLDER"], ".thumbs"),
+    widths=app.config["THUMB_WIDTHS"],
+    max_bytes=app.config["THUMB_CACHE_MB"] << 20,
+    quality=app.config["THUMB_QUALITY"],
+    workers=app.config["THUMB_WORKERS"],
+)
+# Регистрируется после executor.drain, поэтому выполняется раньше: задачи
+# store_media, дорабатывающие при остановке, рендер уже не запускают
+atexit.register(thumbnailer.shutdown)
+
+# Поля, хранящие имена загруженных файлов (Sos.photos — через запятую)
+MEDIA_COLUMNS = {
+    Message:        ("audio", "photo"),
+    PrivateMessage: ("audio", "photo"),
+    Sos:            ("photos",),
+    RouteComment:   ("photo",),
+}
+
+def _media_names(value):
+    return [n for n in (value or "").split(",") if is_hashed(n)]
+
+def _touch_media(name):
+    """Отметить файл свежим (строка media_refs создаётся при первой загрузке)."""
+    now = datetime.utcnow()
+    q = db.session.query(MediaRef).filter_by(name=name)
+    if q.update({MediaRef.updated_at: now}, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(MediaRef(name=name, refs=0, updated_at=now))
+    except IntegrityError:
+        q.update({MediaRef.updated_at: now}, synchronize_session=False)
+
+def save_uploaded_file(file_storage, ext, background=False):
+    """
+    Сохранить загрузку по хешу содержимого; повторная загрузка того же файла
+    места не занимает. Строка media_refs трогается до перемещения файла на
+    место: её блокировка не даёт gc-media удалить файл до коммита запроса.
+    background=True — имя готово сразу (хеш посчитан), а перенос в хранилище
+    (для S3 — выгрузка) идёт фоновой задачей.
+    """
+    name, tmp, _ = media_store.write_temp(file_storage.stream, ext)
+    if background:
+        try:
+            _touch_media(name)
+        except Exception:
+            media_store.discard_temp(tmp)
+            raise
+        executor.submit("store_media", name, tmp)
+        return name
+    return _store_temp(name, tmp)
+
+@executor.task("store_media")
+def _store_media_task(name, tmp):
+    if media_store.commit_temp(name, tmp):
+        thumbnailer.submit(name)
+
+def _store_temp(name, tmp):
+    try:
+        _touch_media(name)
+        new = media_store.commit_temp(name, tmp)
+    except Exception:
+        media_store.discard_temp(tmp)
+        raise
+    if new:
+        thumbnailer.submit(name)
+    return name
+
+def _change_media_refs(connection, deltas):
+    t = MediaRef.__table__
+    now = datetime.utcnow()
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        res = connection.execute(t.update().where(t.c.name == name)
+                                 .values(refs=t.c.refs + delta, updated_at=now))
+        if not res.rowcount and delta > 0:
+            connection.execute(t.insert().values(name=name, refs=delta, updated_at=now))
+
+def _media_refs_after_insert(mapper, connection, target):
+    deltas = Counter()
+    for col in MEDIA_COLUMNS[mapper.class_]:
+        deltas.update(_media_names(getattr(target, col)))
+    _change_media_refs(connection, deltas)
+
+def _media_refs_after_delete(mapper, connection, target):
+    deltas = Counter()
+    for col in MEDIA_COLUMNS[mapper.class_]:
+        deltas.subtract(_media_names(getattr(target, col)))
+    _change_media_refs(connection, deltas)
+
+def _media_refs_after_update(mapper, connection, target):
+    deltas = Counter()
+    state = sa_inspect(target)
+    for col in MEDIA_COLUMNS[mapper.class_]:
+        hist = state.attrs[col].history
+        for value in hist.added:
+            deltas.update(_media_names(value))
+        for value in hist.deleted:
+            deltas.subtract(_media_names(value))
+    _change_media_refs(connection, deltas)
+
+# Ссылки считаются в той же транзакции, что и сама строка (только ORM-операции;
+# после массовых UPDATE/DELETE — flask rebuild-media-refs)
+for _model in MEDIA_COLUMNS:
+    event.listen(_model, "after_insert", _media_refs_after_insert)
+    event.listen(_model, "after_delete", _media_refs_after_delete)
+    event.listen(_model, "after_update", _media_refs_after_update)
 
 def _store_media_from_request():
     audio_fn = photo_fn = None
@@ -245,28 +704,345 @@ def _store_media_from_request():
         photo_fn = save_uploaded_file(request.files["photo"], "jpg")
     return audio_fn, photo_fn
 
+class UploadNotReady(ValueError):
+    """upload_id не найден, чужой или ещё не докачан."""
+
+def _uploaded_name(upload_id):
+    sess = db.session.get(UploadSession, str(upload_id))
+    if sess is None or sess.owner != get_jwt_identity() or not sess.name:
+        raise UploadNotReady(upload_id)
+    return sess.name
+
+def _media_from_uploads(src, audio_fn=None, photo_fn=None):
+    """
+    Подставить файлы из завершённых сессий загрузки: поля audio_upload_id /
+    photo_upload_id (в JSON или форме) вместо самих файлов.
+    """
+    if src.get("audio_upload_id"):
+        audio_fn = _uploaded_name(src["audio_upload_id"])
+    if src.get("photo_upload_id"):
+        photo_fn = _uploaded_name(src["photo_upload_id"])
+    return audio_fn, photo_fn
+
+def _upload_not_ready(e):
+    return jsonify(error="upload_not_complete", upload_id=str(e)), 400
+
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+def _send_media(path, etag=None, mimetype=None, immutable=False):
+    """
+    Отдать файл: сильный ETag, 304 по If-None-Match, Range (перемотка аудио).
+    В режиме UPLOAD_ACCEL воркер только отвечает на условные запросы и ставит
+    заголовки, а байты (и Range) отдаёт фронт-прокси.
+    """
+    if not os.path.isfile(path):
+        return jsonify(error="not_found"), 404
+    accel = app.config["UPLOAD_ACCEL"]
+    rel = os.path.relpath(path, app.config["UPLOAD_FOLDER"]).replace(os.sep, "/")
+    if accel in ("nginx", "sendfile") and not rel.startswith(".."):
+        resp = Response(mimetype=mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream")
+        if accel == "nginx":
+            resp.headers["X-Accel-Redirect"] = app.config["UPLOAD_ACCEL_PREFIX"].rstrip("/") + "/" + rel
+        else:
+            resp.headers["X-Sendfile"] = os.path.abspath(path)
+        if etag:
+            resp.set_etag(etag)
+        resp = resp.make_conditional(request)
+    else:
+        resp = send_file(path, mimetype=mimetype, etag=etag or True, conditional=True)
+    if immutable:
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = MEDIA_MAX_AGE
+        resp.cache_control.immutable = True
+    return resp
+
+def _thumb_format():
+    """
+    ?fmt= или WebP, если клиент явно указал его в Accept и принимает не хуже
+    JPEG (image/webp;q=0 — отказ; один */* не в счёт).
+    """
+    if request.args.get("fmt"):
+        return request.args["fmt"]
+    accept = request.accept_mimetypes
+    webp = max((q for m, q in accept if m == "image/webp"), default=0)
+    return "webp" if webp > 0 and webp >= accept.quality("image/jpeg") else "jpg"
+
+def _redirect_media(filename):
+    """
+    Редирект на подписанную ссылку в бакете. Уменьшенной копии ещё нет —
+    ставим её в очередь и отдаём оригинал. Сам редирект кэшируется не дольше
+    половины срока жизни ссылки.
+    """
+    key = media_store.media_key(filename)
+    if key is None:
+        return jsonify(error="not_found"), 404
+    hashed = is_hashed(filename)
+    width = request.args.get("w", type=int)
+    vary = False
+    if width and width > 0 and thumbnailer.enabled and thumbnailer.is_image(filename):
+        vary = True
+        vkey = thumbnailer.variant_key(filename, width, _thumb_format())
+        if media_store.head(vkey):
+            key = vkey
+        else:
+            thumbnailer.submit(filename)
+    resp = redirect(media_store.url_for(key, immutable=hashed), code=302)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = media_store.url_expires // 2 if hashed else 0
+    if vary:
+        resp.vary.add("Accept")
+    return resp
+
 @app.route("/uploads/<filename>")
 def serve_upload(filename):
-    return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
+    """
+    ?w=<ширина> — уменьшенная копия фото: WebP, если клиент явно принимает
+    image/webp, иначе JPEG (?fmt=jpg|webp — выбрать явно).
+    Файлы с именем по хешу неизменяемы: ETag — сам хеш, Cache-Control immutable.
+    С хранилищем S3 — редирект на подписанную ссылку.
+    """
+    if media_store.remote:
+        return _redirect_media(filename)
+    path = media_store.path_for(filename)
+    if path is None:
+        return jsonify(error="not_found"), 404
+    hashed = is_hashed(filename)
+    width = request.args.get("w", type=int)
+    if width and width > 0 and thumbnailer.is_image(filename):
+        variant = thumbnailer.get(filename, width, _thumb_format())
+        if variant:
+            vpath, mimetype = variant
+            resp = _send_media(vpath, etag=os.path.basename(vpath) if hashed else None,
+                               mimetype=mimetype, immutable=hashed)
+            resp.vary.add("Accept")
+            return resp
+    return _send_media(path, etag=filename.split(".", 1)[0] if hashed else None, immutable=hashed)
 
 @app.route("/uploads")
 def list_uploads():
-    files = os.listdir(app.config["UPLOAD_FOLDER"])
-    return jsonify(files)
+    """
+    Имена загруженных файлов; папка читается по шардам через scandir.
+    ?limit= (не больше UPLOADS_PAGE_MAX) и ?cursor= из next_cursor — страницами
+    {"files": [...], "next_cursor": ...}; без limit — весь список массивом, потоком.
+    """
+    limit = request.args.get("limit", type=int)
+    names = media_store.iter_names(after=request.args.get("cursor") or None)
+    if limit is None:
+        def generate():
+            yield "["
+            sep = ""
+            while True:
+                chunk = list(itertools.islice(names, 500))
+                if not chunk:
+                    break
+                yield sep + ",".join(json.dumps(n) for n in chunk)
+                sep = ","
+            yield "]"
+        return Response(generate(), mimetype="application/json")
+    page_max = app.config["UPLOADS_PAGE_MAX"]
+    page = min(limit, page_max) if limit > 0 else page_max
+    files = list(itertools.islice(names, page + 1))
+    next_cursor = files[page - 1] if len(files) > page else None
+    return jsonify(files=files[:page], next_cursor=next_cursor)
+UPLOAD_EXTS = {"jpg", "jpeg", "png", "webp", "3gp", "m4a", "aac", "mp3", "ogg", "opus"}
+
+def _session_part(sess):
+    return os.path.join(media_store.tmp_dir, f"upload-{sess.id}.part")
+
+def _session_json(sess):
+    return {"upload_id": sess.id, "offset": sess.received, "size": sess.size,
+            "complete": sess.name is not None, "name": sess.name}
+
+def _chunk_offset():
+    """Смещение части: Content-Range: bytes <start>-<end>/<total> или ?offset=."""
+    cr = request.headers.get("Content-Range", "")
+    if cr.startswith("bytes "):
+        start = cr[6:].split("-", 1)[0]
+        if start.isdigit():
+            return int(start)
+    return request.args.get("offset", type=int)
+
+def _finish_upload(sess):
+    """Докачано: посчитать хеш, переместить файл в media_store."""
+    part = _session_part(sess)
+    with open(part, "rb") as fh:
+        name, tmp, _ = media_store.write_temp(fh, sess.ext)
+    if sess.sha256 and not name.startswith(sess.sha256.lower() + "."):
+        media_store.discard_temp(tmp)
+        return False
+    sess.name = _store_temp(name, tmp)
+    os.unlink(part)
+    return True
+
+@app.route("/uploads/sessions", methods=["POST"])
+@jwt_required()
+@single_device_required
+def create_upload_session():
+    """
+    Начать докачиваемую загрузку: {"ext": "jpg", "size": <байт>, "sha256": необязательно}.
+    Дальше части идут PUT /uploads/sessions/<id> с Content-Range (или ?offset=),
+    состояние — GET /uploads/sessions/<id>. Готовый upload_id передаётся в
+    send_message/send_private_message/add_route_comment (audio_upload_id,
+    photo_upload_id) и sos (photo_upload_ids).
+    """
+    d = request.json or {}
+    ext = str(d.get("ext", "")).lower().lstrip(".")
+    size = d.get("size")
+    if ext not in UPLOAD_EXTS:
+        return jsonify(error="bad_ext", allowed=sorted(UPLOAD_EXTS)), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify(error="bad_size"), 400
+    if size > app.config["UPLOAD_MAX_MB"] << 20:
+        return jsonify(error="too_large", max_bytes=app.config["UPLOAD_MAX_MB"] << 20), 413
+    sha = d.get("sha256")
+    sess = UploadSession(owner=get_jwt_identity(), ext=ext, size=size,
+                         sha256=str(sha).lower() if sha else None)
+    db.session.add(sess)
+    db.session.commit()
+    open(_session_part(sess), "wb").close()
+    out = _session_json(sess)
+    out["chunk_max"] = app.config["UPLOAD_CHUNK_MAX_MB"] << 20
+    return jsonify(out), 201
+
+@app.route("/uploads/sessions/<upload_id>", methods=["GET"])
+@jwt_required()
+@single_device_required
+def upload_session_status(upload_id):
+    sess = db.session.get(UploadSession, upload_id)
+    if not sess or sess.owner != get_jwt_identity():
+        return jsonify(error="not_found"), 404
+    return jsonify(_session_json(sess))
+
+@app.route("/uploads/sessions/<upload_id>", methods=["PUT"])
+@jwt_required()
+@single_device_required
+def put_upload_chunk(upload_id):
+    """
+    Дописать часть с указанного смещения. Смещение должно совпадать с уже
+    принятым числом байт, иначе 409 с актуальным offset (клиент продолжает с него).
+    """
+    sess = db.session.get(UploadSession, upload_id)
+    if not sess or sess.owner != get_jwt_identity():
+        return jsonify(error="not_found"), 404
+    if sess.name:
+        return jsonify(_session_json(sess))
+    offset = _chunk_offset()
+    if offset is None:
+        return jsonify(error="offset_required"), 400
+    if offset != sess.received:
+        return jsonify(error="offset_mismatch", **_session_json(sess)), 409
+    length = request.content_length
+    chunk_max = app.config["UPLOAD_CHUNK_MAX_MB"] << 20
+    if length is None or length <= 0:
+        return jsonify(error="length_required"), 411
+    if length > chunk_max or offset + length > sess.size:
+        return jsonify(error="chunk_too_large", max=min(chunk_max, sess.size - offset)), 413
+    db.session.rollback()   # тело читаем без открытой транзакции
+
+    # Часть сначала целиком во временный файл: медленный клиент не держит блокировку
+    chunk_tmp, got = None, 0
+    try:
+        fd, chunk_tmp = tempfile.mkstemp(dir=media_store.tmp_dir)
+        with os.fdopen(fd, "wb") as out:
+            while got < length:
+                buf = request.stream.read(min(64 * 1024, length - got))
+                if not buf:
+                    break
+                out.write(buf)
+                got += len(buf)
+
+        # Под блокировкой сессии: перепроверить смещение и дописать
+        sess = UploadSession.query.filter_by(id=upload_id).with_for_update().first()
+        if sess is None:
+            # Пока читали часть, сессию удалил gc-media
+            db.session.rollback()
+            return jsonify(error="not_found"), 404
+        if sess.received != offset or sess.name:
+            db.session.rollback()
+            return jsonify(error="offset_mismatch", **_session_json(sess)), 409
+        part = _session_part(sess)
+        with open(part, "r+b") as out, open(chunk_tmp, "rb") as src:
+            out.truncate(sess.received)     # хвост от оборванной прошлой попытки
+            out.seek(sess.received)
+            shutil.copyfileobj(src, out)
+        sess.received += got
+        sess.updated_at = datetime.utcnow()
+        if sess.received == sess.size and not _finish_upload(sess):
+            sess.received = 0
+            open(part, "wb").close()
+            db.session.commit()
+            return jsonify(error="hash_mismatch", **_session_json(sess)), 422
+        db.session.commit()
+    finally:
+        if chunk_tmp and os.path.exists(chunk_tmp):
+            os.unlink(chunk_tmp)
+    return jsonify(_session_json(sess))
+
+@app.route("/uploads/presign", methods=["POST"])
+@jwt_required()
+@single_device_required
+def presign_upload():
+    """
+    Прямая загрузка в S3: {"ext": "jpg", "sha256": <hex>, "size": <байт>}.
+    Ответ — {"name", "exists"}; если файла ещё нет, то и {"url", "method", "headers"}:
+    клиент делает PUT прямо в хранилище с этими заголовками, а потом передаёт
+    name в send_message/sos/... как обычное имя файла. С локальным хранилищем —
+    409, загружать через /uploads/sessions.
+    """
+    if not media_store.remote:
+        return jsonify(error="direct_upload_unsupported", use="/uploads/sessions"), 409
+    d = request.json or {}
+    ext = str(d.get("ext", "")).lower().lstrip(".")
+    sha = str(d.get("sha256", "")).lower()
+    size = d.get("size")
+    if ext not in UPLOAD_EXTS:
+        return jsonify(error="bad_ext", allowed=sorted(UPLOAD_EXTS)), 400
+    name = f"{sha}.{ext}"
+    if not is_hashed(name):
+        return jsonify(error="bad_sha256"), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify(error="bad_size"), 400
+    if size > app.config["UPLOAD_MAX_MB"] << 20:
+        return jsonify(error="too_large", max_bytes=app.config["UPLOAD_MAX_MB"] << 20), 413
+    _touch_media(name)      # строка media_refs до загрузки: gc-media не удалит файл раньше ссылки
+    db.session.commit()
+    if media_store.exists(name):
+        return jsonify(name=name, exists=True)
+    url, headers = media_store.upload_url(name, sha, size)
+    return jsonify(name=name, exists=False, method="PUT", url=url, headers=headers,
+                   expires_in=media_store.url_expires)
+
 # ------------------- Регистрация / логин / логаут -------------------
 
+passwords = PasswordHasher(
+    method=app.config["PASSWORD_HASH_METHOD"],
+    workers=app.config["PASSWORD_WORKERS"],
+    max_pending=app.config["PASSWORD_MAX_PENDING"],
+    timeout=app.config["PASSWORD_TIMEOUT_SEC"],
+)
+atexit.register(passwords.shutdown)
+
+@app.errorhandler(PasswordHasherBusy)
+def _passwords_busy(e):
+    resp = jsonify(error="busy")
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "1"
+    return resp
+
 @app.route("/register", methods=["POST"])
 def register():
     d = request.json
     if User.query.get(d["username"]):
         return jsonify(error="exists"), 400
-    db.session.add(
-        User(
-            username=d["username"],
-            password=generate_password_hash(d["password"])
-        )
-    )
-    db.session.commit()
+    db.session.rollback()   # хеш считается долго — без открытой транзакции
+    pw_hash = passwords.hash(d["password"])
+    db.session.add(User(username=d["username"], password=pw_hash))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error="exists"), 400
     return jsonify(message="registered")
 
 @app.route("/login", methods=["POST"])
@@ -274,8 +1050,17 @@ def login():
     d = request.json
     device_id = d.get("device_id")
     user = User.query.get(d["username"])
-    if not user or not check_password_hash(user.password, d["password"]):
+    if not user:
         return jsonify(error="invalid"), 401
+    stored = user.password
+    db.session.rollback()
+    ok, new_hash = passwords.verify(stored, d["password"])
+    if not ok:
+        return jsonify(error="invalid"), 401
+    user = User.query.get(d["username"])
+    if new_hash:
+        # Хеш старым методом/параметрами — обновляем, пока пароль на руках
+        user.password = new_hash
 
     if user.current_token and user.current_device != device_id and not app.config["ALLOW_NO_DEVICE"]:
         return jsonify(error="already_logged"), 403
@@ -284,6 +1069,7 @@ def login():
     user.current_token = decode_token(token)["jti"]
     user.current_device = device_id
     db.session.commit()
+    session_cache.pop(user.username)
 
     return jsonify(access_token=token)
 
@@ -295,9 +1081,251 @@ def logout():
         u.current_token = None
         u.current_device = None
         db.session.commit()
+    session_cache.pop(get_jwt_identity())
     return jsonify(message="logged out")
 
 
+# ------------------- Шина событий (push-канал) -------------------
+
+bus = EventBus(InProcessBackend(maxlen=app.config["EVENTS_BUFFER"],
+                                max_age=app.config["EVENTS_MAX_AGE_SEC"]))
+
+def _pos_topic(lat, lon):
+    r, c = cell_of(lat, lon, app.config["EVENTS_POS_CELL_DEG"])
+    return f"pos:{r}:{c}"
+
+
+# ------------------- Счётчики изменений для /sync -------------------
+
+def bump_counters(*keys):
+    """
+    Увеличить счётчики в текущей транзакции (коммитит вызывающий),
+    чтобы счётчик и само изменение стали видны одновременно.
+    Строки блокируются в порядке ключей: встречные запросы (A→B и B→A)
+    не должны брать их в разном порядке, иначе взаимная блокировка.
+    """
+    for key in sorted(set(keys)):
+        q = db.session.query(ChangeCounter).filter_by(key=key)
+        if q.update({ChangeCounter.value: ChangeCounter.value + 1}, synchronize_session=False):
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(ChangeCounter(key=key, value=1))
+        except IntegrityError:
+            # Ключ параллельно создал другой запрос
+            q.update({ChangeCounter.value: ChangeCounter.value + 1}, synchronize_session=False)
+
+def _counters_query(keys):
+    return db.session.query(ChangeCounter.key, ChangeCounter.value) \
+        .filter(ChangeCounter.key.in_(keys))
+
+def read_counters(keys):
+    """Один запрос: {key: value}, отсутствующие ключи = 0."""
+    rows = _counters_query(keys).all()
+    res = dict.fromkeys(keys, 0)
+    res.update(rows)
+    return res
+
+
+# ------------------- Индекс активных SOS -------------------
+
+# sos.id -> координаты активных незакрытых SOS. Единственный способ
+# обновления — пересборка по счётчику "sos": SOS создаются и закрываются
+# и через другие воркеры, так что точечные правки индекса всё равно не
+# избавили бы от перечитывания.
+sos_index = GridIndex(cell_deg=app.config["SOS_CELL_DEG"])
+_sos_index_version = None
+
+def _active_sos_query():
+    """(id, lat, lon, created) всех активных незакрытых SOS — для пересборки индекса."""
+    return db.session.query(Sos.id, Sos.lat, Sos.lon, Sos.created) \
+        .filter(and_(Sos.active == True, Sos.closed == False))
+
+def _sos_alerts_query(ids, since=None, entered=()):
+    """
+    Активные SOS из ids по возрастанию created; с since — только созданные
+    позже него, кроме entered (в их радиус пользователь только что вошёл).
+    """
+    q = Sos.query.filter(Sos.id.in_(ids)).filter(and_(Sos.active == True, Sos.closed == False))
+    if since is not None:
+        cond = Sos.created > since
+        if entered:
+            cond = db.or_(cond, Sos.id.in_(entered))
+        q = q.filter(cond)
+    return q.order_by(Sos.created.asc())
+
+def _refresh_sos_index(version):
+    """
+    Перечитать активные SOS из БД, если счётчик "sos" ушёл вперёд.
+    Индекс собирается заново и подменяется целиком, чтобы читатели
+    не видели его пустым.
+    """
+    global sos_index, _sos_index_version
+    if version == _sos_index_version:
+        return
+    fresh = GridIndex(cell_deg=app.config["SOS_CELL_DEG"])
+    rows = _active_sos_query().all()
+    for sos_id, lat, lon, created in rows:
+        fresh.upsert(sos_id, lat, lon, created.timestamp())
+    sos_index, _sos_index_version = fresh, version
+
+@executor.task("dispatch_sos")
+def _dispatch_sos_task(sos_id):
+    entry = db.session.get(Sos, sos_id)
+    if entry is None or not entry.active or entry.closed:
+        return
+    notified = _dispatch_sos(entry)
+    logging.info("SOS %s: notified %d nearby users", entry.id, notified)
+
+def _dispatch_sos(entry):
+    """
+    Разослать новый SOS онлайн-пользователям в радиусе SOS_ALERT_RADIUS_KM:
+    срочное событие в их топик "alert:<username>", который push-канал и
+    /sync отдают раньше всего остального.
+    """
+    now = time.time()
+    _refresh_presence(now)
+    data = sos_to_json(entry)
+    sent = 0
+    for e in _index_near(presence, entry.lat, entry.lon, app.config["SOS_ALERT_RADIUS_KM"], now):
+        if e.key == entry.username:
+            continue
+        alert = dict(data, distance_km=round(haversine_km(entry.lat, entry.lon, e.lat, e.lon), 3))
+        bus.publish(f"alert:{e.key}", "sos_nearby", alert, priority=1)
+        sent += 1
+    return sent
+
+def _sos_closed(sos):
+    bus.publish("sos", "sos_closed", {"id": sos.id})
+
+
+# ------------------- Индекс присутствия (онлайн-пользователи) -------------------
+
+ONLINE_WINDOW_SEC = 180
+
+# username -> последняя позиция; живут только пользователи из окна ONLINE_WINDOW_SEC
+presence = GridIndex(cell_deg=app.config["PRESENCE_CELL_DEG"], ttl=ONLINE_WINDOW_SEC,
+                     move_eps=app.config["PRESENCE_MOVE_EPS_DEG"])
+_presence_synced_at = 0.0
+
+def _presence_query(since):
+    return db.session.query(User.username, User.lat, User.lon, User.last_seen) \
+        .filter(User.last_seen > since)
+
+def _refresh_presence(now):
+    """
+    Воркеров может быть несколько, а пинги попадают в разные процессы.
+    Раз в PRESENCE_REFRESH_SEC подтягиваем из БД всех, кто был онлайн в окне —
+    запрос идёт по индексу last_seen и не зависит от общего числа пользователей.
+    """
+    global _presence_synced_at
+    period = app.config["PRESENCE_REFRESH_SEC"]
+    if period <= 0 or now - _presence_synced_at < period:
+        presence.expire(now)
+        return
+    _presence_synced_at = now
+    rows = _presence_query(now - ONLINE_WINDOW_SEC).all()
+    for username, lat, lon, last_seen in rows:
+        presence.upsert(username, lat, lon, last_seen)
+    presence.expire(now)
+
+def _flush_locations(rows):
+    """Одна bulk-операция UPDATE users ... WHERE username = ? (executemany)."""
+    with app.app_context():
+        db.session.bulk_update_mappings(User, rows)
+        db.session.commit()
+
+location_buffer = None
+if app.config["WRITE_BEHIND_LOCATIONS"]:
+    location_buffer = LocationBuffer(
+        _flush_locations,
+        interval=app.config["LOCATION_FLUSH_SEC"],
+        max_pending=app.config["LOCATION_FLUSH_MAX"],
+    )
+    atexit.register(location_buffer.stop)
+
+def _current_position(username):
+    """Свежая позиция пользователя: буфер, затем индекс, затем БД."""
+    if location_buffer is not None:
+        pending = location_buffer.get(username)
+        if pending:
+            return pending[0], pending[1]
+    e = presence.get(username)
+    if e is not None:
+        return e.lat, e.lon
+    u = User.query.get(username)
+    return u.lat, u.lon
+
+def _record_location(username, lat, lon, now):
+    """
+    Сохранить позицию: UPDATE без загрузки пользователя (коммит делает
+    вызывающий) или в write-behind буфер.
+    """
+    if location_buffer is not None:
+        location_buffer.put(username, lat, lon, now)
+    else:
+        db.session.query(User).filter_by(username=username).update(
+            {User.lat: lat, User.lon: lon, User.last_seen: now}, synchronize_session=False)
+    if presence.upsert(username, lat, lon, now):
+        bus.publish(_pos_topic(lat, lon), "position",
+                    {"username": username, "lat": lat, "lon": lon, "last_seen": now})
+
+def _presence_json(e):
+    return {"username": e.key, "lat": e.lat, "lon": e.lon, "last_seen": e.ts}
+
+def _index_near(index, lat, lon, radius_km, now=None):
+    cand = index.candidates(lat, lon, radius_km, now)
+    hits = within_radius(lat, lon, [e.lat for e in cand], [e.lon for e in cand], radius_km)
+    return [cand[i] for i in hits]
+
+# Курсор соседей: "<эпоха процесса>:<версия индекса>". Версии живут только
+# в памяти процесса, поэтому чужой/устаревший курсор означает полный ответ.
+_presence_epoch = uuid.uuid4().hex[:8]
+# username -> (выданный курсор, множество отданных соседей)
+_sync_views = OrderedDict()
+_sync_views_lock = threading.Lock()
+
+# username -> (lat, lon, id SOS в радиусе) на момент последнего пересчёта
+# секции sos_alerts. Как и _sync_views — в памяти процесса.
+_sos_views = OrderedDict()
+
+def _sos_view(me_name):
+    with _sync_views_lock:
+        return _sos_views.get(me_name)
+
+def _save_sos_view(me_name, lat, lon, ids):
+    with _sync_views_lock:
+        _sos_views.pop(me_name, None)
+        _sos_views[me_name] = (lat, lon, frozenset(ids))
+        while len(_sos_views) > app.config["SYNC_VIEWS_MAX"]:
+            _sos_views.popitem(last=False)
+
+def _users_delta(me_name, cursor, near, version):
+    """
+    Дельта соседей относительно курсора клиента. version — presence.version,
+    прочитанная ДО выборки near: обновление, пришедшее между ними, получит
+    версию больше курсора и попадёт в следующую дельту. Сосед, который
+    стоит на месте, версию не меняет и в дельту не попадает (его last_seen
+    у клиента стареет); ушедший оффлайн приходит в removed.
+    Возвращает (changed, removed, new_cursor, full).
+    """
+    new_cursor = f"{_presence_epoch}:{version}"
+    near_keys = {e.key for e in near}
+    with _sync_views_lock:
+        prev = _sync_views.pop(me_name, None)
+        _sync_views[me_name] = (new_cursor, near_keys)
+        while len(_sync_views) > app.config["SYNC_VIEWS_MAX"]:
+            _sync_views.popitem(last=False)
+
+    if not cursor or prev is None or prev[0] != cursor:
+        return near, [], new_cursor, True
+
+    since = int(cursor.rsplit(":", 1)[1])
+    prev_keys = prev[1]
+    changed = [e for e in near if e.version > since or e.key not in prev_keys]
+    return changed, sorted(prev_keys - near_keys), new_cursor, False
+
+
 # ------------------- Старые эндпоинты LOCATION & USERS -------------------
 
 @app.route("/update_location", methods=["POST"])
@@ -305,10 +1333,7 @@ def logout():
 @single_device_required
 def update_location():
     d = request.json
-    u = User.query.get(get_jwt_identity())
-    u.lat = d["lat"]
-    u.lon = d["lon"]
-    u.last_seen = time.time()
+    _record_location(get_jwt_identity(), d["lat"], d["lon"], time.time())
     db.session.commit()
     return jsonify(status="ok")
 
@@ -318,27 +1343,15 @@ def update_location():
 def get_users():
     now = time.time()
     me  = get_jwt_identity()
-    cur = User.query.get(me)
-    res = []
-    for u in User.query.all():
-        if u.username == me or u.username in [i.username for i in cur.ignored]:
-            continue
-        if now - u.last_seen > 180:
-            continue
-        res.append(u.to_json())
-    return jsonify(res)
+    cur = current_user()
+    _refresh_presence(now)
+    skip = {i.username for i in cur.ignored}
+    skip.add(me)
+    return jsonify([_presence_json(e) for e in presence.live(now) if e.key not in skip])
 
 
 # ------------------- Новый batch-эндпоинт /sync -------------------
 
-def _haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * \
-        math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
 @app.route("/sync", methods=["POST"])
 @jwt_required()
 @single_device_required
@@ -347,90 +1360,89 @@ def sync():
     Клиент шлёт: {
       "lat": <float>, "lon": <float>,
       "last_msg_time": <ISO8601>, "last_sos_time": <ISO8601>,
-      "group_id": <str or null>
+      "group_id": <str or null>,
+      "users_cursor": <str or null>,  // опционально, включает дельта-режим соседей
+      "counters": {<key>: <int>},     // опционально, счётчики из прошлого ответа
+      "alerts_cursor": <str or null>  // опционально, срочные оповещения
     }
     Сервер отвечает:
     {
       "updated_users": [...],
       "new_messages": [...],
-      "sos_alerts": [...],
-      "group_status": {...}
+      "sos_alerts": [...],                 // с counters — при новых SOS или сдвиге > SOS_RECHECK_KM
+      "group_status": {...},
+      "private_has_more": <bool>,          // true — личные сообщения обрезаны, дочитать с last_private_id
+      // только в дельта-режиме:
+      "removed_users": [<username>, ...],  // ушли из радиуса или оффлайн
+      "users_cursor": <str>,               // прислать в следующем запросе
+      "users_full": <bool>,                // true — updated_users это полный список
+      // только если клиент прислал counters:
+      "counters": {<key>: <int>},          // секции без изменений в ответе отсутствуют
+      // только если клиент прислал alerts_cursor:
+      "alerts": [...],                     // SOS рядом, поднятые после курсора
+      "alerts_cursor": <str>,
+      "alerts_reset": <bool>               // true — часть оповещений могла потеряться; sos_alerts в этом ответе — без last_sos_time
     }
     """
     req = request.json or {}
     me_name = get_jwt_identity()
-    me      = User.query.get(me_name)
+    gid = req.get("group_id")
+    res = {}
+
+    # Срочные оповещения (SOS рядом) — первыми, ещё до остальных секций
+    alerts_reset = False
+    if "alerts_cursor" in req:
+        alerts, alerts_cursor, alerts_reset = bus.read([f"alert:{me_name}"], req["alerts_cursor"])
+        res["alerts"] = [dict(ev["data"], type=ev["type"]) for ev in alerts]
+        res["alerts_cursor"] = alerts_cursor
+        res["alerts_reset"] = alerts_reset
+
+    # Счётчики изменений: секции, где счётчик совпал с присланным клиентом,
+    # не запрашиваются и не попадают в ответ. Читаем их ДО данных, чтобы
+    # параллельная запись в худшем случае дала лишний повторный запрос.
+    client_counters = req.get("counters")
+    counters = {}
+    if client_counters is not None:
+        keys = [f"u:{me_name}", "sos"] + ([f"g:{gid}"] if gid else [])
+        counters = read_counters(keys)
+
+    def changed(key):
+        return client_counters is None or client_counters.get(key) != counters.get(key)
 
     # Обновить координаты
-    me.lat = req.get("lat", me.lat)
-    me.lon = req.get("lon", me.lon)
-    me.last_seen = time.time()
+    now_ts = time.time()
+    my_lat, my_lon = _current_position(me_name)
+    my_lat = req.get("lat", my_lat)
+    my_lon = req.get("lon", my_lon)
+    _record_location(me_name, my_lat, my_lon, now_ts)
 
     # Вычислить пользователей в радиусе N км (по умолчанию 5)
     radius_km = float(os.getenv("USER_RADIUS_KM", 5))
 
-    users_near = []
-    now_ts = time.time()
-    for u in User.query.all():
-        if u.username == me_name:
-            continue
-        if now_ts - u.last_seen > 180:
-            continue
-        dist = _haversine_km(me.lat, me.lon, u.lat, u.lon)
-        if dist <= radius_km:
-            users_near.append(u.to_json())
-
-    # Групповые сообщения
-    new_group_msgs = []
-    gid = req.get("group_id")
-    if gid:
+    _refresh_presence(now_ts)
+    presence_version = presence.version
+    near = [e for e in _index_near(presence, my_lat, my_lon, radius_km, now_ts) if e.key != me_name]
+
+    # Клиент, приславший users_cursor (хоть null), получает только изменения
+    users_delta = {}
+    if "users_cursor" in req:
+        near, removed, cursor, full = _users_delta(me_name, req["users_cursor"], near, presence_version)
+        users_delta = dict(removed_users=removed, users_cursor=cursor, users_full=full)
+    res["updated_users"] = [_presence_json(e) for e in near]
+    res.update(users_delta)
+    sos_view = _sos_view(me_name)
+
+    if gid and changed(f"g:{gid}"):
+        # Групповые сообщения
         last_iso = req.get("last_msg_time")
-        member = db.session.query(GroupMember).filter_by(user_id=me_name, group_id=gid).first()
+        member = _group_member_query(me_name, gid).first()
         joined_id = member.joined_msg_id if member else 0
+        since = datetime.fromisoformat(last_iso) if last_iso else None
+        msgs = _group_messages_query(gid, joined_id, since).all()
+        res["new_messages"] = [message_to_json(m) for m in msgs]
 
-        q = Message.query.filter_by(group_id=gid).filter(Message.id > joined_id)
-        if last_iso:
-            q = q.filter(Message.created_at > datetime.fromisoformat(last_iso))
-
-        msgs = q.order_by(Message.created_at.asc()).all()
-        new_group_msgs = [{
-            "id": m.id, "from": m.sender, "text": m.text,
-            "photo": m.photo, "audio": m.audio,
-            "created_at": m.created_at.isoformat()
-        } for m in msgs]
-    # Приватные сообщения
-
-    last_private_id = req.get("last_private_id", 0)
-    q_private = PrivateMessage.query.filter(
-        or_(
-            and_(PrivateMessage.to_user == me_name),
-            and_(PrivateMessage.from_user == me_name)
-        )
-    )
-    if last_private_id:
-        q_private = q_private.filter(PrivateMessage.id > last_private_id)
-    private_msgs = [{
-        "id": m.id,
-        "to_user": m.to_user,
-        "from_user": m.from_user,
-        "text": m.text,
-        "photo": m.photo,
-        "audio": m.audio,
-        "created_at": m.created_at.isoformat()
-    } for m in q_private.order_by(PrivateMessage.created_at.asc()).all()]
-
-    # SOS
-    new_sos = []
-    last_sos_iso = req.get("last_sos_time")
-    q_sos = Sos.query.filter(and_(Sos.active == True, Sos.closed == False))
-    if last_sos_iso:
-        q_sos = q_sos.filter(Sos.created > datetime.fromisoformat(last_sos_iso))
-    soses = q_sos.order_by(Sos.created.asc()).all()
-    new_sos = [sos_to_json(s) for s in soses]
-
-    # Статус группы
-    group_status = {}
-    if gid:
+        # Статус группы
+        group_status = {}
         g = Group.query.get(gid)
         if g:
             group_status = {
@@ -438,26 +1450,141 @@ def sync():
                 "name": g.name,
                 "members": [usr.username for usr in g.members]
             }
+        res["group_status"] = group_status
+    elif not gid:
+        res["new_messages"] = []
+        res["group_status"] = {}
+
+    if changed(f"u:{me_name}"):
+        # Приватные сообщения: новые после last_private_id, а на первом
+        # синке — только последние сообщения каждого диалога (старое — /private_history)
+        last_private_id = req.get("last_private_id", 0)
+        has_more = False
+        if last_private_id:
+            page = app.config["MESSAGES_PAGE_MAX"]
+            private_msgs = _private_since(me_name, last_private_id, page + 1)
+            has_more = len(private_msgs) > page
+            private_msgs = private_msgs[:page]
+        else:
+            private_msgs = _private_backfill(me_name, app.config["PRIVATE_BACKFILL_PER_PEER"])
+        res["private_messages"] = [private_message_to_json(m) for m in private_msgs]
+        res["private_has_more"] = has_more
+        if has_more and client_counters is not None:
+            # Страница обрезана: оставляем клиенту старый счётчик, иначе
+            # следующий /sync пропустит секцию и хвост не дойдёт
+            counters[f"u:{me_name}"] = client_counters.get(f"u:{me_name}")
+
+        invites = _invites_query(me_name).all()
+        res["group_invites"] = [invite_to_json(inv) for inv in invites]
+
+    # Потерянные оповещения (вытеснены, перезапуск, другой воркер) не
+    # требуют лишнего запроса: новый SOS всегда двигает счётчик "sos"
+    # Список SOS зависит и от позиции: пересчитываем его и без новых SOS,
+    # если пользователь отошёл дальше SOS_RECHECK_KM от прошлого пересчёта
+    moved = sos_view is None or haversine_km(
+        sos_view[0], sos_view[1], my_lat, my_lon) > app.config["SOS_RECHECK_KM"]
+    if changed("sos") or moved:
+        # SOS в радиусе SOS_RADIUS_KM — кандидаты из индекса, строки по id
+        sos_version = counters["sos"] if counters else read_counters(["sos"])["sos"]
+        _refresh_sos_index(sos_version)
+        ids = {e.key for e in _index_near(sos_index, my_lat, my_lon, app.config["SOS_RADIUS_KM"])}
+        soses = []
+        if ids:
+            last_sos_iso = req.get("last_sos_time")
+            since, entered = None, ()
+            # После reset клиент мог пропустить SOS — отдаём все, без last_sos_time
+            if last_sos_iso and not alerts_reset:
+                since = datetime.fromisoformat(last_sos_iso)
+                # Старые SOS, в радиус которых пользователь только что вошёл, —
+                # тоже; без снимка (первый запрос в этом воркере) новыми считаем все
+                entered = ids - sos_view[2] if sos_view is not None else ids
+            soses = _sos_alerts_query(ids, since, entered).all()
+        res["sos_alerts"] = sos_list_to_json(soses, bool(req.get("show_sos_reports")))
+        _save_sos_view(me_name, my_lat, my_lon, ids)
 
     db.session.commit()
 
-    group_invites = []
-    invites = Invite.query.filter_by(to_user=me_name).order_by(Invite.created.asc()).all()
-    group_invites = [{
-        "id": inv.id,
-        "from_user": inv.from_user,
-        "to_user": inv.to_user,
-        "group_id": inv.group_id,
-        "created": inv.created.isoformat()
-    } for inv in invites]
+    if client_counters is not None:
+        res["counters"] = counters
+    return jsonify(res)
 
+
+# ------------------- Push-канал: SSE и long-poll -------------------
+
+def _event_subscription(me_name):
+    """
+    Топики подписки и фильтр событий по параметрам запроса
+    (group_id, lat, lon, radius_km). Единственный запрос к БД — проверка
+    членства в группе при подключении; дальше ожидание идёт без БД.
+    """
+    topics = [f"alert:{me_name}", f"user:{me_name}", "sos"]
+    gid = request.args.get("group_id")
+    if gid and db.session.query(GroupMember).filter_by(user_id=me_name, group_id=gid).first():
+        topics.append(f"group:{gid}")
+
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius_km = request.args.get("radius_km", default=float(os.getenv("USER_RADIUS_KM", 5)), type=float)
+    if lat is not None and lon is not None:
+        topics += [f"pos:{r}:{c}" for r, c in
+                   cells_around(lat, lon, radius_km, app.config["EVENTS_POS_CELL_DEG"])]
+
+    def keep(ev):
+        d = ev["data"]
+        if ev["type"] == "sos" and lat is not None and lon is not None:
+            return haversine_km(lat, lon, d["lat"], d["lon"]) <= app.config["SOS_RADIUS_KM"]
+        if ev["type"] != "position":
+            return True
+        return d["username"] != me_name and \
+            haversine_km(lat, lon, d["lat"], d["lon"]) <= radius_km
+
+    return topics, keep
+
+@app.route("/events/stream", methods=["GET"])
+@jwt_required()
+@single_device_required
+def events_stream():
+    """
+    Server-Sent Events. Курсор — в Last-Event-ID (браузер/клиент шлёт сам
+    при переподключении) или ?cursor=. Событие "reset" значит, что часть
+    событий потеряна и нужно один раз сделать полный /sync.
+    """
+    topics, keep = _event_subscription(get_jwt_identity())
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("cursor")
+    heartbeat = app.config["EVENTS_HEARTBEAT_SEC"]
+    deadline = time.time() + app.config["EVENTS_STREAM_MAX_SEC"]
+
+    def generate(cursor):
+        yield "retry: 3000\n\n"
+        while time.time() < deadline:
+            events, cursor, reset = bus.read(topics, cursor, heartbeat)
+            if reset:
+                yield "event: reset\ndata: {}\n\n"
+            for ev in events:
+                if keep(ev):
+                    data = json.dumps(ev["data"], ensure_ascii=False)
+                    yield f"event: {ev['type']}\ndata: {data}\n\n"
+            # Срочные события идут вне порядка seq, поэтому курсор (id) ставим
+            # один раз после всей пачки: при обрыве посередине клиент получит
+            # пачку повторно, но ничего не потеряет.
+            yield f"id: {cursor}\n\n" if events or reset else ": ping\n\n"
+
+    return Response(generate(cursor), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/events/poll", methods=["GET"])
+@jwt_required()
+@single_device_required
+def events_poll():
+    """Long-poll: ждём до ?timeout= сек (не больше EVENTS_POLL_MAX_SEC)."""
+    topics, keep = _event_subscription(get_jwt_identity())
+    timeout = min(request.args.get("timeout", default=25.0, type=float),
+                  app.config["EVENTS_POLL_MAX_SEC"])
+    events, cursor, reset = bus.read(topics, request.args.get("cursor"), timeout)
     return jsonify(
-        updated_users = users_near,
-        new_messages  = new_group_msgs,
-        sos_alerts    = new_sos,
-        private_messages = private_msgs,
-        group_status  = group_status,
-        group_invites = group_invites
+        events=[{"type": ev["type"], "data": ev["data"]} for ev in events if keep(ev)],
+        cursor=cursor,
+        reset=reset,
     )
 
 
@@ -466,6 +1593,7 @@ def sync():
 def _remove_from_all_groups(user: User):
     for g in list(user.groups):
         g.members.remove(user)
+        bump_counters(f"g:{g.id}")
         # если группа осталась пустой, снести её
         if len(g.members) == 0 and g.created and datetime.utcnow() - g.created >= timedelta(minutes=1):
             db.session.delete(g)
@@ -477,7 +1605,7 @@ def create_group():
     d = request.json
     if Group.query.filter_by(name=d["name"]).first():
         return jsonify(error="exists"), 400
-    usr = User.query.get(get_jwt_identity())
+    usr = current_user()
     _remove_from_all_groups(usr)
     grp = Group(
         name=d["name"],
@@ -487,6 +1615,8 @@ def create_group():
     )
     grp.members.append(usr)
     db.session.add(grp)
+    db.session.flush()
+    bump_counters(f"g:{grp.id}")
     db.session.commit()
     return jsonify(group_id=grp.id)
 
@@ -498,9 +1628,11 @@ def join_group():
     grp = Group.query.get(d["group_id"])
     if not grp:
         return jsonify(error="not_found"), 404
-    usr = User.query.get(get_jwt_identity())
+    usr = current_user()
     _remove_from_all_groups(usr)
     grp.members.append(usr)
+    bump_counters(f"g:{grp.id}")
+    after_commit("cleanup_invites", usr.username, grp.id)
     db.session.commit()
 
     # Сохраняем момент входа
@@ -510,12 +1642,15 @@ def join_group():
         member.joined_msg_id = last_msg_id
         db.session.commit()
 
-    # Удаляем старые инвайты в эту группу
-    Invite.query.filter_by(to_user=usr.username, group_id=grp.id).delete()
-    db.session.commit()
-
     return jsonify(ok=True)
 
+@executor.task("cleanup_invites")
+def _cleanup_invites_task(username, group_id):
+    """Удалить старые инвайты пользователя в группу, в которую он вошёл."""
+    if Invite.query.filter_by(to_user=username, group_id=group_id).delete():
+        bump_counters(f"u:{username}")
+    db.session.commit()
+
 @app.route("/leave_group", methods=["POST"])
 @jwt_required()
 @single_device_required
@@ -524,9 +1659,10 @@ def leave_group():
     grp = Group.query.get(d["group_id"])
     if not grp:
         return jsonify(error="not_found"), 404
-    usr = User.query.get(get_jwt_identity())
+    usr = current_user()
     if usr in grp.members:
         grp.members.remove(usr)
+        bump_counters(f"g:{grp.id}")
     if len(grp.members) == 0 and (not grp.created or datetime.utcnow() - grp.created >= timedelta(minutes=1)):
         db.session.delete(grp)
     db.session.commit()
@@ -536,7 +1672,7 @@ def leave_group():
 @jwt_required()
 @single_device_required
 def my_groups():
-    usr = User.query.get(get_jwt_identity())
+    usr = current_user()
     return jsonify([
         {"id": g.id, "name": g.name}
         for g in usr.groups
@@ -549,18 +1685,22 @@ def public_groups():
     lat = float(request.args.get("lat", 0.0))
     lon = float(request.args.get("lon", 0.0))
     radius = float(request.args.get("radius_km", 5))
-    groups = []
-    for g in Group.query.filter_by(is_public=True).all():
-        dist = _haversine_km(lat, lon, g.lat, g.lon)
-        if dist <= radius:
-            groups.append({
-                "id": g.id,
-                "name": g.name,
-                "lat": g.lat,
-                "lon": g.lon,
-                "members": len(g.members)
-            })
-    return jsonify(groups)
+    rows = db.session.query(Group.id, Group.name, Group.lat, Group.lon) \
+        .filter_by(is_public=True).all()
+    hits = [rows[i] for i in within_radius(
+        lat, lon, [r.lat for r in rows], [r.lon for r in rows], radius)]
+    counts = dict(
+        db.session.query(GroupMember.group_id, db.func.count())
+        .filter(GroupMember.group_id.in_([r.id for r in hits]))
+        .group_by(GroupMember.group_id).all()
+    ) if hits else {}
+    return jsonify([{
+        "id": r.id,
+        "name": r.name,
+        "lat": r.lat,
+        "lon": r.lon,
+        "members": counts.get(r.id, 0)
+    } for r in hits])
 
 
 # ------------------- Сообщения (групповые, приватные) -------------------
@@ -574,50 +1714,95 @@ def send_message():
         form = request.form
         group_id = form.get("group_id")
         text = form.get("text", "")
+        src = form
         audio_fn, photo_fn = _store_media_from_request()
     else:
         d = request.json
         group_id = d.get("group_id")
         text = d.get("text", "")
+        src = d
         audio_fn = d.get("audio")
         photo_fn = d.get("photo")
+    try:
+        audio_fn, photo_fn = _media_from_uploads(src, audio_fn, photo_fn)
+    except UploadNotReady as e:
+        return _upload_not_ready(e)
 
     msg = Message(group_id=group_id, sender=sender,
                   text=text, audio=audio_fn, photo=photo_fn)
 
-    print(f"[PHOTO_DEBUG] photo_fn = {photo_fn}")
-    print(f"[PHOTO_DEBUG] request.files = {request.files}")
+    logging.debug("[MESSAGE] from=%s group=%s audio=%s photo=%s", sender, group_id, audio_fn, photo_fn)
     db.session.add(msg)
+    if group_id:
+        bump_counters(f"g:{group_id}")
     db.session.commit()
+    if group_id:
+        bus.publish(f"group:{group_id}", "message", message_to_json(msg))
     return jsonify(id=msg.id)
 
+def _group_member_query(user_id, gid):
+    return db.session.query(GroupMember).filter_by(user_id=user_id, group_id=gid)
+
+def _group_messages_query(gid, joined_id, since=None):
+    """Сообщения группы после вступления (и после since) по created_at — для /sync."""
+    q = Message.query.filter_by(group_id=gid).filter(Message.id > joined_id)
+    if since is not None:
+        q = q.filter(Message.created_at > since)
+    return q.order_by(Message.created_at.asc())
+
+def _messages_page_query(gid, min_id, before, limit):
+    """Страница /get_messages: id > min_id, с before — последние перед ним (по убыванию id)."""
+    q = Message.query.filter_by(group_id=gid).filter(Message.id > min_id)
+    if before:
+        q = q.filter(Message.id < before).order_by(Message.id.desc())
+    else:
+        q = q.order_by(Message.id.asc())
+    return q.limit(limit)
+
 @app.route("/get_messages", methods=["GET"])
 @jwt_required()
 @single_device_required
 def get_messages():
+    """
+    Keyset-пагинация по id: ?after_id= — вперёд к новым, ?before_id= — назад
+    к старым; ?limit= не больше MESSAGES_PAGE_MAX. Страница всегда по
+    возрастанию id. С limit ответ {"messages": [...], "next_cursor": <id|null>}
+    (next_cursor — следующий after_id/before_id). Без limit — список, как
+    раньше, но не длиннее MESSAGES_PAGE_MAX: клиент дочитывает по after_id,
+    а обрезанный ответ помечен заголовками X-Truncated и X-Next-Cursor.
+    """
     gid = request.args.get("group_id")
-    after = int(request.args.get("after_id", 0))
+    after = request.args.get("after_id", default=0, type=int)
+    before = request.args.get("before_id", type=int)
+    limit = request.args.get("limit", type=int)
+    page_max = app.config["MESSAGES_PAGE_MAX"]
+    page = min(limit, page_max) if limit and limit > 0 else page_max
     user_id = get_jwt_identity()
 
-    member = db.session.query(GroupMember).filter_by(user_id=user_id, group_id=gid).first()
+    def respond(msgs, next_cursor=None):
+        items = [message_to_json(m) for m in msgs]
+        if limit is None:
+            resp = jsonify(items)
+            if next_cursor is not None:
+                resp.headers["X-Truncated"] = "true"
+                resp.headers["X-Next-Cursor"] = str(next_cursor)
+            return resp
+        return jsonify(messages=items, next_cursor=next_cursor)
+
+    member = _group_member_query(user_id, gid).first()
     if not member:
-        return jsonify([])
+        return respond([])
 
     joined_id = member.joined_msg_id or 0
-    min_id = max(after, joined_id)
-
-    q = Message.query.filter_by(group_id=gid).filter(Message.id > min_id)
-    msgs = q.order_by(Message.created_at.asc()).all()
-
-    return jsonify([{
-        "group_id": m.group_id,
-        "id": m.id,
-        "from": m.sender,
-        "text": m.text,
-        "photo": m.photo,
-        "audio": m.audio,
-        "created_at": m.created_at.isoformat()
-    } for m in msgs])
+    msgs = _messages_page_query(gid, max(after, joined_id), before, page + 1).all()
+    more = len(msgs) > page
+    msgs = msgs[:page]
+    if before:
+        msgs.reverse()
+    next_cursor = None
+    if more:
+        next_cursor = msgs[0].id if before else msgs[-1].id
+    return respond(msgs, next_cursor)
 
 @app.route("/send_invite", methods=["POST"])
 @jwt_required()
@@ -633,24 +1818,21 @@ def send_invite():
 
     invite = Invite(from_user=from_user, to_user=to_user, group_id=group_id)
     db.session.add(invite)
+    bump_counters(f"u:{to_user}")
     db.session.commit()
+    bus.publish(f"user:{to_user}", "invite", invite_to_json(invite))
     return jsonify(success=True)
 
+def _invites_query(to_user):
+    return Invite.query.filter_by(to_user=to_user).order_by(Invite.created.asc())
+
 @app.route("/get_invites", methods=["GET"])
 @jwt_required()
 @single_device_required
 def get_invites():
     me = get_jwt_identity()
-    invites = Invite.query.filter_by(to_user=me).order_by(Invite.created.asc()).all()
-    return jsonify([
-        {
-            "id": inv.id,
-            "from_user": inv.from_user,
-            "to_user": inv.to_user,
-            "group_id": inv.group_id,
-            "created": inv.created.isoformat()
-        } for inv in invites
-    ])
+    invites = _invites_query(me).all()
+    return jsonify([invite_to_json(inv) for inv in invites])
 
 @app.route("/reject_invite", methods=["POST"])
 @jwt_required()
@@ -666,32 +1848,136 @@ def reject_invite():
     inv = Invite.query.filter_by(id=invite_id, to_user=me).first()
     if inv:
         db.session.delete(inv)
+        bump_counters(f"u:{me}")
         db.session.commit()
         return jsonify(success=True)
 
     return jsonify(error="not_found"), 404
 
+def _by_id_page(q, limit, desc=False):
+    return q.order_by(PrivateMessage.id.desc() if desc else PrivateMessage.id.asc()).limit(limit)
+
+def _merge_by_id(queries, limit, desc=False):
+    """
+    Вместо OR — несколько запросов, каждый по своему индексу (…, id),
+    и слияние уже отсортированных результатов. Дубли (сообщение самому
+    себе попадает в обе выборки) отбрасываются.
+    """
+    parts = [_by_id_page(q, limit, desc).all() for q in queries]
+    out, seen = [], set()
+    for m in heapq.merge(*parts, key=lambda m: m.id, reverse=desc):
+        if m.id not in seen:
+            seen.add(m.id)
+            out.append(m)
+            if len(out) == limit:
+                break
+    return out
+
+def _private_since_queries(me_name, last_id):
+    """Входящие и исходящие с id > last_id — отдельные запросы для _merge_by_id."""
+    return [
+        PrivateMessage.query.filter(PrivateMessage.to_user == me_name, PrivateMessage.id > last_id),
+        PrivateMessage.query.filter(PrivateMessage.from_user == me_name, PrivateMessage.id > last_id),
+    ]
+
+def _private_since(me_name, last_id, limit):
+    """Личные сообщения (входящие и исходящие) с id > last_id, по возрастанию."""
+    return _merge_by_id(_private_since_queries(me_name, last_id), limit)
+
+def _private_backfill_queries(me_name, per_peer):
+    """
+    Входящие и исходящие: последние per_peer сообщений по каждому собеседнику
+    (row_number() по (собеседник, id desc)) — по запросу на направление.
+    """
+    def window(own_col, peer_col):
+        rn = db.func.row_number().over(
+            partition_by=peer_col, order_by=PrivateMessage.id.desc()).label("rn")
+        sub = db.session.query(PrivateMessage.id.label("id"), rn) \
+            .filter(own_col == me_name).subquery()
+        return PrivateMessage.query.join(sub, sub.c.id == PrivateMessage.id) \
+            .filter(sub.c.rn <= per_peer)
+
+    return [window(PrivateMessage.to_user, PrivateMessage.from_user),
+            window(PrivateMessage.from_user, PrivateMessage.to_user)]
+
+def _private_backfill(me_name, per_peer):
+    """Последние per_peer сообщений каждого диалога, по возрастанию id."""
+    rows = {}
+    for q in _private_backfill_queries(me_name, per_peer):
+        rows.update((m.id, m) for m in q)
+
+    # В каждой выборке лимит по одному направлению — обрезаем диалог целиком
+    taken, out = {}, []
+    for m in sorted(rows.values(), key=lambda m: m.id, reverse=True):
+        peer = m.to_user if m.from_user == me_name else m.from_user
+        if taken.get(peer, 0) < per_peer:
+            taken[peer] = taken.get(peer, 0) + 1
+            out.append(m)
+    out.reverse()
+    return out
+
+def _private_history_queries(me_name, peer, before=None):
+    """Диалог с peer (до before) — входящие и исходящие для _merge_by_id."""
+    queries = [
+        PrivateMessage.query.filter(PrivateMessage.to_user == me_name, PrivateMessage.from_user == peer),
+        PrivateMessage.query.filter(PrivateMessage.from_user == me_name, PrivateMessage.to_user == peer),
+    ]
+    if before:
+        queries = [q.filter(PrivateMessage.id < before) for q in queries]
+    return queries
+
+@app.route("/private_history", methods=["GET"])
+@jwt_required()
+@single_device_required
+def private_history():
+    """
+    Старые страницы диалога: ?peer=<username>&before_id=<id>&limit=<n>.
+    Ответ {"messages": [...по возрастанию id], "next_cursor": <before_id|null>}.
+    """
+    me = get_jwt_identity()
+    peer = request.args.get("peer")
+    if not peer:
+        return jsonify(error="peer is required"), 400
+    before = request.args.get("before_id", type=int)
+    limit = request.args.get("limit", type=int)
+    page_max = app.config["MESSAGES_PAGE_MAX"]
+    page = min(limit, page_max) if limit and limit > 0 else page_max
+
+    msgs = _merge_by_id(_private_history_queries(me, peer, before), page + 1, desc=True)
+    more = len(msgs) > page
+    msgs = msgs[:page]
+    msgs.reverse()
+    return jsonify(
+        messages=[private_message_to_json(m) for m in msgs],
+        next_cursor=msgs[0].id if more else None,
+    )
+
 @app.route("/send_private_message", methods=["POST"])
 @jwt_required()
 @single_device_required
 def send_private_message():
     sender = get_jwt_identity()  # Это логин отправителя
-    print(f"[DEBUG] Отправитель: {sender}")
 
     # Проверяем тип запроса: multipart (если есть медиа) или JSON
     if request.content_type and request.content_type.startswith("multipart"):
         form = request.form
         to_user = form.get("to_user")
         text = form.get("text", "")
+        src = form
         audio_fn, photo_fn = _store_media_from_request()
     else:
         d = request.json
         to_user = d.get("to_user")
         text = d.get("text", "")
+        src = d
         audio_fn = d.get("audio")
         photo_fn = d.get("photo")
+    try:
+        audio_fn, photo_fn = _media_from_uploads(src, audio_fn, photo_fn)
+    except UploadNotReady as e:
+        return _upload_not_ready(e)
 
-    print(f"[SAVE] from={sender}, to={to_user}, text={text}")
+    logging.debug("[PRIVATE] from=%s to=%s audio=%s photo=%s", sender, to_user, audio_fn, photo_fn)
 
     if not to_user:
         return jsonify({"error": "to_user is required"}), 400
@@ -705,8 +1991,14 @@ def send_private_message():
     )
 
     db.session.add(msg)
+    bump_counters(f"u:{to_user}", f"u:{sender}")
     db.session.commit()
 
+    data = private_message_to_json(msg)
+    bus.publish(f"user:{to_user}", "private_message", data)
+    if to_user != sender:
+        bus.publish(f"user:{sender}", "private_message", data)
+
     return jsonify({"id": msg.id}), 200
 
 # ------------------- SOS -------------------
@@ -728,8 +2020,9 @@ def sos():
         # До 3-х файлов: photo1, photo2, photo3
         for key in ["photo1", "photo2", "photo3"]:
             if key in request.files:
-                fn = save_uploaded_file(request.files[key], "jpg")
+                fn = save_uploaded_file(request.files[key], "jpg", background=True)
                 files.append(fn)
+        upload_ids = [x for x in f.get("photo_upload_ids", "").split(",") if x]
     else:
         d = request.json or {}
         lat = d.get("lat", 0.0)
@@ -739,6 +2032,13 @@ def sos():
         is_danger = bool(d.get("is_danger", False))
         if d.get("photos"):
             files = d["photos"] if isinstance(d["photos"], list) else [d["photos"]]
+        upload_ids = d.get("photo_upload_ids") or []
+        if not isinstance(upload_ids, list):
+            upload_ids = [upload_ids]
+    try:
+        files = files + [_uploaded_name(uid) for uid in upload_ids]
+    except UploadNotReady as e:
+        return _upload_not_ready(e)
     entry = Sos(
         username=get_jwt_identity(),
         lat=lat, lon=lon,
@@ -748,8 +2048,12 @@ def sos():
         photos=",".join(files)
     )
     db.session.add(entry)
+    bump_counters("sos")
+    db.session.flush()
+    after_commit("dispatch_sos", entry.id)
     db.session.commit()
     logging.warning("SOS from %s @ %s,%s", entry.username, entry.lat, entry.lon)
+    bus.publish("sos", "sos", sos_to_json(entry))
     return jsonify(id=entry.id)
 
 # ------------------- Маршруты (create / points / comments / list) -------------------
@@ -770,15 +2074,162 @@ def create_route():
 @single_device_required
 def add_route_point():
     d = request.json
+    # FOR UPDATE: статистика маршрута обновляется последовательно, seal_route ждёт
+    route = Route.query.filter_by(id=d["route_id"]).with_for_update().first()
+    if not route:
+        return jsonify(error="not_found"), 404
+    if route.sealed:
+        return jsonify(error="route_sealed"), 409
     pt = RoutePoint(
         route_id=d["route_id"],
         lat=d["lat"],
-        lon=d["lon"]
+        lon=d["lon"],
+        ts=datetime.utcnow()
     )
     db.session.add(pt)
+    _update_route_stats(route, [(pt.lat, pt.lon, pt.ts)])
     db.session.commit()
     return jsonify(id=pt.id)
 
+def _add_route_cells(rid, cells):
+    """Дописать в route_cells ячейки, которых у маршрута ещё нет."""
+    if not cells:
+        return
+    existing = set(db.session.query(RouteCell.row, RouteCell.col).filter(
+        RouteCell.route_id == rid, db.tuple_(RouteCell.row, RouteCell.col).in_(list(cells))))
+    new = cells - existing
+    if new:
+        db.session.execute(RouteCell.__table__.insert(), [
+            {"route_id": rid, "row": row, "col": col} for row, col in new
+        ])
+
+def _recompute_route_stats(route):
+    """Полный пересчёт статистики и ячеек трека по всем точкам маршрута (потоково)."""
+    stats = TrackStats()
+    cells, prev = set(), None
+    cell_deg = app.config["ROUTE_CELL_DEG"]
+    for lat, lon, ts in _route_rows(route):
+        stats.add(lat, lon, ts)
+        cells |= track_cells([prev, (lat, lon)] if prev else [(lat, lon)], cell_deg)
+        prev = (lat, lon)
+    stats.apply_to(route)
+    RouteCell.query.filter_by(route_id=route.id).delete(synchronize_session=False)
+    _add_route_cells(route.id, cells)
+
+def _update_route_stats(route, points):
+    """
+    Досчитать статистику маршрута по новым точкам [(lat, lon, ts)].
+    Строка маршрута должна быть заблокирована текущей транзакцией.
+    Точки старше уже известного конца трека меняют длину в середине —
+    тогда статистика пересчитывается целиком. Заодно пополняется route_cells.
+    """
+    points = sorted(points, key=lambda p: p[2])
+    if route.end_ts is not None and points[0][2] < route.end_ts:
+        db.session.flush()
+        _recompute_route_stats(route)
+        return
+    stats = TrackStats.of(route)
+    line = [(stats.last_lat, stats.last_lon)] if stats.last_lat is not None else []
+    for lat, lon, ts in points:
+        stats.add(lat, lon, ts)
+        line.append((lat, lon))
+    stats.apply_to(route)
+    _add_route_cells(route.id, track_cells(line, app.config["ROUTE_CELL_DEG"]))
+
+def _parse_point_ts(value, now):
+    """ts точки: unix-секунды, ISO-строка или None (= сейчас)."""
+    if value is None:
+        return now
+    if isinstance(value, str):
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)   # наивное время считаем UTC
+        return dt.timestamp()
+    return float(value)
+
+def _route_points_from_request():
+    """
+    Пачка точек из запроса: список (lat, lon, ts).
+      * application/octet-stream — тело в формате track_codec (дельты + varint),
+        route_id и seq в query-параметрах;
+      * JSON {"route_id", "seq", "points": [{"lat", "lon", "ts"}, ...]}.
+    """
+    now = time.time()
+    if request.mimetype == "application/octet-stream":
+        args = request.args
+        points = track_codec.decode(request.get_data())
+        return args.get("route_id"), args.get("seq", type=int), points
+    d = request.get_json(silent=True)
+    if not isinstance(d, dict):
+        raise TypeError("body must be a JSON object")
+    raw = d.get("points") or []
+    if not isinstance(raw, list) or not all(isinstance(p, dict) for p in raw):
+        raise TypeError("points must be a list of objects")
+    points = [(float(p["lat"]), float(p["lon"]), _parse_point_ts(p.get("ts"), now)) for p in raw]
+    seq = d.get("seq")
+    return d.get("route_id"), int(seq) if seq is not None else None, points
+
+@app.route("/add_route_points", methods=["POST"])
+@jwt_required()
+@single_device_required
+def add_route_points():
+    """
+    Пакетная загрузка точек трека одним executemany в одной транзакции.
+    seq — номер пачки у клиента (растёт монотонно, следующая пачка уходит
+    после ответа на предыдущую): повтор последней принятой пачки ничего не
+    вставляет и возвращает duplicate=true; пачка с seq меньше last_seq
+    отклоняется 409 seq_out_of_order — она не сохранена, last_seq в ответе.
+    """
+    try:
+        route_id, seq, points = _route_points_from_request()
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify(error="bad_points", detail=str(e)), 400
+    if not route_id or seq is None:
+        return jsonify(error="route_id and seq are required"), 400
+    if not points:
+        return jsonify(error="empty_batch"), 400
+    if len(points) > app.config["ROUTE_BATCH_MAX"]:
+        return jsonify(error="batch_too_large", max=app.config["ROUTE_BATCH_MAX"]), 413
+    max_ts = time.time() + 24 * 3600
+    bad = [i for i, (lat, lon, ts) in enumerate(points)
+           if not track_codec.valid_point(lat, lon) or not 0 < ts < max_ts]
+    if bad:
+        return jsonify(error="bad_points", indexes=bad[:20]), 400
+
+    route = Route.query.get(route_id)
+    if not route:
+        return jsonify(error="not_found"), 404
+    if route.owner != get_jwt_identity():
+        return jsonify(error="forbidden"), 403
+
+    if route.sealed:
+        return jsonify(error="route_sealed"), 409
+
+    # Атомарно "занять" seq: параллельный повтор той же пачки получит 0 строк
+    claimed = db.session.query(Route).filter(
+        Route.id == route_id,
+        db.or_(Route.sealed == None, Route.sealed == False),
+        db.or_(Route.last_seq == None, Route.last_seq < seq),
+    ).update({Route.last_seq: seq}, synchronize_session=False)
+    if not claimed:
+        db.session.rollback()
+        route = Route.query.get(route_id)
+        if route.sealed:
+            return jsonify(error="route_sealed"), 409
+        if seq < (route.last_seq or 0):
+            return jsonify(error="seq_out_of_order", last_seq=route.last_seq), 409
+        return jsonify(accepted=0, duplicate=True, last_seq=route.last_seq)
+    # Строка уже заблокирована UPDATE'ом — перечитываем актуальную статистику
+    db.session.refresh(route)
+
+    rows = [(lat, lon, datetime.utcfromtimestamp(ts)) for lat, lon, ts in points]
+    db.session.execute(RoutePoint.__table__.insert(), [
+        {"route_id": route_id, "lat": lat, "lon": lon, "ts": ts} for lat, lon, ts in rows
+    ])
+    _update_route_stats(route, rows)
+    db.session.commit()
+    return jsonify(accepted=len(points), duplicate=False, last_seq=seq)
+
 @app.route("/add_route_comment", methods=["POST"])
 @jwt_required()
 @single_device_required
@@ -789,13 +2240,19 @@ def add_route_comment():
         lat = float(f["lat"])
         lon = float(f["lon"])
         text = f.get("text", "")
-        photo_fn, _ = _store_media_from_request()
+        src = f
+        _, photo_fn = _store_media_from_request()
     else:
         d = request.json
         route_id = d["route_id"]
         lat, lon = d["lat"], d["lon"]
         text = d.get("text", "")
+        src = d
         photo_fn = d.get("photo")
+    try:
+        _, photo_fn = _media_from_uploads(src, photo_fn=photo_fn)
+    except UploadNotReady as e:
+        return _upload_not_ready(e)
 
     cm = RouteComment(
         route_id=route_id,
@@ -804,53 +2261,357 @@ def add_route_comment():
         photo=photo_fn
     )
     db.session.add(cm)
+    db.session.query(Route).filter_by(id=route_id).update(
+        {Route.comment_count: func.coalesce(Route.comment_count, 0) + 1},
+        synchronize_session=False)
     db.session.commit()
     return jsonify(id=cm.id)
 
-@app.route("/get_route", methods=["GET"])
-@jwt_required()
-@single_device_required
-def get_route():
-    rid = request.args.get("route_id")
-    route = Route.query.get(rid)
-    if not route:
-        return jsonify(error="not_found"), 404
+route_lod_cache = TTLCache(maxsize=app.config["ROUTE_LOD_CACHE_MAX"],
+                           ttl=app.config["ROUTE_LOD_CACHE_TTL"])
+
+def _route_fingerprint(route):
+    """
+    (число точек, последний ts) из денормализованной статистики строки
+    маршрута: _update_route_stats меняет их в той же транзакции, что и
+    вставку точек, так что запросов к route_points не нужно.
+    """
+    return route.point_count, route.end_ts
+
+def _route_points_query(rid):
+    return db.session.query(RoutePoint.lat, RoutePoint.lon, RoutePoint.ts) \
+        .filter(RoutePoint.route_id == rid).order_by(RoutePoint.ts.asc())
+
+def _route_rows(route):
+    """(lat, lon, ts) маршрута по возрастанию ts — из блоба или из route_points."""
+    if route.sealed:
+        return ((lat, lon, datetime.utcfromtimestamp(ts)) for lat, lon, ts in track_codec.unpack(route.track))
+    return _route_points_query(route.id).yield_per(app.config["ROUTE_STREAM_BATCH"])
 
-    return jsonify({
+def _simplified_track(route):
+    """
+    SimplifiedTrack маршрута из кэша воркера. Ключ сверяется с отпечатком
+    из БД, поэтому новые точки (в т.ч. через другой воркер) сбрасывают кэш.
+    Возвращает (track, memo), memo — уже посчитанные уровни по zoom.
+    """
+    rid = route.id
+    fp = ("sealed", route.sealed_at) if route.sealed else _route_fingerprint(route)
+    cached = route_lod_cache.get(rid)
+    if cached is not None and cached[0] == fp:
+        return cached[1], cached[2]
+    lats, lons, ts = [], [], []
+    for lat, lon, t in _route_rows(route):
+        lats.append(lat)
+        lons.append(lon)
+        ts.append(t)
+    track, memo = SimplifiedTrack(lats, lons, ts), {}
+    route_lod_cache.set(rid, (fp, track, memo))
+    return track, memo
+
+def _route_header(route):
+    return {
         "id":        route.id,
         "name":      route.name,
         "owner":     route.owner,
-        "created":   route.created.isoformat(),
-        "route_points": [
-            {
-                "lat": p.lat, "lon": p.lon,
-                "ts": p.ts.isoformat()
-            } for p in route.points
-        ],
+        "created":   iso(route.created),
         "route_comments": [
             {
                 "lat": c.lat, "lon": c.lon,
                 "text": c.text, "photo": c.photo,
-                "ts": c.ts.isoformat()
+                "ts": iso(c.ts)
             } for c in route.comments
         ]
-    })
+    }
+
+def _stream_route(route):
+    """Полная детализация: точки по ts, сериализуются пачками, без списка в памяти."""
+    rows = _route_rows(route)
+    head = json.dumps(_route_header(route), ensure_ascii=False)
+    batch = app.config["ROUTE_STREAM_BATCH"]
+
+    def generate():
+        yield head[:-1] + ', "route_points": ['
+        sep, chunk = "", []
+        for lat, lon, ts in rows:
+            chunk.append(app.json.dumps({"lat": lat, "lon": lon, "ts": iso(ts)}))
+            if len(chunk) >= batch:
+                yield sep + ",".join(chunk)
+                sep, chunk = ",", []
+        if chunk:
+            yield sep + ",".join(chunk)
+        yield "]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@app.route("/get_route", methods=["GET"])
+@jwt_required()
+@single_device_required
+def get_route():
+    """
+    ?route_id=   — маршрут;
+    ?tolerance=  — допуск упрощения в метрах (Douglas–Peucker), или
+    ?zoom=       — допуск подбирается под масштаб карты (ROUTE_LOD_PX пикселей);
+    ?format=polyline — точки одной строкой encoded polyline (без ts).
+    Без tolerance/zoom и format=json точки отдаются потоком в порядке ts.
+    """
+    args = request.args
+    rid = args.get("route_id")
+    route = Route.query.options(db.undefer(Route.track)).get(rid)
+    if not route:
+        return jsonify(error="not_found"), 404
+    fmt = args.get("format", "json")
+    if fmt not in ("json", "polyline"):
+        return jsonify(error="bad_format"), 400
+    tolerance = args.get("tolerance", type=float)
+    zoom = args.get("zoom", type=float)
+    precision = min(max(args.get("precision", 5, type=int), 1), 7)
+    if tolerance is None and zoom is None and fmt == "json":
+        return _stream_route(route)
+
+    track, memo = _simplified_track(route)
+    # Уровни по zoom конечны — их результат запоминаем вместе с треком
+    key = None
+    if tolerance is None:
+        if zoom is not None:
+            key = (round(zoom, 1), fmt, precision)
+            tolerance = zoom_tolerance(zoom, track.center_lat(), app.config["ROUTE_LOD_PX"])
+        else:
+            tolerance = 0.0
+    payload = memo.get(key) if key else None
+    if payload is None:
+        idx = track.level(tolerance)
+        if fmt == "polyline":
+            payload = {"route_polyline": encode_polyline(
+                ((track.lats[i], track.lons[i]) for i in idx), precision)}
+        else:
+            ts_iso = track.ts_iso()
+            payload = {"route_points": [
+                {"lat": track.lats[i], "lon": track.lons[i], "ts": ts_iso[i]}
+                for i in idx
+            ]}
+        payload["lod"] = {"tolerance_m": round(tolerance, 3), "points": len(idx),
+                          "points_total": len(track)}
+        if fmt == "polyline":
+            payload["lod"]["precision"] = precision
+        if key:
+            memo[key] = payload
+
+    out = _route_header(route)
+    out.update(payload)
+    return jsonify(out)
+
+def route_to_json(r):
+    return {
+        "id":          r.id,
+        "name":        r.name,
+        "created":     iso(r.created),
+        "points":      r.point_count or 0,
+        "comments":    r.comment_count or 0,
+        "distance_km": round(r.distance_km or 0.0, 3),
+        "bbox":        [r.min_lat, r.min_lon, r.max_lat, r.max_lon] if r.min_lat is not None else None,
+        "start_ts":    iso(r.start_ts) if r.start_ts else None,
+        "end_ts":      iso(r.end_ts) if r.end_ts else None,
+        "sealed":      bool(r.sealed),
+    }
+
+def _routes_page_query(owner, before, limit):
+    """Страница /list_routes, новые первыми; before — (created, id) из курсора."""
+    q = Route.query.filter_by(owner=owner)
+    if before is not None:
+        q = q.filter(db.tuple_(Route.created, Route.id) < before)
+    return q.order_by(Route.created.desc(), Route.id.desc()).limit(limit)
 
 @app.route("/list_routes", methods=["GET"])
 @jwt_required()
 @single_device_required
 def list_routes():
+    """
+    Маршруты пользователя; один запрос по индексу (owner, created).
+    ?limit= (не больше ROUTES_PAGE_MAX) и ?cursor= из next_cursor предыдущей
+    страницы: ответ {"routes": [...], "next_cursor": ...}, новые первыми.
+    Без limit и cursor — как раньше: список всех маршрутов, старые первыми.
+    """
     me = get_jwt_identity()
-    routes = Route.query.filter_by(owner=me).all()
-    return jsonify([
-        {
-            "id":       r.id,
-            "name":     r.name,
-            "created":  r.created.isoformat(),
-            "points":   len(r.points),
-            "comments": len(r.comments)
-        } for r in routes
-    ])
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    page_max = app.config["ROUTES_PAGE_MAX"]
+    page = min(limit, page_max) if limit and limit > 0 else page_max
+
+    if limit is None and not cursor:
+        # Старые клиенты не умеют дочитывать страницы — отдаём всё
+        routes = Route.query.filter_by(owner=me).order_by(Route.created.asc(), Route.id.asc()).all()
+        return jsonify([route_to_json(r) for r in routes])
+    before = None
+    if cursor:
+        created, _, rid = cursor.partition("|")
+        try:
+            before = (datetime.fromisoformat(created), rid)
+        except ValueError:
+            return jsonify(error="bad_cursor"), 400
+    routes = _routes_page_query(me, before, page + 1).all()
+    more = len(routes) > page
+    routes = routes[:page]
+    items = [route_to_json(r) for r in routes]
+    next_cursor = f"{routes[-1].created.isoformat()}|{routes[-1].id}" if more else None
+    return jsonify(routes=items, next_cursor=next_cursor)
+
+def _route_cells_query(cells):
+    """
+    (route_id, row, col) из прямоугольника строк/столбцов, покрывающего
+    ячейки (по индексу row, col); лишние ячейки отсекает _routes_in_cells.
+    """
+    rows = sorted({r for r, _ in cells})
+    cols = sorted({c for _, c in cells})
+    return db.session.query(RouteCell.route_id, RouteCell.row, RouteCell.col) \
+        .filter(RouteCell.row.between(rows[0], rows[-1]), RouteCell.col.in_(cols))
+
+def _routes_in_cells(cells):
+    """(route_id, (row, col)) маршрутов, проходящих через данные ячейки."""
+    wanted = set(cells)
+    return [(rid, (row, col)) for rid, row, col in _route_cells_query(cells) if (row, col) in wanted]
+
+def _routes_by_bbox(min_lat, min_lon, max_lat, max_lon, order_by, limit):
+    """
+    Запрос не больше limit маршрутов, чей bbox пересекает заданный
+    (min_lon > max_lon — через 180°), в порядке order_by.
+    """
+    q = db.session.query(Route.id, Route.min_lat, Route.min_lon, Route.max_lat, Route.max_lon) \
+        .filter(Route.min_lat <= max_lat, Route.max_lat >= min_lat)
+    if min_lon <= max_lon:
+        q = q.filter(Route.min_lon <= max_lon, Route.max_lon >= min_lon)
+    else:
+        q = q.filter(db.or_(Route.max_lon >= min_lon, Route.min_lon <= max_lon))
+    return q.order_by(*order_by).limit(limit)
+
+def _parse_bbox(value):
+    min_lat, min_lon, max_lat, max_lon = (float(x) for x in value.split(","))
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("bad bbox")
+    return min_lat, min_lon, max_lat, max_lon
+
+@app.route("/routes_near", methods=["GET"])
+@jwt_required()
+@single_device_required
+def routes_near():
+    """
+    Маршруты, трек которых проходит не дальше ?radius_km= от (?lat=, ?lon=),
+    или пересекает ?bbox=min_lat,min_lon,max_lat,max_lon.
+    Кандидаты берутся из route_cells (ячейки, через которые идёт трек), так что
+    route_points не читается; точность — до размера ячейки ROUTE_CELL_DEG,
+    near_km — расстояние до ближайшей такой ячейки. Области больше
+    ROUTES_NEAR_MAX_CELLS ячеек ищутся грубее, по bbox маршрутов, и не больше
+    чем среди ROUTES_NEAR_SCAN_MAX кандидатов (новейших для bbox, ближайших
+    по центру для радиуса). total — число найденных кандидатов; если их
+    больше лимита, total_capped=true и total — нижняя оценка.
+    """
+    args = request.args
+    cell_deg = app.config["ROUTE_CELL_DEG"]
+    page_max = app.config["ROUTES_PAGE_MAX"]
+    limit = args.get("limit", type=int)
+    limit = min(limit, page_max) if limit and limit > 0 else page_max
+    lat, lon = args.get("lat", type=float), args.get("lon", type=float)
+    scan_max = app.config["ROUTES_NEAR_SCAN_MAX"]
+    capped = False
+
+    dist = {}   # route_id -> расстояние (км) или None для bbox-запроса
+    by_distance = not args.get("bbox")
+    if not by_distance:
+        try:
+            bbox = _parse_bbox(args["bbox"])
+        except ValueError:
+            return jsonify(error="bad_bbox"), 400
+        cells = bbox_cells(*bbox, cell_deg)
+        if len(cells) <= app.config["ROUTES_NEAR_MAX_CELLS"]:
+            dist = {rid: None for rid, _ in _routes_in_cells(cells)}
+        else:
+            rows = _routes_by_bbox(*bbox, order_by=(Route.created.desc(), Route.id.desc()),
+                                   limit=scan_max + 1).all()
+            capped = len(rows) > scan_max
+            dist = {row.id: None for row in rows[:scan_max]}
+    elif lat is not None and lon is not None:
+        radius = min(args.get("radius_km", 5.0, type=float), app.config["ROUTES_NEAR_MAX_KM"])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180) or radius <= 0:
+            return jsonify(error="bad_params"), 400
+        cell_dist = {}
+        for cell in cells_around(lat, lon, radius, cell_deg):
+            d = cell_distance_km(lat, lon, cell, cell_deg)
+            if d <= radius:
+                cell_dist[cell] = d
+        if len(cell_dist) <= app.config["ROUTES_NEAR_MAX_CELLS"]:
+            for rid, cell in _routes_in_cells(list(cell_dist)):
+                d = cell_dist[cell]
+                if d < dist.get(rid, math.inf):
+                    dist[rid] = d
+        else:
+            dlat, dlon = radius_to_deg(lat, radius)
+            min_lon = (lon - dlon + 180.0) % 360.0 - 180.0 if dlon < 180 else -180.0
+            max_lon = (lon + dlon + 180.0) % 360.0 - 180.0 if dlon < 180 else 180.0
+            # Сначала маршруты с ближайшим центром bbox (грубо, в градусах)
+            k = math.cos(math.radians(lat))
+            center = (func.abs((Route.min_lat + Route.max_lat) / 2 - lat)
+                      + k * func.abs((Route.min_lon + Route.max_lon) / 2 - lon))
+            rows = _routes_by_bbox(max(lat - dlat, -90.0), min_lon, min(lat + dlat, 90.0), max_lon,
+                                   order_by=(center, Route.id), limit=scan_max + 1).all()
+            capped = len(rows) > scan_max
+            for row in rows[:scan_max]:
+                near_lat = min(max(lat, row.min_lat), row.max_lat)
+                near_lon = min(max(lon, row.min_lon), row.max_lon)
+                d = haversine_km(lat, lon, near_lat, near_lon)
+                if d <= radius:
+                    dist[row.id] = d
+    else:
+        return jsonify(error="lat/lon or bbox required"), 400
+
+    if not dist:
+        routes = []
+    elif by_distance:
+        ids = heapq.nsmallest(limit, dist, key=dist.get)
+        routes = sorted(Route.query.filter(Route.id.in_(ids)).all(), key=lambda r: dist[r.id])
+    else:
+        routes = Route.query.filter(Route.id.in_(list(dist))) \
+            .order_by(Route.created.desc(), Route.id.desc()).limit(limit).all()
+    items = []
+    for r in routes:
+        item = route_to_json(r)
+        item["owner"] = r.owner
+        if by_distance:
+            item["near_km"] = round(dist[r.id], 3)
+        items.append(item)
+    return jsonify(routes=items, total=len(dist), total_capped=capped)
+
+def _seal_route(route):
+    """
+    Упаковать точки маршрута в route.track и удалить строки route_points.
+    Коммит — на вызывающем. Возвращает число упакованных точек.
+    """
+    points, prev = [], route.created or datetime.utcnow()
+    for lat, lon, ts in _route_points_query(route.id).yield_per(app.config["ROUTE_STREAM_BATCH"]):
+        prev = ts or prev
+        points.append((lat, lon, prev.replace(tzinfo=timezone.utc).timestamp()))
+    route.track = track_codec.pack(points)
+    route.sealed = True
+    route.sealed_at = datetime.utcnow()
+    RoutePoint.query.filter_by(route_id=route.id).delete(synchronize_session=False)
+    return len(points)
+
+@app.route("/seal_route", methods=["POST"])
+@jwt_required()
+@single_device_required
+def seal_route():
+    """Завершить маршрут: точки сжимаются в один блоб, новые точки больше не принимаются."""
+    rid = (request.json or {}).get("route_id")
+    # FOR UPDATE: параллельные /add_route_point(s) дождутся конца упаковки
+    route = Route.query.filter_by(id=rid).with_for_update().first()
+    if not route:
+        return jsonify(error="not_found"), 404
+    if route.owner != get_jwt_identity():
+        return jsonify(error="forbidden"), 403
+    if route.sealed:
+        db.session.rollback()
+        return jsonify(success=True, points=track_codec.packed_count(route.track), bytes=len(route.track))
+    count = _seal_route(route)
+    db.session.commit()
+    return jsonify(success=True, points=count, bytes=len(route.track))
 
 
 @app.route("/report_sos", methods=["POST"])
@@ -873,7 +2634,9 @@ def report_sos():
     # Автоскрытие после 3 жалоб
     if SosReport.query.filter_by(sos_id=sos_id).count() >= 3:
         sos.active = False
+        bump_counters("sos")
         db.session.commit()
+        _sos_closed(sos)
     return jsonify(success=True)
 
 @app.route("/delete_sos", methods=["POST"])
@@ -891,7 +2654,9 @@ def delete_sos():
         return jsonify(error="forbidden"), 403
     sos.active = False
     sos.closed = True
+    bump_counters("sos")
     db.session.commit()
+    _sos_closed(sos)
     print(f"[DELETE_SOS] SOS {sos_id} marked as inactive and closed")
     return jsonify(success=True)
 
@@ -908,13 +2673,18 @@ def resolve_sos():
     sos.rescuer = helper
     sos.closed = True
     sos.active = False
+    bump_counters("sos")
+    after_commit("bump_rating", helper)
     db.session.commit()
-    rescuer = User.query.get(helper)
-    if rescuer:
-        rescuer.rating = (rescuer.rating or 0) + 1
-        db.session.commit()
+    _sos_closed(sos)
     return jsonify(success=True)
 
+@executor.task("bump_rating")
+def _bump_rating_task(username):
+    db.session.query(User).filter_by(username=username).update(
+        {User.rating: db.func.coalesce(User.rating, 0) + 1}, synchronize_session=False)
+    db.session.commit()
+
 @app.route("/ban_user", methods=["POST"])
 @jwt_required()
 def ban_user():
@@ -927,7 +2697,137 @@ def ban_user():
         return jsonify(error="not_found"), 404
     u.banned = True
     db.session.commit()
+    session_cache.pop(target)
     return jsonify(success=True)
+
+@app.route("/admin/passwords", methods=["GET"])
+@jwt_required()
+def password_stats():
+    """Пул хеширования паролей этого воркера: очередь, пик, отказы, среднее время."""
+    if get_jwt_identity() != "admin":
+        return jsonify(error="forbidden"), 403
+    return jsonify(passwords.stats())
+
+@app.route("/admin/tasks", methods=["GET"])
+@jwt_required()
+def task_stats():
+    """Метрики фоновых задач этого воркера: очередь, выполненные, повторы, отказы."""
+    if get_jwt_identity() != "admin":
+        return jsonify(error="forbidden"), 403
+    return jsonify(executor.stats())
+# ------------------- CLI -------------------
+
+@app.cli.command("check-query-plans")
+@click.option("--verbose", is_flag=True, help="Печатать планы всех запросов.")
+def check_query_plans_command(verbose):
+    """EXPLAIN горячих запросов на засеянных данных; код 1 при seq scan."""
+    from query_plans import run_checks
+    if run_checks(verbose):
+        raise SystemExit(1)
+
+@app.cli.command("backfill-route-stats")
+@click.option("--batch", default=200, show_default=True, help="Маршрутов на транзакцию.")
+def backfill_route_stats_command(batch):
+    """Пересчитать денормализованную статистику всех маршрутов пачками."""
+    last_id, done = "", 0
+    while True:
+        routes = Route.query.options(db.undefer(Route.track)).filter(Route.id > last_id) \
+            .order_by(Route.id.asc()).limit(batch).with_for_update().all()
+        if not routes:
+            break
+        ids = [r.id for r in routes]
+        comments = dict(db.session.query(RouteComment.route_id, func.count())
+                        .filter(RouteComment.route_id.in_(ids)).group_by(RouteComment.route_id))
+        for r in routes:
+            _recompute_route_stats(r)
+            r.comment_count = comments.get(r.id, 0)
+        db.session.commit()
+        last_id, done = ids[-1], done + len(ids)
+        click.echo(f"{done} routes")
+    click.echo(f"backfilled {done} routes")
+
+@app.cli.command("gc-media")
+@click.option("--grace-hours", default=24.0, show_default=True,
+              help="Удалять файлы без ссылок, не тронутые дольше этого времени.")
+@click.option("--batch", default=500, show_default=True)
+def gc_media_command(grace_hours, batch):
+    """Удалить загрузки, на которые больше никто не ссылается."""
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    removed = 0
+    while True:
+        # SKIP LOCKED: строки, которые сейчас трогает загрузка, пропускаем
+        rows = MediaRef.query.filter(MediaRef.refs <= 0, MediaRef.updated_at < cutoff) \
+            .order_by(MediaRef.name).limit(batch).with_for_update(skip_locked=True).all()
+        if not rows:
+            break
+        for row in rows:
+            media_store.delete(row.name)
+            db.session.delete(row)
+        db.session.commit()
+        removed += len(rows)
+    click.echo(f"removed {removed} files")
+
+    # Брошенные и давно завершённые сессии докачки
+    cutoff = datetime.utcnow() - timedelta(hours=app.config["UPLOAD_SESSION_TTL_HOURS"])
+    expired = UploadSession.query.filter(UploadSession.updated_at < cutoff).all()
+    for sess in expired:
+        try:
+            os.unlink(_session_part(sess))
+        except FileNotFoundError:
+            pass
+        db.session.delete(sess)
+    db.session.commit()
+    click.echo(f"expired {len(expired)} upload sessions")
+
+@app.cli.command("rebuild-media-refs")
+def rebuild_media_refs_command():
+    """Пересчитать media_refs по таблицам и файлам на диске (после массовых правок)."""
+    counts = Counter()
+    for model, cols in MEDIA_COLUMNS.items():
+        for row in db.session.query(*(getattr(model, c) for c in cols)).yield_per(5000):
+            for value in row:
+                counts.update(_media_names(value))
+    for name in media_store.iter_names():
+        if is_hashed(name):
+            counts.setdefault(name, 0)
+    existing = dict(db.session.query(MediaRef.name, MediaRef.refs))
+    now = datetime.utcnow()
+    changed = 0
+    for name, refs in counts.items():
+        if name not in existing:
+            db.session.add(MediaRef(name=name, refs=refs, updated_at=now))
+            changed += 1
+        elif existing[name] != refs:
+            db.session.query(MediaRef).filter_by(name=name).update(
+                {MediaRef.refs: refs, MediaRef.updated_at: now}, synchronize_session=False)
+            changed += 1
+    stale = [name for name, refs in existing.items() if name not in counts and refs]
+    if stale:
+        db.session.query(MediaRef).filter(MediaRef.name.in_(stale)).update(
+            {MediaRef.refs: 0, MediaRef.updated_at: now}, synchronize_session=False)
+    db.session.commit()
+    click.echo(f"{len(counts)} files, {changed + len(stale)} rows updated")
+
+@app.cli.command("seal-routes")
+@click.option("--idle-hours", default=24.0, show_default=True,
+              help="Запечатывать маршруты без новых точек дольше этого времени.")
+def seal_routes_command(idle_hours):
+    """Запечатать завершённые маршруты (по одному на транзакцию)."""
+    cutoff = datetime.utcnow() - timedelta(hours=idle_hours)
+    ids = [rid for rid, in db.session.query(RoutePoint.route_id)
+           .group_by(RoutePoint.route_id).having(func.max(RoutePoint.ts) < cutoff)]
+    sealed = 0
+    for rid in ids:
+        route = Route.query.filter_by(id=rid).with_for_update().first()
+        if route is None or route.sealed:
+            db.session.rollback()
+            continue
+        count = _seal_route(route)
+        db.session.commit()
+        sealed += 1
+        click.echo(f"{rid}: {count} points -> {len(route.track)} bytes")
+    click.echo(f"sealed {sealed} routes")
+
 # ------------------- Запуск -------------------
 
 if __name__ == "__main__":
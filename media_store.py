@@ -0,0 +1,294 @@
+"""
+Хранилище загрузок с адресацией по содержимому.
+
+Файл пишется во временный файл потоково, sha256 считается на лету; имя
+файла — "<sha256>.<ext>", лежит он в шардированной папке root/ab/cd/.
+Одинаковое содержимое хранится один раз. Старые файлы с uuid-именами
+остаются в корне папки и отдаются как раньше.
+
+Подсчёт ссылок (таблица media_refs) и сборка мусора — в main.py: здесь
+только хранилище.
+
+S3MediaStore — те же файлы в S3-совместимом бакете (AWS, MinIO). Клиенты
+загружают и скачивают напрямую по подписанным URL, воркеры байты не трогают;
+локальная папка нужна только как буфер для загрузок, идущих через сервер.
+Нужен boto3 (необязательная зависимость, в requirements.txt не входит:
+pip install boto3).
+"""
+import base64
+import contextlib
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # boto3 нужен только для S3
+    boto3 = None
+
+CHUNK = 64 * 1024
+HASHED_NAME = re.compile(r"^([0-9a-f]{64})\.([a-z0-9]{1,8})$")
+_EXT = re.compile(r"^[a-z0-9]{1,8}$")
+
+
+def is_hashed(name):
+    return bool(name) and HASHED_NAME.match(name) is not None
+
+
+def key_for(name):
+    """Относительный путь файла: "ab/cd/<hash>.<ext>" или имя как есть; None для недопустимых."""
+    if not name or "/" in name or "\\" in name or name.startswith("."):
+        return None
+    m = HASHED_NAME.match(name)
+    if m:
+        digest = m.group(1)
+        return f"{digest[:2]}/{digest[2:4]}/{name}"
+    return name
+
+
+class MediaStore:
+    remote = False
+
+    def __init__(self, root):
+        self.root = root
+        self.tmp_dir = os.path.join(root, ".tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, name):
+        """Путь к файлу по имени; None для недопустимых имён."""
+        key = key_for(name)
+        if key is None:
+            return None
+        return os.path.join(self.root, *key.split("/"))
+
+    @contextlib.contextmanager
+    def local_copy(self, name):
+        """Путь к файлу на диске на время with (None, если файла нет)."""
+        path = self.path_for(name)
+        yield path if path is not None and os.path.isfile(path) else None
+
+    def write_temp(self, stream, ext):
+        """
+        Сохранить поток во временный файл, посчитав sha256.
+        Возвращает (имя по содержимому, путь к временному файлу, размер).
+        """
+        ext = ext.lower()
+        if not _EXT.match(ext):
+            raise ValueError(f"bad extension: {ext!r}")
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = stream.read(CHUNK)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return f"{h.hexdigest()}.{ext}", tmp, size
+
+    def commit_temp(self, name, tmp):
+        """Переместить временный файл на место; если такой файл уже есть — выкинуть копию."""
+        path = self.path_for(name)
+        if os.path.exists(path):
+            os.unlink(tmp)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        return True
+
+    def discard_temp(self, tmp):
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+    def exists(self, name):
+        path = self.path_for(name)
+        return path is not None and os.path.isfile(path)
+
+    def delete(self, name):
+        path = self.path_for(name)
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_names(self, after=None):
+        """
+        Имена всех файлов без построения общего списка: сначала старые из
+        корня, затем шардированные. Порядок стабильный (по имени внутри
+        каждой части), поэтому after=<последнее имя> продолжает обход с
+        места остановки, не перечитывая пройденные шарды.
+        """
+        after_hashed = is_hashed(after)
+        if not after_hashed:
+            legacy = sorted(e.name for e in self._scandir(self.root)
+                            if e.is_file() and not e.name.startswith("."))
+            for name in legacy:
+                if after is None or name > after:
+                    yield name
+        for top in self._subdirs(self.root):
+            if after_hashed and top < after[:2]:
+                continue
+            for sub in self._subdirs(os.path.join(self.root, top)):
+                if after_hashed and top + sub < after[:4]:
+                    continue
+                leaf = os.path.join(self.root, top, sub)
+                for name in sorted(e.name for e in self._scandir(leaf) if e.is_file()):
+                    if not after_hashed or name > after:
+                        yield name
+
+    @staticmethod
+    def _scandir(path):
+        try:
+            with os.scandir(path) as it:
+                return list(it)
+        except FileNotFoundError:
+            return []
+
+    def _subdirs(self, path):
+        return sorted(e.name for e in self._scandir(path)
+                      if e.is_dir() and len(e.name) == 2 and not e.name.startswith("."))
+
+
+class S3MediaStore(MediaStore):
+    """
+    Файлы в бакете: <prefix>media/<key_for(name)>, уменьшенные копии —
+    <prefix>thumbs/... . root — локальная папка для временных файлов.
+    """
+    remote = True
+
+    def __init__(self, root, bucket, prefix="", endpoint_url=None, region=None,
+                 access_key=None, secret_key=None, url_expires=3600, client=None):
+        if client is None and boto3 is None:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3")
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.url_expires = url_expires
+        self.client = client or boto3.client(
+            "s3", endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            # MinIO и прочие совместимые сервисы обычно без virtual-host адресации
+            config=BotoConfig(signature_version="s3v4",
+                              s3={"addressing_style": "path" if endpoint_url else "auto"}),
+        )
+
+    def path_for(self, name):
+        return None
+
+    def media_key(self, name):
+        key = key_for(name)
+        return None if key is None else f"{self.prefix}media/{key}"
+
+    def thumb_key(self, rel):
+        return f"{self.prefix}thumbs/{rel}"
+
+    def head(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put_file(self, key, path, content_type=None):
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.upload_file(path, self.bucket, key, ExtraArgs=extra)
+
+    def commit_temp(self, name, tmp):
+        key = self.media_key(name)
+        if not self.head(key):
+            self.put_file(key, tmp, mimetypes.guess_type(name)[0])
+            self.discard_temp(tmp)
+            return True
+        self.discard_temp(tmp)
+        return False
+
+    def exists(self, name):
+        key = self.media_key(name)
+        return key is not None and self.head(key)
+
+    def delete(self, name):
+        """Удалить файл и его уменьшенные копии."""
+        key = self.media_key(name)
+        if key is None or not self.head(key):
+            return False
+        stem = name.rsplit(".", 1)[0]
+        keys = [key] + list(self._list(self.thumb_key(f"{stem[:2]}/{stem}.")))
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+        return True
+
+    @contextlib.contextmanager
+    def local_copy(self, name):
+        """Скачать во временный файл на время with."""
+        key = self.media_key(name)
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                try:
+                    self.client.download_fileobj(self.bucket, key, out)
+                    found = True
+                except ClientError as e:
+                    if e.response["Error"]["Code"] not in ("404", "NoSuchKey", "NotFound"):
+                        raise
+                    found = False
+            yield tmp if found else None
+        finally:
+            self.discard_temp(tmp)
+
+    def _list(self, prefix, start_after=None):
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        for page in self.client.get_paginator("list_objects_v2").paginate(**kwargs):
+            for obj in page.get("Contents", ()):
+                yield obj["Key"]
+
+    def iter_names(self, after=None):
+        """Имена в порядке ключей бакета; after продолжает с места остановки."""
+        prefix = f"{self.prefix}media/"
+        start = self.media_key(after) if after else None
+        for key in self._list(prefix, start_after=start):
+            name = key.rsplit("/", 1)[-1]
+            if key_for(name) == key[len(prefix):]:
+                yield name
+
+    def url_for(self, key, immutable=False):
+        """Подписанная ссылка на скачивание."""
+        params = {"Bucket": self.bucket, "Key": key}
+        if immutable:
+            params["ResponseCacheControl"] = "public, max-age=31536000, immutable"
+        return self.client.generate_presigned_url("get_object", Params=params,
+                                                  ExpiresIn=self.url_expires)
+
+    def upload_url(self, name, sha256_hex, size):
+        """
+        Подписанный PUT для загрузки клиентом напрямую. Хеш и размер входят
+        в подпись (x-amz-checksum-sha256, Content-Length), поэтому хранилище
+        примет только файл с заявленным содержимым и длиной — имя по хешу
+        остаётся честным, а лимит размера проверен до загрузки.
+        Возвращает (url, заголовки, которые клиент обязан отправить).
+        """
+        checksum = base64.b64encode(bytes.fromhex(sha256_hex)).decode()
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        url = self.client.generate_presigned_url("put_object", Params={
+            "Bucket": self.bucket, "Key": self.media_key(name),
+            "ContentType": content_type, "ChecksumSHA256": checksum, "ContentLength": size,
+        }, ExpiresIn=self.url_expires)
+        return url, {"Content-Type": content_type, "Content-Length": str(size),
+                     "x-amz-checksum-sha256": checksum}
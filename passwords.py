@@ -0,0 +1,144 @@
+"""
+Хеширование паролей в отдельных процессах.
+
+generate_password_hash / check_password_hash (scrypt, pbkdf2) намеренно
+дорогие по CPU и держат GIL десятки миллисекунд: пачка логинов в одном
+воркере останавливает все остальные запросы. Здесь они выполняются в
+пуле процессов, а поток запроса только ждёт результат (без GIL).
+
+Ограничения: одновременно не больше max_pending операций (в работе + в
+очереди), сверх этого — PasswordHasherBusy, чтобы шторм логинов не копил
+бесконечную очередь. workers=0 — считать в вызывающем потоке, как раньше.
+
+verify() заодно перехеширует пароль, если хеш сделан другим методом или
+с другими параметрами: новый хеш возвращается вызывающему для сохранения.
+
+Процессы создаются через forkserver (fork из многопоточного воркера
+небезопасен), поэтому, как обычно для multiprocessing, запускаемый скрипт
+должен быть безопасен для повторного импорта (if __name__ == "__main__").
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _method_prefix(method):
+    """Метод с параметрами, как он записан в хеше: "scrypt:32768:8:1"."""
+    return generate_password_hash("", method).split("$", 1)[0]
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(stored, password, method, prefix):
+    """(пароль верный, новый хеш или None). Выполняется в дочернем процессе."""
+    if not check_password_hash(stored, password):
+        return False, None
+    if stored.split("$", 1)[0] != prefix:
+        return True, generate_password_hash(password, method)
+    return True, None
+
+
+class PasswordHasher:
+    def __init__(self, method="scrypt", workers=2, max_pending=64, timeout=10.0):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._pool = None
+        self._prefix = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._peak = 0
+        self._counts = {"hash": 0, "verify": 0, "rehash": 0, "rejected": 0, "timeouts": 0}
+        self._busy_total = 0.0
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Не fork: в воркере уже есть потоки (задачи, буфер координат).
+                # forkserver с предзагрузкой только этого модуля — дочерним
+                # процессам не нужно импортировать приложение.
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            return self._pool
+
+    def _call(self, kind, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counts["rejected"] += 1
+                raise PasswordHasherBusy()
+            self._pending += 1
+            self._peak = max(self._peak, self._pending)
+            self._counts[kind] += 1
+        started = time.monotonic()
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            for attempt in (1, 2):
+                try:
+                    return self._get_pool().submit(fn, *args).result(timeout=self.timeout)
+                except BrokenProcessPool:
+                    # Дочерний процесс убит (OOM и т.п.) — пересоздаём пул один раз
+                    logging.warning("[PASSWORDS] process pool broken, restarting")
+                    with self._lock:
+                        self._pool = None
+                    if attempt == 2:
+                        raise
+                except TimeoutError:
+                    with self._lock:
+                        self._counts["timeouts"] += 1
+                    raise PasswordHasherBusy() from None
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._busy_total += time.monotonic() - started
+
+    def _method_prefix(self):
+        if self._prefix is None:
+            self._prefix = self._call("hash", _method_prefix, self.method)
+        return self._prefix
+
+    def hash(self, password):
+        return self._call("hash", _hash, password, self.method)
+
+    def verify(self, stored, password):
+        """(верный ли пароль, новый хеш, если старый пора обновить, иначе None)."""
+        if not stored:
+            return False, None
+        ok, new_hash = self._call("verify", _verify, stored, password,
+                                  self.method, self._method_prefix())
+        if new_hash:
+            with self._lock:
+                self._counts["rehash"] += 1
+        return ok, new_hash
+
+    def stats(self):
+        with self._lock:
+            calls = self._counts["hash"] + self._counts["verify"]
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "queued": max(0, self._pending - max(self.workers, 1)),
+                "peak_pending": self._peak,
+                "max_pending": self.max_pending,
+                "avg_ms": round(self._busy_total / calls * 1000, 2) if calls else 0.0,
+                **self._counts,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
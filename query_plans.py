@@ -0,0 +1,145 @@
+"""
+Регрессионная проверка планов горячих запросов.
+
+    flask --app main check-query-plans
+
+Засевает немного данных во временной транзакции, делает EXPLAIN каждого
+горячего запроса из sync()/get_messages()/get_invites()/get_route()/list_routes() и
+падает (код 1), если хоть где-то план содержит последовательное
+сканирование таблицы. Запросы строятся теми же функциями main.py
+(_group_messages_query, _private_backfill_queries, ...), что и в
+обработчиках, поэтому правка запроса сразу попадает под проверку. В конце транзакция откатывается. Та же проверка
+запускается в pytest (tests/test_query_plans.py).
+
+PostgreSQL на маленьких таблицах предпочитает Seq Scan, поэтому на время
+проверки включается enable_seqscan = off: seq scan в плане останется только
+там, где подходящего индекса нет вообще. Поддерживается и SQLite
+(EXPLAIN QUERY PLAN, ищем "SCAN <table>" без индекса).
+"""
+import re
+import time
+from datetime import datetime, timedelta
+
+import click
+
+import main
+from main import (
+    app, db, User, Group, GroupMember, Message, PrivateMessage, Invite, Sos,
+    SosReport, Route, RoutePoint, RouteCell, RouteComment, ChangeCounter, ONLINE_WINDOW_SEC,
+)
+
+_SQLITE_SCAN = re.compile(r"\bSCAN (?!CONSTANT)(\w+)(?!.*USING)")
+
+
+def _seed():
+    now = datetime.utcnow()
+    users = [User(username=f"plan_u{i}", password="x", lat=55.0, lon=37.0,
+                  last_seen=time.time()) for i in range(3)]
+    db.session.add_all(users)
+    grp = Group(id="plan-group", name="plan-group")
+    db.session.add(grp)
+    db.session.flush()
+    db.session.add(GroupMember(user_id="plan_u0", group_id=grp.id))
+    db.session.add_all([Message(group_id=grp.id, sender="plan_u0", text=str(i)) for i in range(5)])
+    db.session.add_all([PrivateMessage(from_user="plan_u0", to_user="plan_u1", text=str(i)) for i in range(5)])
+    db.session.add(Invite(from_user="plan_u1", to_user="plan_u0", group_id=grp.id))
+    sos = Sos(username="plan_u1", lat=55.0, lon=37.0, created=now - timedelta(minutes=1))
+    db.session.add(sos)
+    db.session.flush()
+    db.session.add(SosReport(sos_id=sos.id, reporter="plan_u2"))
+    route = Route(id="plan-route", name="plan", owner="plan_u0")
+    db.session.add(route)
+    db.session.flush()
+    db.session.add_all([RoutePoint(route_id=route.id, lat=55.0, lon=37.0) for _ in range(5)])
+    db.session.add(RouteComment(route_id=route.id, lat=55.0, lon=37.0, text="c"))
+    db.session.add(RouteCell(route_id=route.id, row=5500, col=21700))
+    db.session.add(ChangeCounter(key="u:plan_u0", value=1))
+    db.session.flush()
+    return now
+
+
+def hot_queries(now):
+    """(имя, Query) — запросы строят те же функции, что и обработчики."""
+    me, gid, rid = "plan_u0", "plan-group", "plan-route"
+    since = now - timedelta(hours=1)
+    page = app.config["MESSAGES_PAGE_MAX"] + 1
+    since_in, since_out = main._private_since_queries(me, 1)
+    backfill_in, backfill_out = main._private_backfill_queries(me, app.config["PRIVATE_BACKFILL_PER_PEER"])
+    history_in, history_out = main._private_history_queries(me, "plan_u1", before=100)
+    return [
+        ("sync: counters", main._counters_query([f"u:{me}", "sos", f"g:{gid}"])),
+        ("sync: presence refresh", main._presence_query(time.time() - ONLINE_WINDOW_SEC)),
+        ("sync/get_messages: group member", main._group_member_query(me, gid)),
+        ("sync: group messages", main._group_messages_query(gid, 0, since)),
+        ("sync: group status members", db.session.query(User)
+            .join(GroupMember, GroupMember.user_id == User.username).filter(GroupMember.group_id == gid)),
+        ("sync: private messages in", main._by_id_page(since_in, page)),
+        ("sync: private messages out", main._by_id_page(since_out, page)),
+        ("sync: private backfill in", backfill_in),
+        ("sync: private backfill out", backfill_out),
+        ("private_history: in", main._by_id_page(history_in, page, desc=True)),
+        ("private_history: out", main._by_id_page(history_out, page, desc=True)),
+        ("sync: sos index refresh", main._active_sos_query()),
+        ("sync: sos by id", main._sos_alerts_query([1, 2, 3], since, entered={2})),
+        ("sync: sos reports batch", main._sos_reports_query([1, 2, 3])),
+        ("sync/get_invites: invites", main._invites_query(me)),
+        ("get_messages: forward", main._messages_page_query(gid, 0, None, page)),
+        ("get_messages: backward", main._messages_page_query(gid, 0, 100, page)),
+        ("get_route: route", Route.query.filter_by(id=rid)),
+        ("list_routes: page", main._routes_page_query(me, (now, rid), app.config["ROUTES_PAGE_MAX"] + 1)),
+        ("routes_near: cells", main._route_cells_query([(5500, 21700), (5510, 21702)])),
+        ("routes_near: bbox fallback", main._routes_by_bbox(
+            54.0, 36.0, 56.0, 38.0, order_by=(Route.created.desc(), Route.id.desc()),
+            limit=app.config["ROUTES_NEAR_SCAN_MAX"] + 1)),
+        ("get_route: points", main._route_points_query(rid)),
+        ("get_route: comments", RouteComment.query.filter_by(route_id=rid)),
+    ]
+
+
+def _explain(conn, query):
+    compiled = query.statement.compile(
+        dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    rows = conn.exec_driver_sql(prefix + str(compiled), params).fetchall()
+    return [str(r[-1]) for r in rows]
+
+
+def _seq_scans(dialect, plan):
+    if dialect == "sqlite":
+        # SCAN подзапроса (anon_1, subquery-N) — обход уже отобранных строк, не таблицы
+        return [m.group(1) for line in plan for m in [_SQLITE_SCAN.search(line)]
+                if m and m.group(1) in db.metadata.tables]
+    return [line.strip() for line in plan if "Seq Scan" in line]
+
+
+def collect_plans():
+    """[(имя, план, seq scan'ы)] по всем горячим запросам; данные откатываются."""
+    conn = db.session.connection()
+    dialect = conn.dialect.name
+    results = []
+    try:
+        if dialect == "postgresql":
+            conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        now = _seed()
+        for name, query in hot_queries(now):
+            plan = _explain(conn, query)
+            results.append((name, plan, _seq_scans(dialect, plan)))
+    finally:
+        db.session.rollback()
+    return results
+
+
+def run_checks(verbose=False):
+    """Напечатать результаты и вернуть число запросов с seq scan (0 — всё хорошо)."""
+    failed = 0
+    for name, plan, scans in collect_plans():
+        status = "SEQ SCAN" if scans else "ok"
+        click.echo(f"[{status:>8}] {name}" + (f": {', '.join(scans)}" if scans else ""))
+        if verbose or scans:
+            for line in plan:
+                click.echo("            " + line)
+        failed += bool(scans)
+    return failed
@@ -0,0 +1,232 @@
+"""
+Фоновые задачи: побочные эффекты, которые не должны задерживать ответ.
+
+Задача регистрируется по имени (@executor.task("name")) и ставится в очередь
+как (имя, аргументы) — без замыканий, поэтому аргументы должны быть простыми
+значениями (id, строки, числа). Это и есть задел под надёжную очередь:
+бэкенд с тем же интерфейсом (put / get / qsize) поверх Redis или таблицы
+в БД сможет хранить задачи вне процесса.
+
+InProcessBackend — ограниченная очередь в памяти процесса; при перезапуске
+невыполненные задачи теряются, поэтому при остановке воркера очередь
+дорабатывается (drain). Если очередь переполнена, задача выполняется прямо
+в вызывающем потоке: лучше медленный ответ, чем потерянный побочный эффект.
+
+Неудачная задача повторяется с экспоненциальной задержкой до max_retries раз.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+
+class TaskQueueFull(Exception):
+    pass
+
+
+class Task:
+    __slots__ = ("name", "args", "attempt", "enqueued")
+
+    def __init__(self, name, args, attempt=0, enqueued=None):
+        self.name = name
+        self.args = args
+        self.attempt = attempt
+        self.enqueued = time.monotonic() if enqueued is None else enqueued
+
+
+class InProcessBackend:
+    """Очередь с отложенными задачами (для повторов) в памяти процесса."""
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._ready = []          # heap (not_before, n, task)
+        self._n = itertools.count()
+        self._cond = threading.Condition()
+
+    def put(self, task, delay=0.0, force=False):
+        """force — повтор уже принятой задачи, его не отбрасываем по размеру."""
+        with self._cond:
+            if not force and len(self._ready) >= self.maxsize:
+                raise TaskQueueFull(task.name)
+            heapq.heappush(self._ready, (time.monotonic() + delay, next(self._n), task))
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Следующая готовая задача или None по таймауту."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._ready and self._ready[0][0] <= now:
+                    return heapq.heappop(self._ready)[2]
+                wait = deadline - now
+                if self._ready:
+                    wait = min(wait, self._ready[0][0] - now)
+                if wait <= 0 and now >= deadline:
+                    return None
+                self._cond.wait(max(wait, 0.001))
+
+    def qsize(self):
+        return len(self._ready)
+
+
+class TaskExecutor:
+    """
+    Пул потоков над бэкендом очереди. Потоки стартуют лениво — при первой
+    задаче, уже в рабочем процессе (как LocationBuffer).
+    context — фабрика контекста для каждой задачи (например, app.app_context).
+    """
+
+    def __init__(self, backend=None, workers=4, max_retries=3, retry_delay=0.5,
+                 context=None, sync=False):
+        self.backend = backend or InProcessBackend()
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.context = context
+        self.sync = sync              # выполнять сразу в вызывающем потоке (тесты, отладка)
+        self._registry = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._busy = 0
+        self._counts = Counter()      # (событие, имя задачи) -> n
+        self._wait_max = 0.0
+        self._run_total = 0.0
+        self._run_max = 0.0
+
+    def task(self, name):
+        """Декоратор: зарегистрировать функцию под именем."""
+        def register(fn):
+            if name in self._registry:
+                raise ValueError(f"task {name!r} already registered")
+            self._registry[name] = fn
+            return fn
+        return register
+
+    def submit(self, name, *args):
+        if name not in self._registry:
+            raise KeyError(f"unknown task {name!r}")
+        task = Task(name, args)
+        self._count("submitted", name)
+        if self.sync or self._stopped.is_set():
+            self._run_inline(task)
+            return
+        try:
+            self.backend.put(task)
+        except TaskQueueFull:
+            self._count("inline", name)
+            logging.warning("[TASKS] queue full, running %s inline", name)
+            self._run_inline(task)
+            return
+        self._ensure_threads()
+
+    def _run_inline(self, task):
+        while not self._execute(task):
+            if task.attempt > self.max_retries:
+                break
+
+    def _ensure_threads(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers and not self._stopped.is_set():
+                t = threading.Thread(target=self._run, name=f"tasks-{len(self._threads)}",
+                                     daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _count(self, event, name):
+        with self._lock:
+            self._counts[event, name] += 1
+
+    def _execute(self, task):
+        """Выполнить задачу; True — успех или окончательный отказ, False — нужен повтор."""
+        fn = self._registry[task.name]
+        started = time.monotonic()
+        waited = started - task.enqueued
+        try:
+            if self.context is not None:
+                with self.context():
+                    fn(*task.args)
+            else:
+                fn(*task.args)
+        except Exception:
+            task.attempt += 1
+            if task.attempt > self.max_retries:
+                self._count("failed", task.name)
+                logging.exception("[TASKS] %s%r failed after %d attempts",
+                                  task.name, task.args, task.attempt)
+                return True
+            self._count("retried", task.name)
+            logging.warning("[TASKS] %s failed (attempt %d), will retry",
+                            task.name, task.attempt, exc_info=True)
+            return False
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._run_total += elapsed
+                self._run_max = max(self._run_max, elapsed)
+                self._wait_max = max(self._wait_max, waited)
+        self._count("done", task.name)
+        return True
+
+    def _run(self):
+        while True:
+            task = self.backend.get(timeout=0.5)
+            if task is None:
+                if self._stopped.is_set():
+                    return
+                continue
+            with self._lock:
+                self._busy += 1
+            try:
+                if not self._execute(task):
+                    delay = self.retry_delay * 2 ** (task.attempt - 1)
+                    self.backend.put(task, delay=delay, force=True)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+
+    def pending(self):
+        with self._lock:
+            return self.backend.qsize() + self._busy
+
+    def drain(self, timeout=10.0):
+        """
+        Дождаться выполнения очереди и остановить потоки (при завершении воркера).
+        Новые задачи после этого выполняются синхронно. Возвращает число
+        задач, которые не успели выполниться.
+        """
+        deadline = time.monotonic() + timeout
+        while self._threads and self.pending() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._stopped.set()
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()) + 1.0)
+        left = self.pending()
+        if left:
+            logging.warning("[TASKS] %d tasks left undone at shutdown", left)
+        return left
+
+    def stats(self):
+        with self._lock:
+            by_task = {}
+            totals = Counter()
+            for (event, name), n in self._counts.items():
+                by_task.setdefault(name, {})[event] = n
+                totals[event] += n
+            done = totals["done"] + totals["failed"]
+            return {
+                "workers": len(self._threads),
+                "queued": self.backend.qsize(),
+                "running": self._busy,
+                "totals": dict(totals),
+                "tasks": by_task,
+                "run_avg_ms": round(self._run_total / (done + totals["retried"]) * 1000, 2)
+                if done + totals["retried"] else 0.0,
+                "run_max_ms": round(self._run_max * 1000, 2),
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+            }
@@ -0,0 +1,52 @@
+"""
+Общая настройка тестов.
+
+Окружение задаётся до импорта main: с DATABASE_URL тесты идут на указанной
+базе (в CI — PostgreSQL со схемой из миграций), без него — на временной
+SQLite со схемой из моделей. Фоновые задачи выполняются синхронно, пароли
+хешируются в потоке запроса дешёвым методом.
+"""
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="map-server-tests-")
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "test.db")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_tmp, "uploads"))
+os.environ.setdefault("PASSWORD_WORKERS", "0")
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+os.environ.setdefault("TASKS_SYNC", "true")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key-with-enough-length-for-hs256")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def app():
+    from main import app, db
+    with app.app_context():
+        if db.engine.dialect.name == "sqlite":
+            db.create_all()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def login(client):
+    """login(prefix="u") -> (username, заголовки); имя уникально в пределах сессии."""
+    def do(prefix="u", device="dev-1"):
+        name = f"{prefix}{next(_names)}"
+        client.post("/register", json={"username": name, "password": "pw"})
+        r = client.post("/login", json={"username": name, "password": "pw", "device_id": device})
+        assert r.status_code == 200, r.json
+        return name, {"Authorization": f"Bearer {r.json['access_token']}", "X-Device-ID": device}
+    return do
@@ -0,0 +1,77 @@
+"""
+TTLCache и кэш сессий single_device_required: срок жизни, LRU, инвалидация.
+"""
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_ttl_expiry(clock):
+    c = TTLCache(ttl=10)
+    c.set("a", 1)
+    clock[0] += 9
+    assert c.get("a") == 1
+    clock[0] += 2
+    assert c.get("a") is None and len(c) == 0
+
+
+def test_lru_eviction():
+    c = TTLCache(maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")                       # a — недавно использованный
+    c.set("c", 3)
+    assert c.get("b") is None
+    assert (c.get("a"), c.get("c")) == (1, 3)
+
+
+def test_pop_rejects_stale_set():
+    c = TTLCache()
+    gen = c.generation("u")
+    # между чтением строки и set() сессию инвалидировали (login/logout/ban)
+    assert c.pop("u") is None
+    assert not c.set("u", "old session", generation=gen)
+    assert c.get("u") is None
+    gen = c.generation("u")
+    assert c.set("u", "new session", generation=gen)
+    assert c.pop("u") == "new session"
+
+
+def test_generations_survive_eviction():
+    c = TTLCache(maxsize=2)
+    gen = c.generation("u")
+    c.pop("u")
+    c.pop("x")
+    c.pop("y")                       # поколение "u" вытеснено
+    assert not c.set("u", "old", generation=gen)
+
+
+def test_clear_rejects_stale_set():
+    c = TTLCache()
+    gen = c.generation("u")
+    c.clear()
+    assert not c.set("u", "old", generation=gen)
+
+
+def test_logout_and_relogin_invalidate_session(client, login):
+    import main
+    name, h = login("sess")
+    assert client.get("/list_routes", headers=h).status_code == 200
+    assert main.session_cache.get(name) is not None
+
+    assert client.post("/logout", headers=h).status_code == 200
+    assert main.session_cache.get(name) is None
+    assert client.get("/list_routes", headers=h).status_code == 403
+
+    r = client.post("/login", json={"username": name, "password": "pw", "device_id": "dev-2"})
+    h2 = {"Authorization": f"Bearer {r.json['access_token']}", "X-Device-ID": "dev-2"}
+    assert client.get("/list_routes", headers=h2).status_code == 200
+    assert client.get("/list_routes", headers={**h2, "X-Device-ID": "dev-1"}).status_code == 403
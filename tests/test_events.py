@@ -0,0 +1,137 @@
+"""
+Шина событий: курсоры, разрывы и вытеснение старых топиков.
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import events  # noqa: E402
+from events import EventBus, InProcessBackend  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(events.time, "monotonic", c)
+    return c
+
+
+def seq_of(cursor):
+    return int(cursor.rsplit(":", 1)[1])
+
+
+def test_read_without_cursor_returns_only_new_events():
+    bus = EventBus(InProcessBackend())
+    bus.publish("user:a", "old", {})
+    evs, cursor, reset = bus.read(["user:a"], None)
+    assert evs == [] and not reset
+    bus.publish("user:a", "new", {"n": 1})
+    bus.publish("user:b", "other", {})
+    evs, cursor2, reset = bus.read(["user:a"], cursor)
+    assert [e["type"] for e in evs] == ["new"] and not reset
+    assert seq_of(cursor2) == 3
+
+
+def test_priority_events_first():
+    bus = EventBus(InProcessBackend())
+    _, cursor, _ = bus.read(["t"], None)
+    bus.publish("t", "normal", {})
+    bus.publish("t", "urgent", {}, priority=1)
+    evs, _, _ = bus.read(["t"], cursor)
+    assert [e["type"] for e in evs] == ["urgent", "normal"]
+
+
+def test_foreign_epoch_resets_once():
+    bus = EventBus(InProcessBackend())
+    evs, cursor, reset = bus.read(["t"], "deadbeef:5")
+    assert reset and evs == []
+    _, _, reset = bus.read(["t"], cursor)
+    assert not reset
+
+
+def test_overflow_gap_is_reported_once():
+    bus = EventBus(InProcessBackend(maxlen=3))
+    _, cursor, _ = bus.read(["t"], None)
+    for i in range(5):
+        bus.publish("t", "e", {"i": i})
+    evs, cursor, reset = bus.read(["t"], cursor)
+    assert reset and [e["data"]["i"] for e in evs] == [2, 3, 4]
+    evs, cursor, reset = bus.read(["t"], cursor)
+    assert not reset and evs == []
+
+
+def test_idle_read_moves_cursor_to_head():
+    bus = EventBus(InProcessBackend())
+    _, cursor, _ = bus.read(["mine"], None)
+    for _ in range(10):
+        bus.publish("other", "e", {})
+    _, cursor2, reset = bus.read(["mine"], cursor)
+    assert not reset and seq_of(cursor2) == 10
+
+
+def test_expired_unrelated_topic_does_not_reset_forever(clock):
+    backend = InProcessBackend(max_age=60)
+    bus = EventBus(backend)
+    _, cursor, _ = bus.read(["user:me"], None)
+    bus.publish("pos:1:1", "position", {})
+    clock.now += 120
+    bus.publish("pos:2:2", "position", {})       # запускает вытеснение
+    assert "pos:1:1" not in backend._topics
+
+    # Курсор старше вытесненного события — один reset, и курсор уходит вперёд
+    evs, cursor, reset = bus.read(["user:me"], cursor)
+    assert reset and evs == []
+    assert seq_of(cursor) == backend.head()
+
+    # Дальше — обычное ожидание без reset
+    t0 = time.perf_counter()
+    evs, cursor2, reset = bus.read(["user:me"], cursor, timeout=0.2)
+    assert not reset and evs == []
+    assert time.perf_counter() - t0 >= 0.15
+    assert cursor2 == cursor
+
+
+def test_sweep_keeps_topics_with_waiters(clock):
+    backend = InProcessBackend(max_age=60)
+    bus = EventBus(backend)
+    bus.publish("group:1", "message", {})
+    _, cursor, _ = bus.read(["group:1"], None)
+    result = {}
+
+    def wait():
+        result["read"] = bus.read(["group:1"], cursor, timeout=2)
+
+    t = threading.Thread(target=wait)
+    t.start()
+    while "group:1" not in backend._waiters:
+        time.sleep(0.01)
+    clock.now += 120
+    bus.publish("other", "e", {})
+    assert "group:1" in backend._topics
+    bus.publish("group:1", "message", {"n": 2})
+    t.join()
+    evs, _, reset = result["read"]
+    assert [e["data"] for e in evs] == [{"n": 2}] and not reset
+
+
+def test_blocking_read_wakes_on_publish():
+    bus = EventBus(InProcessBackend())
+    _, cursor, _ = bus.read(["t"], None)
+    threading.Timer(0.05, bus.publish, args=("t", "e", {"x": 1})).start()
+    t0 = time.perf_counter()
+    evs, _, _ = bus.read(["t"], cursor, timeout=5)
+    assert [e["data"] for e in evs] == [{"x": 1}]
+    assert time.perf_counter() - t0 < 2
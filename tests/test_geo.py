@@ -0,0 +1,68 @@
+"""
+GridIndex: версии записей, TTL и поиск по радиусу; дельта соседей в /sync.
+"""
+from geo import GridIndex, cells_around, cell_of
+
+
+def test_upsert_bumps_version_only_on_move():
+    idx = GridIndex(cell_deg=0.05, move_eps=1e-5)
+    assert idx.upsert("a", 55.0, 37.0, ts=1)
+    v = idx.get("a", now=1).version
+    assert not idx.upsert("a", 55.0, 37.0, ts=2)
+    assert not idx.upsert("a", 55.000001, 37.0, ts=3)
+    entry = idx.get("a", now=3)
+    assert entry.version == v and entry.ts == 3
+    assert idx.upsert("a", 55.001, 37.0, ts=4)
+    assert idx.get("a", now=4).version > v
+
+
+def test_older_ts_is_ignored():
+    idx = GridIndex()
+    idx.upsert("a", 55.0, 37.0, ts=10)
+    assert not idx.upsert("a", 56.0, 37.0, ts=5)
+    assert idx.get("a", now=10).lat == 55.0
+
+
+def test_move_between_cells():
+    idx = GridIndex(cell_deg=0.05)
+    idx.upsert("a", 55.0, 37.0, ts=1)
+    idx.upsert("a", 56.0, 38.0, ts=2)
+    assert [e.key for e in idx.query_radius(56.0, 38.0, 1, now=2)] == ["a"]
+    assert idx.query_radius(55.0, 37.0, 1, now=2) == []
+
+
+def test_stationary_ping_keeps_entry_alive():
+    idx = GridIndex(ttl=100)
+    idx.upsert("a", 55.0, 37.0, ts=0)
+    idx.upsert("b", 55.0, 37.1, ts=50)
+    idx.upsert("a", 55.0, 37.0, ts=90)      # не сдвинулся, но пинг свежий
+    assert idx.expire(now=140) == 0
+    assert idx.expire(now=185) == 1
+    assert [e.key for e in idx.live(now=185)] == ["a"]
+
+
+def test_cells_around_wraps_antimeridian():
+    cells = cells_around(0.0, 179.99, 5, 0.05)
+    cols = {c for _, c in cells}
+    assert cell_of(0.0, -179.99, 0.05)[1] in cols
+    assert cell_of(0.0, 179.99, 0.05)[1] in cols
+
+
+def test_sync_delta_empty_for_stationary_neighbours(client, login):
+    me, h = login("delta")
+    other, ho = login("delta")
+    pos = {"lat": 10.0, "lon": 20.0}
+    client.post("/sync", json=dict(pos, lat=10.001), headers=ho)
+    r = client.post("/sync", json=dict(pos, users_cursor=None), headers=h).json
+    assert r["users_full"] and [u["username"] for u in r["updated_users"]] == [other]
+
+    # Оба стоят на месте и продолжают пинговать
+    client.post("/sync", json=dict(pos, lat=10.001), headers=ho)
+    r = client.post("/sync", json=dict(pos, users_cursor=r["users_cursor"]), headers=h).json
+    assert not r["users_full"]
+    assert r["updated_users"] == [] and r["removed_users"] == []
+
+    # Сдвиг соседа попадает в дельту
+    client.post("/sync", json=dict(pos, lat=10.01), headers=ho)
+    r = client.post("/sync", json=dict(pos, users_cursor=r["users_cursor"]), headers=h).json
+    assert [u["username"] for u in r["updated_users"]] == [other]
@@ -0,0 +1,124 @@
+"""
+geometry: значимость Douglas–Peucker, encoded polyline, статистика трека.
+"""
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import geometry
+from geometry import SimplifiedTrack, TrackStats, decode_polyline, encode_polyline
+
+
+def _naive_dp(xs, ys, tol):
+    """Классический рекурсивный DP — эталон для сравнения."""
+    def rec(a, b, keep):
+        if b - a < 2:
+            return
+        i, d = geometry._farthest_py(xs, ys, a, b)
+        if d > tol:
+            keep.add(i)
+            rec(a, i, keep)
+            rec(i, b, keep)
+    keep = {0, len(xs) - 1}
+    rec(0, len(xs) - 1, keep)
+    return sorted(keep)
+
+
+def _track(n, seed):
+    rnd = random.Random(seed)
+    lat, lon = 48.0, 11.0
+    lats, lons = [], []
+    for _ in range(n):
+        lat += rnd.uniform(-0.001, 0.001)
+        lon += rnd.uniform(-0.0005, 0.0015)
+        lats.append(lat)
+        lons.append(lon)
+    return lats, lons
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_significance_matches_naive_dp(monkeypatch, use_numpy, seed):
+    if use_numpy and geometry.np is None:
+        pytest.skip("numpy is not installed")
+    if not use_numpy:
+        monkeypatch.setattr(geometry, "np", None)
+    lats, lons = _track(400, seed)
+    ts = [datetime(2024, 1, 1) + timedelta(seconds=i) for i in range(len(lats))]
+    track = SimplifiedTrack(lats, lons, ts)
+    xs, ys = geometry._project(lats, lons)
+    for tol in (0.5, 5.0, 20.0, 100.0, 1000.0):
+        assert list(track.level(tol)) == _naive_dp(xs, ys, tol)
+
+
+def test_levels_are_nested_and_keep_endpoints():
+    lats, lons = _track(300, 7)
+    track = SimplifiedTrack(lats, lons, [None] * len(lats))
+    prev = set(range(len(track)))
+    assert list(track.level(0)) == list(range(len(track)))
+    for tol in (1.0, 10.0, 100.0, 1e6):
+        idx = set(track.level(tol))
+        assert {0, len(track) - 1} <= idx <= prev
+        prev = idx
+    assert prev == {0, len(track) - 1}
+
+
+def test_short_tracks():
+    assert geometry.dp_significance([], []) == []
+    assert geometry.dp_significance([1.0, 2.0], [1.0, 2.0]) == [math.inf, math.inf]
+    assert list(SimplifiedTrack([1.0], [2.0], [None]).level(10)) == [0]
+
+
+def test_zoom_tolerance_halves_per_zoom_level():
+    t10 = geometry.zoom_tolerance(10, 0.0)
+    assert geometry.zoom_tolerance(11, 0.0) == pytest.approx(t10 / 2)
+    assert geometry.zoom_tolerance(10, 60.0) == pytest.approx(t10 / 2)
+    assert geometry.zoom_tolerance(99, 0.0) == geometry.zoom_tolerance(geometry.MAX_ZOOM, 0.0)
+
+
+def test_polyline_reference_vector():
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    s = encode_polyline(points)
+    assert s == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode_polyline(s) == points
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_polyline_round_trip(precision):
+    lats, lons = _track(200, 5)
+    points = list(zip(lats, lons))
+    decoded = decode_polyline(encode_polyline(points, precision), precision)
+    eps = 10 ** -precision
+    assert len(decoded) == len(points)
+    assert all(abs(a - c) <= eps and abs(b - d) <= eps
+               for (a, b), (c, d) in zip(points, decoded))
+
+
+def test_track_stats_incremental_equals_full():
+    lats, lons = _track(50, 9)
+    ts = [datetime(2024, 1, 1) + timedelta(minutes=i) for i in range(50)]
+    full = TrackStats()
+    for p in zip(lats, lons, ts):
+        full.add(*p)
+
+    class Obj:
+        pass
+    part = TrackStats()
+    for p in list(zip(lats, lons, ts))[:20]:
+        part.add(*p)
+    obj = Obj()
+    part.apply_to(obj)
+    resumed = TrackStats.of(obj)
+    for p in list(zip(lats, lons, ts))[20:]:
+        resumed.add(*p)
+
+    for name in TrackStats.FIELDS:
+        if name == "distance_km":
+            assert resumed.distance_km == pytest.approx(full.distance_km)
+        else:
+            assert getattr(resumed, name) == getattr(full, name)
+    assert full.point_count == 50
+    assert (full.min_lat, full.max_lat) == (min(lats), max(lats))
+    assert (full.start_ts, full.end_ts) == (ts[0], ts[-1])
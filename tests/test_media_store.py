@@ -0,0 +1,126 @@
+"""
+Хранилище загрузок: адресация по содержимому, дедупликация, подсчёт ссылок и gc-media.
+"""
+import hashlib
+import io
+import os
+
+import pytest
+
+from media_store import MediaStore, is_hashed, key_for
+
+
+@pytest.fixture
+def store(tmp_path):
+    return MediaStore(str(tmp_path))
+
+
+def _put(store, data, ext="jpg"):
+    name, tmp, size = store.write_temp(io.BytesIO(data), ext)
+    return name, store.commit_temp(name, tmp), size
+
+
+def test_content_addressed_names_and_dedup(store):
+    data = b"x" * 200_000
+    name, new, size = _put(store, data)
+    digest = hashlib.sha256(data).hexdigest()
+    assert name == f"{digest}.jpg" and new and size == len(data)
+    assert store.path_for(name) == os.path.join(store.root, digest[:2], digest[2:4], name)
+    assert store.exists(name)
+
+    again, new, _ = _put(store, data)
+    assert again == name and not new
+    assert os.listdir(store.tmp_dir) == []          # копия выкинута
+
+    other, new, _ = _put(store, data, "png")
+    assert other != name and new
+
+
+def test_names_are_validated(store):
+    assert key_for("../etc/passwd") is None
+    assert key_for(".hidden") is None
+    assert key_for("a/b.jpg") is None
+    assert key_for("legacy-uuid.jpg") == "legacy-uuid.jpg"
+    assert not is_hashed("legacy-uuid.jpg")
+    with pytest.raises(ValueError):
+        store.write_temp(io.BytesIO(b"x"), "../sh")
+
+
+def test_iter_names_resumes_after(store):
+    names = sorted(_put(store, bytes([i]) * 10)[0] for i in range(20))
+    with open(os.path.join(store.root, "old-file.3gp"), "wb") as f:
+        f.write(b"old")
+    listed = list(store.iter_names())
+    assert listed == ["old-file.3gp"] + names
+    assert list(store.iter_names(after="old-file.3gp")) == names
+    assert list(store.iter_names(after=names[9])) == names[10:]
+    assert store.delete(names[0]) and not store.delete(names[0])
+    assert names[0] not in list(store.iter_names())
+
+
+def _refs(name):
+    from main import MediaRef, db
+    row = db.session.get(MediaRef, name)
+    db.session.rollback()
+    return None if row is None else row.refs
+
+
+def _comment(client, h, rid, data):
+    r = client.post("/add_route_comment", headers=h, content_type="multipart/form-data", data={
+        "route_id": rid, "lat": "1", "lon": "2", "text": "t",
+        "photo": (io.BytesIO(data), "p.jpg")})
+    assert r.status_code == 200, r.data
+
+
+def test_refcount_and_gc(app, client, login):
+    import main
+    from main import RouteComment, db
+    _, h = login("media")
+    rid = client.post("/create_route", json={"name": "m"}, headers=h).json["route_id"]
+    data = os.urandom(4096)
+    name = f"{hashlib.sha256(data).hexdigest()}.jpg"
+    _comment(client, h, rid, data)
+    _comment(client, h, rid, data)
+
+    runner = app.test_cli_runner()
+    with app.app_context():
+        assert _refs(name) == 2
+        assert main.media_store.exists(name)
+
+        comments = RouteComment.query.filter_by(route_id=rid).all()
+        db.session.delete(comments[0])
+        db.session.commit()
+        assert _refs(name) == 1
+
+        # на файл ещё есть ссылка — gc его не трогает
+        runner.invoke(args=["gc-media", "--grace-hours", "0"])
+        assert main.media_store.exists(name)
+
+        db.session.delete(comments[1])
+        db.session.commit()
+        assert _refs(name) == 0
+
+        # без ссылок, но в пределах грейс-периода — тоже остаётся
+        runner.invoke(args=["gc-media", "--grace-hours", "1"])
+        assert main.media_store.exists(name)
+
+        result = runner.invoke(args=["gc-media", "--grace-hours", "0"])
+        assert result.exit_code == 0, result.output
+        assert not main.media_store.exists(name)
+        assert _refs(name) is None
+
+
+def test_rebuild_media_refs(app, client, login):
+    import main
+    from main import MediaRef, db
+    _, h = login("rebuild")
+    rid = client.post("/create_route", json={"name": "m"}, headers=h).json["route_id"]
+    data = os.urandom(2048)
+    name = f"{hashlib.sha256(data).hexdigest()}.jpg"
+    _comment(client, h, rid, data)
+    with app.app_context():
+        db.session.query(MediaRef).filter_by(name=name).update({MediaRef.refs: 7})
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=["rebuild-media-refs"])
+        assert result.exit_code == 0, result.output
+        assert _refs(name) == 1
@@ -0,0 +1,21 @@
+"""
+Планы горячих запросов: ни одного последовательного сканирования.
+"""
+import pytest
+
+from query_plans import collect_plans
+
+
+@pytest.fixture(scope="module")
+def plans(app):
+    with app.app_context():
+        return collect_plans()
+
+
+def test_hot_queries_use_indexes(plans):
+    scans = {name: found for name, _, found in plans if found}
+    assert not scans, f"seq scan in hot queries: {scans}"
+
+
+def test_all_hot_queries_explained(plans):
+    assert plans and all(plan for _, plan, _ in plans)
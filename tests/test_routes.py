@@ -0,0 +1,83 @@
+"""
+Маршруты: пакетная загрузка точек (валидация, seq), уровни детализации.
+"""
+import pytest
+
+import track_codec
+from geometry import decode_polyline
+
+
+@pytest.fixture
+def route(client, login):
+    _, h = login("rt")
+    rid = client.post("/create_route", json={"name": "r"}, headers=h).json["route_id"]
+    return rid, h
+
+
+def _batch(seq, n=3, lat0=40.0):
+    return [{"lat": lat0 + i * 0.001, "lon": 10.0, "ts": 1_700_000_000 + seq * 100 + i}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize("body", [
+    [1, 2, 3],
+    {"route_id": "x", "seq": 1, "points": [1, 2]},
+    {"route_id": "x", "seq": 1, "points": {"lat": 1}},
+    {"route_id": "x", "seq": 1, "points": [{"lat": "north", "lon": 1}]},
+    {"route_id": "x", "seq": "one", "points": [{"lat": 1, "lon": 1}]},
+])
+def test_malformed_batch_is_400(client, route, body):
+    rid, h = route
+    if isinstance(body, dict) and body.get("route_id") == "x":
+        body = dict(body, route_id=rid)
+    r = client.post("/add_route_points", json=body, headers=h)
+    assert r.status_code == 400, r.data
+    assert r.json["error"] == "bad_points"
+
+
+def test_seq_retry_and_out_of_order(client, route):
+    rid, h = route
+    post = lambda seq: client.post("/add_route_points", headers=h, json={
+        "route_id": rid, "seq": seq, "points": _batch(seq)})
+
+    r = post(1)
+    assert r.status_code == 200 and r.json == {"accepted": 3, "duplicate": False, "last_seq": 1}
+    r = post(3)
+    assert r.status_code == 200 and r.json["accepted"] == 3
+
+    # повтор последней пачки — принята ранее, ничего не вставлено
+    r = post(3)
+    assert r.status_code == 200 and r.json == {"accepted": 0, "duplicate": True, "last_seq": 3}
+
+    # опоздавшая пачка не сохраняется, и клиент узнаёт об этом
+    r = post(2)
+    assert r.status_code == 409
+    assert r.json == {"error": "seq_out_of_order", "last_seq": 3}
+
+    pts = client.get(f"/get_route?route_id={rid}", headers=h).json
+    assert len(pts["route_points"]) == 6
+
+
+def test_binary_batch(client, route):
+    rid, h = route
+    points = [(40.0 + i * 0.001, 10.0, 1_700_000_000 + i) for i in range(5)]
+    r = client.post(f"/add_route_points?route_id={rid}&seq=1", headers=h,
+                    data=track_codec.encode(points), content_type="application/octet-stream")
+    assert r.status_code == 200 and r.json["accepted"] == 5
+    r = client.post(f"/add_route_points?route_id={rid}&seq=2", headers=h,
+                    data=b"\x01\xff", content_type="application/octet-stream")
+    assert r.status_code == 400
+
+
+def test_get_route_lod(client, route):
+    rid, h = route
+    # прямая с одним "зубцом" посередине
+    points = [{"lat": 40.0 + i * 0.001, "lon": 10.0 + (0.01 if i == 50 else 0.0),
+               "ts": 1_700_000_000 + i} for i in range(101)]
+    client.post("/add_route_points", headers=h,
+                json={"route_id": rid, "seq": 1, "points": points})
+    r = client.get(f"/get_route?route_id={rid}&tolerance=10", headers=h).json
+    assert [p["lat"] for p in r["route_points"]] == pytest.approx([40.0, 40.049, 40.05, 40.051, 40.1])
+    assert r["lod"]["points_total"] == 101
+    r = client.get(f"/get_route?route_id={rid}&zoom=3&format=polyline", headers=h).json
+    assert len(decode_polyline(r["route_polyline"])) == r["lod"]["points"] == 2
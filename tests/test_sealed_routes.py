@@ -0,0 +1,80 @@
+"""
+Запечатанные маршруты: чтение из блоба совпадает с чтением из route_points.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _points(n, t0=1_700_000_000):
+    return [{"lat": 40.0 + i * 0.0007, "lon": 10.0 + (i % 7) * 0.0003, "ts": t0 + i * 5}
+            for i in range(n)]
+
+
+@pytest.fixture
+def route(client, login):
+    _, h = login("seal")
+    rid = client.post("/create_route", json={"name": "s"}, headers=h).json["route_id"]
+    r = client.post("/add_route_points", headers=h,
+                    json={"route_id": rid, "seq": 1, "points": _points(250)})
+    assert r.status_code == 200
+    return rid, h
+
+
+def _reads(client, rid, h):
+    full = client.get(f"/get_route?route_id={rid}", headers=h)
+    assert full.status_code == 200
+    lod = client.get(f"/get_route?route_id={rid}&tolerance=5", headers=h).json
+    poly = client.get(f"/get_route?route_id={rid}&zoom=14&format=polyline", headers=h).json
+    return full.get_json(), lod, poly
+
+
+def test_sealed_reads_match_open_reads(app, client, route):
+    rid, h = route
+    before = _reads(client, rid, h)
+    r = client.post("/seal_route", json={"route_id": rid}, headers=h)
+    assert r.status_code == 200 and r.json["points"] == 250
+    assert r.json["bytes"] < 250 * 8
+    after = _reads(client, rid, h)
+    assert after == before
+    assert len(after[0]["route_points"]) == 250
+
+    from main import RoutePoint
+    with app.app_context():
+        assert RoutePoint.query.filter_by(route_id=rid).count() == 0
+
+
+def test_sealed_route_is_read_only(client, route):
+    rid, h = route
+    client.post("/seal_route", json={"route_id": rid}, headers=h)
+    again = client.post("/seal_route", json={"route_id": rid}, headers=h)
+    assert again.status_code == 200 and again.json["points"] == 250
+
+    r = client.post("/add_route_points", headers=h,
+                    json={"route_id": rid, "seq": 2, "points": _points(3, 1_700_100_000)})
+    assert r.status_code == 409 and r.json["error"] == "route_sealed"
+    r = client.post("/add_route_point", headers=h, json={"route_id": rid, "lat": 1, "lon": 1})
+    assert r.status_code == 409
+
+    listed = client.get("/list_routes", headers=h).json
+    item = next(x for x in listed if x["id"] == rid)
+    assert item["sealed"] and item["points"] == 250
+
+
+def test_seal_routes_command_seals_idle_routes(app, client, login):
+    _, h = login("idle")
+    stale = datetime.utcnow() - timedelta(hours=48)
+    ids = []
+    for ts in (stale.timestamp(), datetime.utcnow().timestamp()):
+        rid = client.post("/create_route", json={"name": "x"}, headers=h).json["route_id"]
+        client.post("/add_route_points", headers=h, json={"route_id": rid, "seq": 1, "points": [
+            {"lat": 1.0, "lon": 2.0, "ts": ts}, {"lat": 1.001, "lon": 2.0, "ts": ts + 1}]})
+        ids.append(rid)
+
+    result = app.test_cli_runner().invoke(args=["seal-routes", "--idle-hours", "24"])
+    assert result.exit_code == 0, result.output
+    assert f"{ids[0]}: 2 points" in result.output
+    assert ids[1] not in result.output
+
+    listed = {x["id"]: x["sealed"] for x in client.get("/list_routes", headers=h).json}
+    assert listed == {ids[0]: True, ids[1]: False}
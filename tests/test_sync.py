@@ -0,0 +1,42 @@
+"""
+/sync: счётчики секций, SOS рядом с учётом перемещения, личные сообщения.
+"""
+from datetime import datetime, timedelta
+
+
+def _sync(client, headers, **body):
+    r = client.post("/sync", json=body, headers=headers)
+    assert r.status_code == 200, r.data
+    return r.json
+
+
+def test_empty_position_is_accepted(client, login):
+    _, h = login("nopos")
+    for _ in range(2):
+        r = _sync(client, h, counters={})
+        assert "counters" in r
+
+
+def test_sos_reached_by_walking_into_range(client, login):
+    _, h = login("walker")
+    _, hs = login("victim")
+    assert client.post("/sos", json={"lat": 40.0, "lon": 10.0}, headers=hs).status_code == 200
+
+    far = dict(lat=40.0, lon=12.0)                  # ~170 км, вне SOS_RADIUS_KM
+    r = _sync(client, h, counters={}, **far)
+    assert r["sos_alerts"] == []
+    last_sos_time = (datetime.utcnow() + timedelta(seconds=1)).isoformat()
+
+    # Стоим на месте, счётчики не менялись — секции нет
+    r = _sync(client, h, counters=r["counters"], last_sos_time=last_sos_time, **far)
+    assert "sos_alerts" not in r
+
+    # Подошли: старый SOS приходит, несмотря на last_sos_time
+    near = dict(lat=40.0, lon=10.2)
+    r = _sync(client, h, counters=r["counters"], last_sos_time=last_sos_time, **near)
+    assert [s["lat"] for s in r["sos_alerts"]] == [40.0]
+
+    # Немного сдвинулись, но уже получили его — повторно не отдаём
+    r = _sync(client, h, counters=r["counters"], last_sos_time=last_sos_time,
+              lat=40.0, lon=10.22)
+    assert r["sos_alerts"] == []
@@ -0,0 +1,123 @@
+"""
+TaskExecutor: повторы, переполнение очереди, drain; after_commit — только после коммита.
+"""
+import threading
+import time
+
+import pytest
+
+from tasks import InProcessBackend, TaskExecutor
+
+
+def _executor(**kw):
+    kw.setdefault("retry_delay", 0.01)
+    return TaskExecutor(workers=2, **kw)
+
+
+def test_runs_in_worker_threads_and_drains():
+    ex = _executor()
+    done, threads = [], set()
+
+    @ex.task("work")
+    def work(n):
+        threads.add(threading.current_thread().name)
+        done.append(n)
+
+    for i in range(20):
+        ex.submit("work", i)
+    assert ex.drain(timeout=5) == 0
+    assert sorted(done) == list(range(20))
+    assert threading.current_thread().name not in threads
+    assert ex.stats()["totals"]["done"] == 20
+
+    ex.submit("work", 99)                   # после drain — синхронно
+    assert done[-1] == 99
+
+
+def test_retries_then_gives_up():
+    ex = _executor(max_retries=2)
+    calls = {"flaky": 0, "broken": 0}
+
+    @ex.task("flaky")
+    def flaky():
+        calls["flaky"] += 1
+        if calls["flaky"] < 3:
+            raise RuntimeError("transient")
+
+    @ex.task("broken")
+    def broken():
+        calls["broken"] += 1
+        raise RuntimeError("permanent")
+
+    ex.submit("flaky")
+    ex.submit("broken")
+    ex.drain(timeout=5)
+    assert calls == {"flaky": 3, "broken": 3}
+    totals = ex.stats()["totals"]
+    assert totals["done"] == 1 and totals["failed"] == 1 and totals["retried"] == 4
+
+
+def test_full_queue_runs_inline():
+    gate = threading.Event()
+    ex = TaskExecutor(InProcessBackend(maxsize=1), workers=1)
+    ran_in = []
+
+    @ex.task("block")
+    def block():
+        gate.wait(5)
+
+    @ex.task("probe")
+    def probe():
+        ran_in.append(threading.current_thread().name)
+
+    ex.submit("block")                       # занимает единственный поток
+    while ex.backend.qsize():
+        time.sleep(0.01)
+    ex.submit("probe")                       # ждёт в очереди
+    ex.submit("probe")                       # очередь полна — выполняется здесь
+    assert ran_in == [threading.current_thread().name]
+    gate.set()
+    ex.drain(timeout=5)
+    assert len(ran_in) == 2
+
+
+def test_registry_errors():
+    ex = _executor(sync=True)
+    ex.task("a")(lambda: None)
+    with pytest.raises(ValueError):
+        ex.task("a")(lambda: None)
+    with pytest.raises(KeyError):
+        ex.submit("missing")
+
+
+@pytest.fixture
+def probe(app):
+    import main
+    if "test_probe" not in main.executor._registry:
+        main.executor.task("test_probe")(lambda n: probe.calls.append(n))
+    probe.calls = []
+    return probe.calls
+
+
+def test_after_commit_only_on_commit(app, probe):
+    import main
+    from main import db
+    with app.app_context():
+        main.after_commit("test_probe", 1)
+        db.session.rollback()
+        assert probe == []
+
+        main.after_commit("test_probe", 2)
+        assert probe == []                    # до коммита задача не ставится
+        db.session.commit()
+        assert probe == [2]
+
+        # откат точки сохранения не отменяет задачи внешней транзакции
+        main.after_commit("test_probe", 3)
+        with db.session.begin_nested() as sp:
+            sp.rollback()
+        db.session.commit()
+        assert probe == [2, 3]
+
+        db.session.commit()                   # уже выполненные не повторяются
+        assert probe == [2, 3]
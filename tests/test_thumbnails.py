@@ -0,0 +1,62 @@
+"""
+Thumbnailer: варианты фиксированной ширины, фоновый рендер и остановка.
+"""
+import io
+import os
+
+import pytest
+
+from media_store import MediaStore
+from thumbnails import Thumbnailer
+
+Image = pytest.importorskip("PIL.Image")
+
+
+@pytest.fixture
+def thumbs(tmp_path):
+    store = MediaStore(str(tmp_path / "media"))
+    t = Thumbnailer(store, str(tmp_path / "thumbs"), widths=(100, 300), workers=1)
+    yield t
+    t.shutdown()
+
+
+def _photo(store, size=(800, 600)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (10, 120, 200)).save(buf, "JPEG")
+    buf.seek(0)
+    name, tmp, _ = store.write_temp(buf, "jpg")
+    store.commit_temp(name, tmp)
+    return name
+
+
+def test_get_snaps_width_and_renders_once(thumbs):
+    name = _photo(thumbs.store)
+    path, mime = thumbs.get(name, 120)
+    assert mime == "image/jpeg" and path.endswith(".w300.jpg")
+    with Image.open(path) as im:
+        assert im.size == (300, 225)
+    assert thumbs.get(name, 300)[0] == path
+    assert thumbs.get(name, 100, "webp")[1] == "image/webp"
+    assert thumbs.get("missing.jpg", 100) is None
+    assert thumbs.get("audio.3gp", 100) is None
+
+
+def test_submit_renders_all_variants(thumbs):
+    name = _photo(thumbs.store)
+    thumbs.submit(name)
+    thumbs._executor.shutdown(wait=True)
+    assert sorted(os.path.basename(p) for p in _files(thumbs.cache_dir)) == sorted(
+        f"{name[:-4]}.w{w}.{fmt}" for w in (100, 300) for fmt in ("jpg", "webp"))
+    assert not thumbs._pending
+
+
+def test_submit_after_shutdown_is_noop(thumbs):
+    name = _photo(thumbs.store)
+    thumbs.shutdown()
+    thumbs.submit(name)                  # не падает и ничего не ставит в очередь
+    assert thumbs._executor is None and not thumbs._pending
+    assert thumbs.get(name, 100) is not None   # запрос по-прежнему рендерит сам
+
+
+def _files(root):
+    return [os.path.join(d, f) for d, _, names in os.walk(root) for f in names]
@@ -0,0 +1,76 @@
+"""
+track_codec: кодирование треков дельтами и varint.
+"""
+import random
+import zlib
+
+import pytest
+
+import track_codec
+from track_codec import TrackCodecError
+
+
+def _track(n, seed=1):
+    rnd = random.Random(seed)
+    lat, lon, ts = 55.75, 37.62, 1_700_000_000.0
+    points = []
+    for _ in range(n):
+        lat += rnd.uniform(-0.0005, 0.0005)
+        lon += rnd.uniform(-0.0005, 0.0005)
+        ts += rnd.uniform(0.5, 5.0)
+        points.append((lat, lon, ts))
+    return points
+
+
+def _close(a, b):
+    return all(abs(x[0] - y[0]) <= 1e-6 and abs(x[1] - y[1]) <= 1e-6
+               and abs(x[2] - y[2]) <= 1e-3 for x, y in zip(a, b)) and len(a) == len(b)
+
+
+@pytest.mark.parametrize("points", [
+    [],
+    [(0.0, 0.0, 0.0)],
+    [(-90.0, -180.0, 1.0), (90.0, 180.0, 2.0), (-33.8688, 151.2093, 1_700_000_000.123)],
+    _track(500),
+])
+def test_round_trip(points):
+    assert _close(track_codec.decode(track_codec.encode(points)), points)
+    assert _close(track_codec.unpack(track_codec.pack(points)), points)
+    assert track_codec.packed_count(track_codec.pack(points)) == len(points)
+
+
+def test_neighbouring_fixes_are_compact():
+    points = _track(1000)
+    assert len(track_codec.encode(points)) < 8 * len(points)
+
+
+def test_round_trip_is_stable():
+    data = track_codec.encode(_track(100))
+    assert track_codec.encode(track_codec.decode(data)) == data
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x02\x00",                                     # чужая версия
+    track_codec.encode(_track(3))[:-1],              # обрезано
+    track_codec.encode(_track(3)) + b"\x00",         # хвост
+    b"\x01" + b"\xff" * 12,                          # бесконечный varint
+])
+def test_decode_rejects_garbage(data):
+    with pytest.raises(TrackCodecError):
+        track_codec.decode(data)
+
+
+def test_unpack_rejects_non_zlib():
+    with pytest.raises(TrackCodecError):
+        track_codec.unpack(b"not zlib")
+    with pytest.raises(TrackCodecError):
+        track_codec.packed_count(zlib.compress(b"\x07"))
+
+
+def test_valid_point():
+    assert track_codec.valid_point(0, 0)
+    assert track_codec.valid_point(-90.0, 180.0)
+    assert not track_codec.valid_point(90.1, 0)
+    assert not track_codec.valid_point(0, float("nan"))
+    assert not track_codec.valid_point("1", 0)
@@ -0,0 +1,101 @@
+"""
+Докачиваемые загрузки: части по смещению, повтор после обрыва, проверка хеша, истечение.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+
+def _create(client, h, data, **extra):
+    body = {"ext": "jpg", "size": len(data), **extra}
+    r = client.post("/uploads/sessions", json=body, headers=h)
+    assert r.status_code == 201, r.data
+    return r.json["upload_id"]
+
+
+def _put(client, h, uid, data, start, total):
+    end = start + len(data) - 1
+    return client.put(f"/uploads/sessions/{uid}", data=data, headers={
+        **h, "Content-Range": f"bytes {start}-{end}/{total}",
+        "Content-Type": "application/octet-stream"})
+
+
+def test_resume_after_lost_response(client, login):
+    _, h = login("up")
+    data = os.urandom(10_000)
+    uid = _create(client, h, data, sha256=hashlib.sha256(data).hexdigest())
+
+    assert _put(client, h, uid, data[:4000], 0, len(data)).json["offset"] == 4000
+    # ответ потерялся — клиент повторяет ту же часть и узнаёт, откуда продолжать
+    r = _put(client, h, uid, data[:4000], 0, len(data))
+    assert r.status_code == 409 and r.json["error"] == "offset_mismatch"
+    assert r.json["offset"] == 4000
+    assert client.get(f"/uploads/sessions/{uid}", headers=h).json["offset"] == 4000
+
+    r = client.put(f"/uploads/sessions/{uid}?offset=4000", data=data[4000:], headers=h)
+    assert r.status_code == 200 and r.json["complete"]
+    name = r.json["name"]
+    assert name == hashlib.sha256(data).hexdigest() + ".jpg"
+
+    # повтор последней части после завершения — то же состояние
+    again = _put(client, h, uid, data[4000:], 4000, len(data))
+    assert again.status_code == 200 and again.json["name"] == name
+
+    rid = client.post("/create_route", json={"name": "u"}, headers=h).json["route_id"]
+    r = client.post("/add_route_comment", headers=h, json={
+        "route_id": rid, "lat": 1, "lon": 2, "photo_upload_id": uid})
+    assert r.status_code == 200
+    route = client.get(f"/get_route?route_id={rid}", headers=h).json
+    assert route["route_comments"][0]["photo"] == name
+
+
+def test_hash_mismatch_restarts_upload(client, login):
+    _, h = login("up")
+    data = os.urandom(1000)
+    uid = _create(client, h, data, sha256="0" * 64)
+    r = _put(client, h, uid, data, 0, len(data))
+    assert r.status_code == 422 and r.json["error"] == "hash_mismatch"
+    assert r.json["offset"] == 0 and not r.json["complete"]
+
+
+def test_limits_and_ownership(client, login):
+    _, h = login("up")
+    _, other = login("up")
+    data = os.urandom(100)
+    uid = _create(client, h, data)
+    assert client.get(f"/uploads/sessions/{uid}", headers=other).status_code == 404
+    assert _put(client, other, uid, data, 0, 100).status_code == 404
+    assert _put(client, h, uid, data + b"x", 0, 100).status_code == 413
+    assert client.put(f"/uploads/sessions/{uid}", data=data, headers=h).status_code == 400
+    assert client.post("/uploads/sessions", json={"ext": "exe", "size": 1},
+                       headers=h).status_code == 400
+
+    # незавершённую загрузку нельзя приложить к сообщению
+    rid = client.post("/create_route", json={"name": "u"}, headers=h).json["route_id"]
+    r = client.post("/add_route_comment", headers=h, json={
+        "route_id": rid, "lat": 1, "lon": 2, "photo_upload_id": uid})
+    assert r.status_code == 400 and r.json["error"] == "upload_not_complete"
+
+
+def test_abandoned_sessions_expire(app, client, login):
+    import main
+    from main import UploadSession, db
+    _, h = login("up")
+    data = os.urandom(500)
+    stale, fresh = _create(client, h, data), _create(client, h, data)
+    _put(client, h, stale, data[:100], 0, len(data))
+    with app.app_context():
+        part = main._session_part(db.session.get(UploadSession, stale))
+        assert os.path.exists(part)
+        old = datetime.utcnow() - timedelta(hours=app.config["UPLOAD_SESSION_TTL_HOURS"] + 1)
+        db.session.query(UploadSession).filter_by(id=stale).update({UploadSession.updated_at: old})
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["gc-media"])
+        assert result.exit_code == 0, result.output
+        assert db.session.get(UploadSession, stale) is None
+        assert db.session.get(UploadSession, fresh) is not None
+        assert not os.path.exists(part)
+
+    assert client.get(f"/uploads/sessions/{stale}", headers=h).status_code == 404
+    assert _put(client, h, stale, data[100:], 100, len(data)).status_code == 404
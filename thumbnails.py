@@ -0,0 +1,230 @@
+"""
+Уменьшенные копии фотографий для ?w= в /uploads.
+
+Варианты фиксированной ширины (THUMB_WIDTHS) в JPEG и WebP создаются в
+фоне сразу после загрузки, а для остальных файлов — лениво при первом
+запросе. Лежат в отдельной папке-кэше с ограничением по размеру:
+при переполнении удаляются давно не запрошенные (по mtime, который
+обновляется при каждой отдаче).
+
+С удалённым хранилищем (store.remote) готовый вариант кладётся в бакет
+рядом с оригиналом (store.thumb_key), а локальная копия удаляется.
+
+Без Pillow модуль выключен (enabled = False) и отдаются оригиналы.
+"""
+import bisect
+import contextlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow опционален
+    Image = None
+
+IMAGE_EXTS = {"jpg", "jpeg", "png", "webp"}
+FORMATS = {"jpg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+MAX_PIXELS = 50_000_000
+
+
+class Thumbnailer:
+    def __init__(self, store, cache_dir, widths=(160, 480, 1080), max_bytes=512 << 20,
+                 quality=80, workers=2):
+        self.store = store
+        self.cache_dir = cache_dir
+        self.widths = sorted(widths)
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.workers = workers
+        self.enabled = Image is not None
+        self._executor = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._pending = set()        # имена, для которых render_all уже в очереди
+        self._size = None            # байт в кэше; None — ещё не считали
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+            Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+    @staticmethod
+    def is_image(name):
+        return name.rsplit(".", 1)[-1].lower() in IMAGE_EXTS
+
+    def snap_width(self, w):
+        """Ближайшая фиксированная ширина не меньше запрошенной."""
+        i = bisect.bisect_left(self.widths, w)
+        return self.widths[min(i, len(self.widths) - 1)]
+
+    @staticmethod
+    def _variant_rel(name, width, fmt):
+        stem = name.rsplit(".", 1)[0]
+        return f"{stem[:2]}/{stem}.w{width}.{fmt}"
+
+    def _variant_path(self, name, width, fmt):
+        return os.path.join(self.cache_dir, *self._variant_rel(name, width, fmt).split("/"))
+
+    def variant_key(self, name, width, fmt="jpg"):
+        """Ключ варианта в удалённом хранилище (ширина округляется как в get)."""
+        return self.store.thumb_key(self._variant_rel(name, self.snap_width(width), fmt))
+
+    def _have(self, name, width, fmt, path):
+        if self.store.remote:
+            return self.store.head(self.store.thumb_key(self._variant_rel(name, width, fmt)))
+        return os.path.exists(path)
+
+    def get(self, name, width, fmt="jpg"):
+        """
+        Путь к варианту (создаётся при необходимости) и mimetype;
+        None, если вариант сделать нельзя (нет Pillow, не картинка, битый файл).
+        """
+        if not self.enabled or fmt not in FORMATS or not self.is_image(name):
+            return None
+        width = self.snap_width(width)
+        path = self._variant_path(name, width, fmt)
+        try:
+            os.utime(path)
+            return path, FORMATS[fmt][1]
+        except FileNotFoundError:
+            pass
+        if not self._render(name, width, fmt, path):
+            return None
+        return path, FORMATS[fmt][1]
+
+    def _render(self, name, width, fmt, path, src=None):
+        key = (name, width, fmt)
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                if self._have(name, width, fmt, path):
+                    return True
+                copy = contextlib.nullcontext(src) if src else self.store.local_copy(name)
+                with copy as src:
+                    if src is None or not self._write_variant(src, width, fmt, path):
+                        return False
+                if self.store.remote:
+                    try:
+                        self.store.put_file(self.store.thumb_key(self._variant_rel(name, width, fmt)),
+                                            path, FORMATS[fmt][1])
+                    finally:
+                        os.unlink(path)
+                else:
+                    self._account(os.path.getsize(path))
+                return True
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def _write_variant(self, src, width, fmt, path):
+        tmp = None
+        try:
+            with Image.open(src) as img:
+                img.draft("RGB", (width, width * 4))     # JPEG декодируется сразу уменьшенным
+                img = ImageOps.exif_transpose(img)
+                if img.mode not in ("RGB", "L"):
+                    img = img.convert("RGB")
+                if img.width > width:
+                    height = max(1, round(img.height * width / img.width))
+                    img = img.resize((width, height), Image.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, "wb") as out:
+                    img.save(out, FORMATS[fmt][0], quality=self.quality, optimize=True)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logging.warning("[THUMBS] %s -> w%d.%s failed: %s", src, width, fmt, e)
+            if tmp is not None and os.path.exists(tmp):
+                os.unlink(tmp)
+            return False
+        os.replace(tmp, path)
+        return True
+
+    def render_all(self, name):
+        """Все фиксированные варианты файла (вызывается в фоне после загрузки)."""
+        missing = [(width, fmt, self._variant_path(name, width, fmt))
+                   for width in self.widths for fmt in FORMATS]
+        missing = [v for v in missing if not self._have(name, *v)]
+        if not missing:
+            return
+        with self.store.local_copy(name) as src:     # из бакета — скачивается один раз
+            if src is None:
+                return
+            for width, fmt, path in missing:
+                if not self._render(name, width, fmt, path, src):
+                    return
+
+    def _render_pending(self, name):
+        try:
+            self.render_all(name)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def submit(self, name):
+        """Поставить render_all в очередь; повторный вызов до его окончания ничего не делает."""
+        if not self.enabled or not self.is_image(name):
+            return
+        with self._lock:
+            if self._stopped or name in self._pending:
+                return
+            self._pending.add(name)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="thumbs")
+        self._executor.submit(self._render_pending, name)
+
+    # --- ограничение размера кэша ---
+
+    def _scan(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for n in names:
+                p = os.path.join(root, n)
+                try:
+                    st = os.stat(p)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    def _account(self, added):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += added
+            if self._size <= self.max_bytes:
+                return
+            self.evict()
+
+    def evict(self, target=None):
+        """Удалить самые давно запрошенные варианты, пока кэш не станет меньше target."""
+        target = int(self.max_bytes * 0.9) if target is None else target
+        files = sorted(self._scan())
+        total = sum(size for _, size, _ in files)
+        started = time.monotonic()
+        for _, size, p in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(p)
+                total -= size
+            except FileNotFoundError:
+                pass
+        self._size = total
+        logging.info("[THUMBS] evicted down to %d bytes in %.1f ms",
+                     total, (time.monotonic() - started) * 1000)
+        return total
+
+    def shutdown(self):
+        """Остановить фон при завершении воркера: очередь отбрасывается (варианты
+        создадутся лениво при запросе), последующие submit ничего не делают."""
+        with self._lock:
+            self._stopped = True
+            pool = self._executor
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,115 @@
+"""
+Компактное представление трека: фиксированная точка + дельты + varint.
+
+Точка — (lat, lon, ts): lat/lon в градусах, ts — unix-время в секундах.
+Координаты хранятся как целые микроградусы (~0.1 м), время — миллисекунды.
+Каждая точка кодируется разностью с предыдущей (zigzag varint), поэтому
+соседние GPS-фиксы занимают по 4–7 байт.
+
+Формат: байт версии, varint количества точек, далее тройки дельт.
+pack()/unpack() — то же самое, сжатое zlib: так хранятся запечатанные маршруты.
+"""
+import math
+import zlib
+
+VERSION = 1
+COORD_SCALE = 1_000_000
+TIME_SCALE = 1000
+
+
+class TrackCodecError(ValueError):
+    pass
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, pos):
+    shift = result = 0
+    while True:
+        if pos >= len(data):
+            raise TrackCodecError("truncated varint")
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift > 70:
+            raise TrackCodecError("varint too long")
+
+
+def encode(points):
+    """[(lat, lon, ts), ...] -> bytes."""
+    out = bytearray([VERSION])
+    _put_varint(out, len(points))
+    plat = plon = pts = 0
+    for lat, lon, ts in points:
+        ilat = int(round(lat * COORD_SCALE))
+        ilon = int(round(lon * COORD_SCALE))
+        its = int(round(ts * TIME_SCALE))
+        _put_varint(out, _zigzag(ilat - plat))
+        _put_varint(out, _zigzag(ilon - plon))
+        _put_varint(out, _zigzag(its - pts))
+        plat, plon, pts = ilat, ilon, its
+    return bytes(out)
+
+
+def decode(data):
+    """bytes -> [(lat, lon, ts), ...]."""
+    if not data or data[0] != VERSION:
+        raise TrackCodecError("unknown track format")
+    count, pos = _get_varint(data, 1)
+    points = []
+    ilat = ilon = its = 0
+    for _ in range(count):
+        d, pos = _get_varint(data, pos)
+        ilat += _unzigzag(d)
+        d, pos = _get_varint(data, pos)
+        ilon += _unzigzag(d)
+        d, pos = _get_varint(data, pos)
+        its += _unzigzag(d)
+        points.append((ilat / COORD_SCALE, ilon / COORD_SCALE, its / TIME_SCALE))
+    if pos != len(data):
+        raise TrackCodecError("trailing bytes")
+    return points
+
+
+def pack(points, level=6):
+    return zlib.compress(encode(points), level)
+
+
+def unpack(blob):
+    try:
+        return decode(zlib.decompress(blob))
+    except zlib.error as e:
+        raise TrackCodecError(str(e)) from None
+
+
+def packed_count(blob):
+    """Число точек в pack()-блобе; распаковывается только заголовок."""
+    try:
+        head = zlib.decompressobj().decompress(blob, 16)
+    except zlib.error as e:
+        raise TrackCodecError(str(e)) from None
+    if not head or head[0] != VERSION:
+        raise TrackCodecError("unknown track format")
+    return _get_varint(head, 1)[0]
+
+
+def valid_point(lat, lon):
+    return (isinstance(lat, (int, float)) and isinstance(lon, (int, float))
+            and math.isfinite(lat) and math.isfinite(lon)
+            and -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0)